@@ -2,13 +2,15 @@ from .manager import CampaignManager
 from .runner import SimulationRunner
 from .parallelrunner import ParallelRunner
 from .lptrunner import LptRunner
+from .asyncrunner import AsyncRunner
 from .gridrunner import BUILD_GRID_PARAMS, SIMULATION_GRID_PARAMS
 from .database import DatabaseManager
-from .utils import list_param_combinations, automatic_parser, stdout_automatic_parser, only_load_some_files, CallbackBase
+from .utils import list_param_combinations, iter_param_combinations, Constraint, automatic_parser, stdout_automatic_parser, only_load_some_files, CallbackBase
 from .cli import cli
 
 __all__ = ('CampaignManager', 'SimulationRunner', 'ParallelRunner', 'LptRunner',
-           'DatabaseManager', 'list_param_combinations', 'automatic_parser',
+           'AsyncRunner', 'DatabaseManager', 'list_param_combinations',
+           'iter_param_combinations', 'Constraint', 'automatic_parser',
            'only_load_some_files', 'CallbackBase')
 
 name = 'sem'
@@ -0,0 +1,140 @@
+from .runner import SimulationRunner
+from .utils import CallbackBase
+import asyncio
+import os
+import threading
+import time
+# Simulations are launched as asyncio subprocesses: a single thread can wait
+# for any number of them, and the event loop stays free for other work.
+
+
+class AsyncRunner(SimulationRunner):
+    """
+    A Runner which can perform simulations in parallel on the current machine,
+    from an asyncio event loop.
+
+    At most max_parallel_processes simulations (or as many as the available
+    CPUs, if it is None) run at the same time, as bounded by a semaphore. The
+    run_simulations_async method yields results as an asynchronous iterator,
+    while run_simulations can be used like the one of any other runner, and
+    runs its own event loop in a separate thread, so that it also works when
+    called from a thread that is already running an event loop (for
+    instance, in a Jupyter notebook).
+    """
+
+    def run_simulations(self, parameter_list, data_folder,
+                        callbacks: [CallbackBase] = None,
+                        stop_on_errors=False):
+        """
+        This function runs multiple simulations in parallel, in a new event
+        loop running in a separate thread.
+
+        Args:
+            parameter_list (list): list of parameter combinations to simulate.
+            data_folder (str): folder in which to create output folders.
+            callbacks (list): list of callbacks to be triggered
+            stop_on_errors (bool): check whether simulation has to stop on errors or not
+        """
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        results = self.run_simulations_async(parameter_list, data_folder,
+                                             callbacks, stop_on_errors)
+
+        async def get_next_result():
+            return await results.__anext__()
+
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(
+                        get_next_result(), loop).result()
+                except StopAsyncIteration:
+                    break
+        finally:
+            # Stop the simulations that are still running
+            asyncio.run_coroutine_threadsafe(results.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    async def run_simulations_async(self, parameter_list, data_folder,
+                                    callbacks: [CallbackBase] = None,
+                                    stop_on_errors=False):
+        """
+        This function runs multiple simulations in parallel, yielding results
+        as an asynchronous iterator, in the order in which simulations end.
+
+        If the iteration is interrupted, or a simulation fails and
+        stop_on_errors is True, simulations that are still running are
+        killed.
+
+        Args:
+            parameter_list (list): list of parameter combinations to simulate.
+            data_folder (str): folder in which to create output folders.
+            callbacks (list): list of callbacks to be triggered
+            stop_on_errors (bool): check whether simulation has to stop on errors or not
+        """
+        parameter_list = list(parameter_list)
+
+        if callbacks is not None:
+            for cb in callbacks:
+                cb.on_simulation_start(len(parameter_list))
+                cb.controlled_by_parent = True
+
+        semaphore = asyncio.BoundedSemaphore(self.max_parallel_processes or
+                                             os.cpu_count())
+        tasks = [asyncio.ensure_future(self.launch_simulation_async(
+            parameter, data_folder, semaphore, callbacks, stop_on_errors))
+            for parameter in parameter_list]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if callbacks is not None:
+            for cb in callbacks:
+                cb.on_simulation_end()
+
+    async def launch_simulation_async(self, parameter, data_folder, semaphore,
+                                      callbacks, stop_on_errors):
+        """
+        Launch a single simulation as an asyncio subprocess, as soon as the
+        semaphore allows it.
+
+        Args:
+            parameter (dict): the parameter combination to simulate.
+        """
+        async with semaphore:
+            current_result, command, temp_dir = self.prepare_simulation(
+                parameter, data_folder)
+            sim_uuid = current_result['meta']['id']
+
+            if callbacks is not None:
+                for cb in callbacks:
+                    cb.on_run_start(parameter, sim_uuid)
+
+            start = time.time()  # Time execution
+            with open(os.path.join(temp_dir, 'stdout'), 'w') as stdout_file, open(
+                    os.path.join(temp_dir, 'stderr'), 'w') as stderr_file:
+                process = await asyncio.create_subprocess_exec(
+                    *command, cwd=temp_dir, env=self.environment,
+                    stdout=stdout_file, stderr=stderr_file)
+                try:
+                    return_code = await process.wait()
+                except asyncio.CancelledError:
+                    process.kill()
+                    await process.wait()
+                    raise
+            end = time.time()  # Time execution
+
+            if callbacks is not None:
+                for cb in callbacks:
+                    cb.on_run_end(sim_uuid, return_code, end - start)
+
+        self.finalize_simulation(current_result, temp_dir, return_code,
+                                 end - start, stop_on_errors)
+        return current_result
@@ -0,0 +1,672 @@
+import os
+import copy
+import json
+import sqlite3
+import collections
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+from tinydb.middlewares import CachingMiddleware
+from .utils import get_combination_key, get_hashable_value
+
+# These variables control the journal of the TinyDB backend.
+# JOURNAL_FSYNC can be 'always' (sync the journal to disk after each
+# operation), 'flush' (sync it when the database is written to disk) or
+# 'never' (leave it to the operating system).
+# JOURNAL_COMPACTION_SIZE is the size in bytes over which writing the
+# database to disk also compacts the journal into the JSON file.
+JOURNAL_FSYNC = 'flush'
+JOURNAL_COMPACTION_SIZE = 64 * 1024 * 1024
+
+
+class JournalMiddleware(CachingMiddleware):
+    """
+    A TinyDB middleware keeping the database in memory, and saving changes to
+    an append-only journal instead of rewriting the whole JSON file.
+
+    The journal is a file next to the JSON file (with the -journal suffix),
+    containing a header line and one JSON line for each operation that was
+    performed on the database since the JSON file was last written. The JSON
+    file, or snapshot, is only rewritten when the journal is compacted, via
+    the flush method.
+
+    A generation number, saved both in the snapshot and in the journal
+    header, makes sure that a journal is never replayed on a snapshot that
+    already contains its operations, even if compaction is interrupted.
+
+    Files are only modified once the database is: databases that are only
+    read leave both the journal and the snapshot untouched.
+    """
+
+    def __init__(self, storage_cls):
+        CachingMiddleware.__init__(self, storage_cls)
+        # The snapshot is only written on compaction
+        self.WRITE_CACHE_SIZE = float('inf')
+        self.journal = None
+        # Size of the valid part of the journal, as found by read_journal
+        self.journal_size = 0
+
+    def __call__(self, path, *args, **kwargs):
+        self.journal_path = '%s-journal' % path
+        return CachingMiddleware.__call__(self, path, *args, **kwargs)
+
+    def get_generation(self):
+        return (self.read() or {}).get('journal', {}).get(
+            '1', {}).get('generation', 0)
+
+    def read_journal(self):
+        """
+        Yield the operations saved in the journal, as [name, arguments]
+        lists.
+
+        Journals left over by an interrupted compaction, and incomplete lines
+        left over by an interrupted write, are ignored, and discarded when
+        the journal is first written to (see open_journal).
+        """
+        generation = self.get_generation()
+        valid_size = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as journal:
+                header = journal.readline()
+                try:
+                    current = json.loads(header)['generation'] == generation
+                except (ValueError, KeyError, TypeError):
+                    current = False
+                if current:
+                    valid_size = len(header)
+                    for line in journal:
+                        try:
+                            operation = json.loads(line)
+                        except ValueError:
+                            break
+                        yield operation
+                        valid_size += len(line)
+        self.journal_size = valid_size
+
+    def open_journal(self):
+        """
+        Open the journal for appending, discarding its invalid parts.
+        """
+        if self.journal_size:
+            with open(self.journal_path, 'r+b') as journal:
+                journal.truncate(self.journal_size)
+            self.journal = open(self.journal_path, 'a')
+        else:
+            self.start_journal(self.get_generation())
+
+    def start_journal(self, generation):
+        """
+        Replace the journal with an empty one for the specified generation.
+        """
+        if self.journal is not None:
+            self.journal.close()
+        temporary_path = '%s.tmp' % self.journal_path
+        with open(temporary_path, 'w') as journal:
+            journal.write('%s\n' % json.dumps({'generation': generation}))
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temporary_path, self.journal_path)
+        self.journal = open(self.journal_path, 'a')
+
+    def append(self, name, *args):
+        """
+        Save an operation to the journal.
+        """
+        # Serialize the whole line first, not to leave incomplete lines
+        # behind in case of errors
+        line = '%s\n' % json.dumps([name, list(args)])
+        if self.journal is None:
+            self.open_journal()
+        self.journal.write(line)
+        if JOURNAL_FSYNC == 'always':
+            self.sync()
+
+    def sync(self):
+        """
+        Make sure the journal is written to disk, and compact it if it grew
+        too large.
+        """
+        if self.journal is None:
+            return
+        self.journal.flush()
+        if JOURNAL_FSYNC != 'never':
+            os.fsync(self.journal.fileno())
+        if self.journal.tell() > JOURNAL_COMPACTION_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Compact the journal, by writing the whole database to the JSON file
+        and starting a new, empty journal, if the database was modified.
+        """
+        if self._cache_modified_count > 0:
+            self.compact()
+
+    def compact(self):
+        """
+        Compact the journal, even if the database was not modified.
+        """
+        generation = self.get_generation() + 1
+        data = self.read() or {}
+        data['journal'] = {'1': {'generation': generation}}
+        self.cache = data
+        self.storage.write(data)
+        self._cache_modified_count = 0
+        self.start_journal(generation)
+
+    def close(self):
+        CachingMiddleware.close(self)
+        if self.journal is not None:
+            self.journal.close()
+
+
+class TinyDBBackend(TinyDB):
+    """
+    A storage backend keeping the whole campaign in a TinyDB JSON file.
+
+    This is the default backend: the database is a single human readable file,
+    which is loaded in memory when the campaign is opened. Changes are saved
+    to an append-only journal (see JournalMiddleware), which is replayed when
+    the database is opened, and periodically compacted into the JSON file.
+
+    Since all results are in memory anyway, this backend also builds some hash
+    indexes when the database is opened, and keeps them up to date as results
+    are inserted and removed:
+
+    * documents: document id -> result dictionary, in insertion order;
+    * ids: result id -> document ids;
+    * combinations: parameter combination key (see
+      sem.utils.get_combination_key) -> document ids;
+    * values: parameter -> parameter value -> document ids.
+
+    This makes lookups by result id and by parameter combination constant
+    time operations, instead of scans of the whole results table.
+    """
+
+    backend_type = 'TinyDB'
+    extension = 'json'
+
+    def __init__(self, filepath):
+        TinyDB.__init__(self, filepath, storage=JournalMiddleware(JSONStorage))
+        self.build_indexes()
+        self.state = {}
+        self.state_ids = {}
+        for document in self.table('state').all():
+            self.state[document['key']] = document['value']
+            self.state_ids[document['key']] = document.doc_id
+
+        # Bring the database up to date, by replaying the journal
+        self.replaying = True
+        for name, args in self.storage.read_journal():
+            getattr(self, name)(*args)
+        self.replaying = False
+        # Replayed operations are already saved
+        self.storage._cache_modified_count = 0
+
+    def log(self, name, *args):
+        """
+        Save an operation to the journal, unless we are replaying it.
+        """
+        if not self.replaying:
+            self.storage.append(name, *args)
+
+    def build_indexes(self):
+        self.documents = {}
+        self.ids = collections.defaultdict(list)
+        self.combinations = collections.defaultdict(list)
+        self.values = collections.defaultdict(
+            lambda: collections.defaultdict(set))
+        for document in self.table('results').all():
+            self.add_to_indexes(document.doc_id, dict(document))
+
+    def add_to_indexes(self, doc_id, result):
+        self.documents[doc_id] = result
+        self.ids[result['meta']['id']].append(doc_id)
+        self.combinations[get_combination_key(result['params'])].append(doc_id)
+        for k, v in result['params'].items():
+            self.values[k][get_hashable_value(v)].add(doc_id)
+
+    def remove_from_indexes(self, doc_id):
+        result = self.documents.pop(doc_id)
+        self.ids[result['meta']['id']].remove(doc_id)
+        if not self.ids[result['meta']['id']]:
+            del self.ids[result['meta']['id']]
+        key = get_combination_key(result['params'])
+        self.combinations[key].remove(doc_id)
+        if not self.combinations[key]:
+            del self.combinations[key]
+        for k, v in result['params'].items():
+            self.values[k][get_hashable_value(v)].discard(doc_id)
+
+    @classmethod
+    def create(cls, filepath, config):
+        """
+        Create a new database file at filepath, containing config.
+        """
+        db = cls(filepath)
+        db.table('config').insert(config)
+        db.compact()
+        return db
+
+    @classmethod
+    def open(cls, filepath):
+        """
+        Open an existing database file.
+        """
+        return cls(filepath)
+
+    def get_config(self):
+        return self.table('config').all()[0]
+
+    def set_config(self, config):
+        self.log('set_config', config)
+        self.table('config').truncate()
+        self.table('config').insert(config)
+
+    def insert_results(self, results):
+        # Save copies, so that the caller can't alter the indexes
+        results = copy.deepcopy(list(results))
+        self.log('insert_results', results)
+        doc_ids = self.table('results').insert_multiple(results)
+        for doc_id, result in zip(doc_ids, results):
+            self.add_to_indexes(doc_id, dict(result))
+
+    def get_all_results(self):
+        return self.get_documents(self.documents.keys())
+
+    def iter_all_results(self):
+        """
+        Return all results without copying them: they must not be modified.
+        """
+        return iter(list(self.documents.values()))
+
+    def get_results_by_id(self, result_id):
+        return self.get_documents(self.ids.get(result_id, []))
+
+    def get_documents(self, doc_ids):
+        # Return copies of the dictionaries the indexes are built from (the
+        # parameters and the metadata), so that the caller can't alter them
+        return [{k: dict(v) if isinstance(v, dict) else v for k, v in
+                 self.documents[i].items()} for i in doc_ids]
+
+    def search_results(self, query_params):
+        """
+        Return the results whose parameters take one of the values listed in
+        query_params, a dictionary of parameter: list-of-values pairs.
+        """
+        if not query_params:
+            return self.get_all_results()
+
+        # If the query fixes all parameters but (possibly) RngRun, we can
+        # directly look up the parameter combination
+        fixed = {k: v[0] for k, v in query_params.items() if len(v) == 1}
+        combination_params = [k for k in self.values.keys() if k != 'RngRun']
+        if combination_params and set(combination_params) <= set(fixed.keys()):
+            doc_ids = self.combinations.get(get_combination_key(fixed), [])
+            if 'RngRun' in query_params:
+                runs = self.values.get('RngRun', {})
+                allowed = set().union(*[runs.get(get_hashable_value(v), set())
+                                        for v in query_params['RngRun']])
+                doc_ids = [i for i in doc_ids if i in allowed]
+            return self.get_documents(doc_ids)
+
+        # Otherwise, intersect the documents matching each parameter,
+        # starting from the smallest set
+        matches = sorted(
+            [set().union(*[self.values.get(k, {}).get(get_hashable_value(v),
+                                                      set())
+                           for v in values])
+             for k, values in query_params.items()], key=len)
+        doc_ids = matches[0].intersection(*matches[1:])
+        return self.get_documents(sorted(doc_ids))
+
+    def search_results_grouped(self, queries):
+        """
+        Return a list containing the results of search_results for each query
+        in queries.
+        """
+        # Thanks to the indexes, each of these searches only touches the
+        # results it returns.
+        return [self.search_results(q) for q in queries]
+
+    def remove_result(self, result_id):
+        self.log('remove_result', result_id)
+        doc_ids = self.ids.get(result_id, [])[:]
+        self.table('results').remove(doc_ids=doc_ids)
+        for doc_id in doc_ids:
+            self.remove_from_indexes(doc_id)
+
+    def drop_results(self):
+        self.log('drop_results')
+        self.drop_table('results')
+        self.build_indexes()
+
+    def get_distinct_values(self, param):
+        """
+        Return the distinct values a parameter takes in the results.
+        """
+        return [self.documents[next(iter(doc_ids))]['params'][param] for
+                doc_ids in self.values.get(param, {}).values() if doc_ids]
+
+    def get_state(self, key, default=None):
+        """
+        Return the value saved under key in the state table, which contains
+        information SEM keeps about the campaign besides its configuration.
+        """
+        return self.state.get(key, default)
+
+    def set_state(self, key, value):
+        """
+        Save a JSON serializable value under key in the state table.
+        """
+        self.log('set_state', key, value)
+        if key in self.state_ids:
+            self.table('state').update({'value': value},
+                                       doc_ids=[self.state_ids[key]])
+        else:
+            self.state_ids[key] = self.table('state').insert({'key': key,
+                                                              'value': value})
+        self.state[key] = value
+
+    def get_state_items(self, prefix):
+        """
+        Return a list of (key, value) pairs, containing the values saved in
+        the state table under keys starting with prefix.
+        """
+        return [(k, v) for k, v in self.state.items() if k.startswith(prefix)]
+
+    def remove_state(self, key):
+        """
+        Remove the value saved under key in the state table, if any.
+        """
+        self.log('remove_state', key)
+        if key in self.state_ids:
+            self.table('state').remove(doc_ids=[self.state_ids.pop(key)])
+        self.state.pop(key, None)
+
+    def flush(self):
+        self.storage.sync()
+
+    def compact(self):
+        self.storage.compact()
+
+
+class SQLiteBackend(object):
+    """
+    A storage backend keeping the campaign in an SQLite database.
+
+    Every parameter and the result metadata are stored in dedicated, indexed
+    columns, so that queries do not need to go through all the results, and
+    inserting new results does not require rewriting the whole database.
+    The complete result dictionary is also saved as JSON, so that results are
+    returned exactly as they were inserted.
+    """
+
+    backend_type = 'SQLite'
+    extension = 'sqlite'
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.columns = {k: quote('param:%s' % k) for k in
+                        list(self.get_config()['params'].keys()) + ['RngRun']}
+
+    @classmethod
+    def create(cls, filepath, config):
+        """
+        Create a new database file at filepath, containing config.
+        """
+        connection = cls.connect(filepath)
+        columns = [quote('param:%s' % k) for k in
+                   list(config['params'].keys()) + ['RngRun']]
+        with connection:
+            connection.execute(
+                'CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute(
+                'CREATE TABLE state (key TEXT PRIMARY KEY, value TEXT)')
+            connection.executemany(
+                'INSERT INTO config VALUES (?, ?)',
+                [(k, json.dumps(v)) for k, v in config.items()])
+            # Parameter columns have no declared type, so that values are
+            # stored without being converted.
+            connection.execute(
+                'CREATE TABLE results (doc INTEGER PRIMARY KEY, id TEXT, '
+                'elapsed_time REAL, exitcode INTEGER, result TEXT, %s)' %
+                ', '.join(columns))
+            connection.execute('CREATE INDEX results_id ON results (id)')
+            for idx, column in enumerate(columns):
+                connection.execute('CREATE INDEX results_param_%s ON results '
+                                   '(%s)' % (idx, column))
+            # A composite index allows lookups of complete parameter
+            # combinations, with RngRun last.
+            connection.execute('CREATE INDEX results_params ON results (%s)' %
+                               ', '.join(columns))
+        return cls(connection)
+
+    @classmethod
+    def open(cls, filepath):
+        """
+        Open an existing database file.
+        """
+        return cls(cls.connect(filepath))
+
+    @staticmethod
+    def connect(filepath):
+        # The connection can be used from other threads (for instance, by
+        # CampaignManager.run_missing_simulations_async), as long as it is
+        # not used by two threads at the same time
+        connection = sqlite3.connect(filepath, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def get_config(self):
+        return {k: json.loads(v) for k, v in
+                self.connection.execute('SELECT key, value FROM config')}
+
+    def set_config(self, config):
+        with self.connection:
+            self.connection.execute('DELETE FROM config')
+            self.connection.executemany(
+                'INSERT INTO config VALUES (?, ?)',
+                [(k, json.dumps(v)) for k, v in config.items()])
+
+    def insert_results(self, results):
+        rows = []
+        for result in results:
+            rows.append([result['meta'].get('id'),
+                         result['meta'].get('elapsed_time'),
+                         result['meta'].get('exitcode'),
+                         json.dumps(result)] +
+                        [to_column_value(result['params'][k]) for k in
+                         self.columns.keys()])
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO results (id, elapsed_time, exitcode, result, %s) '
+                'VALUES (%s)' % (', '.join(self.columns.values()),
+                                 ', '.join(['?'] * (len(self.columns) + 4))),
+                rows)
+
+    def get_all_results(self):
+        return self.select('')
+
+    def iter_all_results(self):
+        """
+        Return all results. Since they are decoded from the database, they
+        are copies anyway.
+        """
+        return iter(self.get_all_results())
+
+    def get_results_by_id(self, result_id):
+        return self.select('WHERE id = ?', [result_id])
+
+    def search_results(self, query_params):
+        """
+        Return the results whose parameters take one of the values listed in
+        query_params, a dictionary of parameter: list-of-values pairs.
+        """
+        if not query_params:
+            return self.get_all_results()
+
+        conditions = []
+        arguments = []
+        for key, values in query_params.items():
+            column = self.columns[key]
+            alternatives = []
+            not_none = [to_column_value(v) for v in values if v is not None]
+            if not_none:
+                alternatives.append('%s IN (%s)' % (
+                    column, ', '.join(['?'] * len(not_none))))
+                arguments += not_none
+            if len(not_none) < len(values):
+                alternatives.append('%s IS NULL' % column)
+            conditions.append('(%s)' % (' OR '.join(alternatives) or '0'))
+        return self.select('WHERE %s' % ' AND '.join(conditions), arguments)
+
+    def search_results_grouped(self, queries):
+        """
+        Return a list containing the results of search_results for each query
+        in queries.
+
+        Queries that fix a single value for each parameter (except, possibly,
+        RngRun) are answered together, by joining a temporary table
+        containing all of them with the results table. Other queries are
+        performed one by one.
+        """
+        grouped = [[] for _ in queries]
+        combination_columns = [k for k in self.columns.keys() if k != 'RngRun']
+        rows = []
+        for idx, query in enumerate(queries):
+            if (set(query.keys()) - set(['RngRun']) ==
+                    set(combination_columns) and
+                    all(len(v) == 1 for v in query.values()) and
+                    query.get('RngRun', [0])[0] is not None):
+                rows.append([idx] + [to_column_value(query[k][0]) for k in
+                                     combination_columns] +
+                            [to_column_value(query['RngRun'][0]) if 'RngRun'
+                             in query else None])
+            else:
+                grouped[idx] = self.search_results(query)
+
+        if rows:
+            columns = [self.columns[k] for k in combination_columns]
+            # The temporary table is dropped even if the query fails, so that
+            # it can be created again by the next call
+            try:
+                with self.connection:
+                    self.connection.execute(
+                        'CREATE TEMP TABLE queries (%s)' %
+                        ', '.join(['idx INTEGER'] + columns + ['run']))
+                    self.connection.executemany(
+                        'INSERT INTO queries VALUES (%s)' %
+                        ', '.join(['?'] * (len(columns) + 2)), rows)
+                    joined = self.connection.execute(
+                        'SELECT queries.idx, results.result FROM queries '
+                        'JOIN results ON %s AND (queries.run IS NULL OR '
+                        'results.%s = queries.run) '
+                        'ORDER BY queries.idx, results.doc' % (
+                            ' AND '.join(['results.%s IS queries.%s' % (c, c)
+                                          for c in columns] or ['1']),
+                            self.columns['RngRun'])).fetchall()
+            finally:
+                self.connection.execute('DROP TABLE IF EXISTS queries')
+            for idx, result in joined:
+                grouped[idx].append(json.loads(result))
+        return grouped
+
+    def select(self, condition, arguments=()):
+        return [json.loads(r) for (r,) in self.connection.execute(
+            'SELECT result FROM results %s ORDER BY doc' % condition,
+            arguments)]
+
+    def remove_result(self, result_id):
+        with self.connection:
+            self.connection.execute('DELETE FROM results WHERE id = ?',
+                                    [result_id])
+
+    def drop_results(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM results')
+
+    def get_distinct_values(self, param):
+        """
+        Return the distinct values a parameter takes in the results.
+        """
+        # Columns hold booleans as integers, and lists and dictionaries as
+        # JSON strings: values are read from the first result taking each of
+        # them instead
+        return [json.loads(r)['params'][param] for (r,) in
+                self.connection.execute(
+                    'SELECT result FROM results WHERE doc IN (SELECT MIN(doc) '
+                    'FROM results GROUP BY %s) ORDER BY doc' %
+                    self.columns[param])]
+
+    def get_state(self, key, default=None):
+        """
+        Return the value saved under key in the state table, which contains
+        information SEM keeps about the campaign besides its configuration.
+        """
+        row = self.connection.execute('SELECT value FROM state WHERE key = ?',
+                                      [key]).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set_state(self, key, value):
+        """
+        Save a JSON serializable value under key in the state table.
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO state VALUES (?, ?)',
+                [key, json.dumps(value)])
+
+    def get_state_items(self, prefix):
+        """
+        Return a list of (key, value) pairs, containing the values saved in
+        the state table under keys starting with prefix.
+        """
+        # Keys starting with prefix sort between prefix and the string
+        # following all of them, so that the primary key index can be used
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return [(key, json.loads(value)) for key, value in
+                self.connection.execute(
+                    'SELECT key, value FROM state WHERE key >= ? AND key < ?',
+                    [prefix, end])]
+
+    def remove_state(self, key):
+        """
+        Remove the value saved under key in the state table, if any.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM state WHERE key = ?', [key])
+
+    def flush(self):
+        self.connection.commit()
+
+    def compact(self):
+        self.connection.commit()
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        self.connection.close()
+
+
+def quote(identifier):
+    """
+    Quote an SQL identifier, so that any parameter name can be a column name.
+    """
+    return '"%s"' % identifier.replace('"', '""')
+
+
+def to_column_value(value):
+    """
+    Convert a parameter value to a value that can be stored in an SQLite
+    column. Values SQLite cannot represent are stored as their JSON encoding.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+# Available backends, by name
+BACKENDS = {
+    'TinyDB': TinyDBBackend,
+    'SQLite': SQLiteBackend,
+}
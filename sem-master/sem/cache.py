@@ -0,0 +1,263 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import types
+
+# Maximum size, in bytes, of the parsed results kept in the cache of a
+# campaign. When this size is exceeded, the least recently used results are
+# evicted.
+CACHE_SIZE = 1024 * 1024 * 1024
+
+# Values of global variables of these types are included in the fingerprint
+# of a parsing function, since they may affect its output.
+FINGERPRINT_VALUE_TYPES = (bool, int, float, complex, str, bytes, tuple,
+                           list, dict, set, frozenset, type(None))
+
+
+def get_function_fingerprint(function, **options):
+    """
+    Return a string that identifies a result parsing function and the options
+    it is called with.
+
+    The fingerprint is computed from the bytecode and constants of the
+    function, its default arguments, the variables it closes over, the
+    attributes set by decorators (e.g., the output labels), and the values of
+    the simple global variables it references. Functions called by the
+    parsing function are included recursively, so that editing any of them
+    changes the fingerprint.
+    """
+    digest = hashlib.sha1()
+    update_fingerprint(digest, function, set())
+    digest.update(repr(sorted(options.items())).encode())
+    return digest.hexdigest()
+
+
+def update_fingerprint(digest, value, seen):
+    """
+    Feed the description of a value into a hashlib digest.
+    """
+    if isinstance(value, (functools.partial, types.FunctionType)):
+        # Functions may reference each other
+        if id(value) in seen:
+            digest.update(b'seen')
+            return
+        seen.add(id(value))
+
+    if isinstance(value, functools.partial):
+        digest.update(b'partial')
+        update_fingerprint(digest, value.func, seen)
+        for argument in value.args:
+            update_fingerprint(digest, argument, seen)
+        for key, argument in sorted(value.keywords.items()):
+            digest.update(key.encode())
+            update_fingerprint(digest, argument, seen)
+    elif isinstance(value, types.MethodType):
+        digest.update(type(value.__self__).__qualname__.encode())
+        update_fingerprint(digest, value.__func__, seen)
+    elif isinstance(value, types.FunctionType):
+        digest.update(value.__qualname__.encode())
+        update_code_fingerprint(digest, value.__code__)
+        for default in (value.__defaults__ or ()):
+            update_fingerprint(digest, default, seen)
+        for key, default in sorted((value.__kwdefaults__ or {}).items()):
+            digest.update(key.encode())
+            update_fingerprint(digest, default, seen)
+        for cell in (value.__closure__ or ()):
+            try:
+                update_fingerprint(digest, cell.cell_contents, seen)
+            except ValueError:
+                # Empty cell
+                pass
+        # Attributes set by decorators, and the decorated function
+        for key, attribute in sorted(value.__dict__.items()):
+            digest.update(key.encode())
+            update_fingerprint(digest, attribute, seen)
+        for name in get_global_names(value.__code__):
+            if name in value.__globals__:
+                global_value = value.__globals__[name]
+                if isinstance(global_value, (types.FunctionType,
+                                             functools.partial) +
+                              FINGERPRINT_VALUE_TYPES):
+                    digest.update(name.encode())
+                    update_fingerprint(digest, global_value, seen)
+    elif isinstance(value, types.ModuleType):
+        digest.update(value.__name__.encode())
+    else:
+        digest.update(repr(value).encode())
+
+
+def update_code_fingerprint(digest, code):
+    """
+    Feed a code object, including the code of nested functions, into a
+    hashlib digest.
+    """
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            update_code_fingerprint(digest, constant)
+        else:
+            digest.update(repr(constant).encode())
+
+
+def get_global_names(code):
+    """
+    Return the names referenced by a code object and its nested functions.
+    """
+    names = list(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names += get_global_names(constant)
+    return sorted(set(names))
+
+
+class ResultCache(object):
+    """
+    On-disk cache of parsed results, kept in the campaign directory.
+
+    Parsed results are identified by the fingerprint of the parsing function
+    (see get_function_fingerprint) and by the id of the result they were
+    obtained from, and are stored in an SQLite database. The total size of
+    the cache is bounded by CACHE_SIZE, evicting the least recently used
+    parsed results first.
+    """
+
+    # Maximum number of variables in an SQLite query
+    BATCH_SIZE = 500
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_dir,
+                                                       'parsed.sqlite'))
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS parsed ('
+                'fingerprint TEXT, id TEXT, output BLOB, size INTEGER, '
+                'accessed REAL, PRIMARY KEY (fingerprint, id))')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS parsed_id ON parsed (id)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS parsed_accessed '
+                'ON parsed (accessed)')
+
+    def get_outputs(self, fingerprint, result_ids):
+        """
+        Return a dictionary of result_id: parsed_output pairs, containing the
+        cached outputs of the specified results.
+        """
+        outputs = {}
+        result_ids = list(result_ids)
+        now = time.time()
+        with self.connection:
+            for start in range(0, len(result_ids), self.BATCH_SIZE):
+                batch = result_ids[start:start + self.BATCH_SIZE]
+                condition = 'fingerprint = ? AND id IN (%s)' % ', '.join(
+                    '?' * len(batch))
+                for result_id, output in self.connection.execute(
+                        'SELECT id, output FROM parsed WHERE %s' % condition,
+                        [fingerprint] + batch):
+                    outputs[result_id] = pickle.loads(output)
+                self.connection.execute(
+                    'UPDATE parsed SET accessed = ? WHERE %s' % condition,
+                    [now, fingerprint] + batch)
+        return outputs
+
+    def set_outputs(self, fingerprint, outputs):
+        """
+        Save a dictionary of result_id: parsed_output pairs to the cache.
+
+        Outputs that cannot be pickled are not cached.
+        """
+        now = time.time()
+        rows = []
+        for result_id, output in outputs.items():
+            try:
+                output = pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                continue
+            rows.append((fingerprint, result_id, output, len(output), now))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?, ?)', rows)
+        self.evict()
+
+    def evict(self, size=None):
+        """
+        Remove the least recently used outputs until the size of the cache
+        is below the specified size, or CACHE_SIZE.
+        """
+        if size is None:
+            size = CACHE_SIZE
+        excess = (self.connection.execute(
+            'SELECT TOTAL(size) FROM parsed').fetchone()[0] - size)
+        if excess <= 0:
+            return
+        evicted = []
+        for rowid, output_size in self.connection.execute(
+                'SELECT rowid, size FROM parsed ORDER BY accessed, rowid'):
+            evicted.append((rowid,))
+            excess -= output_size
+            if excess <= 0:
+                break
+        with self.connection:
+            self.connection.executemany('DELETE FROM parsed WHERE rowid = ?',
+                                        evicted)
+
+    def remove_results(self, result_ids):
+        """
+        Remove the cached outputs of the specified results.
+        """
+        with self.connection:
+            self.connection.executemany('DELETE FROM parsed WHERE id = ?',
+                                        [(i,) for i in result_ids])
+
+    def clear(self):
+        """
+        Remove all cached outputs.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM parsed')
+        self.connection.execute('VACUUM')
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedParsingFunction(object):
+    """
+    Wrapper of a result parsing function, that returns previously parsed
+    outputs when available and keeps track of newly parsed outputs.
+
+    Previously parsed outputs are either saved in the result itself (see
+    CampaignManager.run_simulations), or, if a cache is specified, in the
+    cache. Use the save method to write newly parsed outputs to the cache.
+    """
+
+    def __init__(self, function, fingerprint, cache=None, result_ids=()):
+        self.function = function
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self.outputs = {}
+        if cache is not None:
+            self.outputs = cache.get_outputs(fingerprint, result_ids)
+        self.new_outputs = {}
+
+    def __call__(self, result):
+        result_id = result['meta']['id']
+        if result.get('parsed', {}).get('function') == self.fingerprint:
+            return result['parsed']['output']
+        if self.cache is None:
+            return self.function(result)
+        if result_id not in self.outputs:
+            output = self.function(result)
+            self.outputs[result_id] = output
+            self.new_outputs[result_id] = output
+        return self.outputs[result_id]
+
+    def save(self):
+        if self.cache is not None:
+            self.cache.set_outputs(self.fingerprint, self.new_outputs)
+        self.new_outputs = {}
@@ -5,10 +5,7 @@ import pprint
 import collections
 import os
 import re
-import glob
 import shutil
-from tinydb import TinyDB
-from tinydb.table import Document
 
 
 @click.group()
@@ -39,7 +36,28 @@ def cli():
               is_flag=True,
               show_default=True,
               help="Whether to avoid optimization of the build")
-def build(ns_3_path, results_dir, script, no_optimization):
+@click.option("--backend-type",
+              type=click.Choice(['TinyDB', 'SQLite']),
+              default='TinyDB',
+              show_default=True,
+              help="The storage backend to use for the campaign database")
+@click.option("--data-layout",
+              type=click.Choice(sem.utils.DATA_LAYOUTS),
+              default='flat',
+              show_default=True,
+              help="The layout of the folder containing simulation outputs")
+@click.option("--output-store",
+              type=click.Choice(['directories', 'segments']),
+              default='directories',
+              show_default=True,
+              help="Whether to keep simulation outputs in their own "
+              "directories or to pack them in segment files")
+@click.option("--compression",
+              type=click.Choice(list(sem.store.COMPRESSION_SUFFIXES)),
+              default=None,
+              help="The algorithm used to compress simulation outputs")
+def build(ns_3_path, results_dir, script, no_optimization, backend_type,
+          data_layout, output_store, compression):
     """
     Run multiple simulations.
     """
@@ -49,7 +67,11 @@ def build(ns_3_path, results_dir, script, no_optimization):
                                        script,
                                        results_dir,
                                        overwrite=False,
-                                       optimized=not no_optimization)
+                                       optimized=not no_optimization,
+                                       backend_type=backend_type,
+                                       data_layout=data_layout,
+                                       output_store=output_store,
+                                       compression=compression)
 
     # Print campaign info
     click.echo(campaign)
@@ -98,8 +120,29 @@ def build(ns_3_path, results_dir, script, no_optimization):
               is_flag=True,
               show_default=True,
               help="Avoid ensuring the ns-3 repository is clean -- use with caution")
+@click.option("--backend-type",
+              type=click.Choice(['TinyDB', 'SQLite']),
+              default='TinyDB',
+              show_default=True,
+              help="The storage backend to use for the campaign database")
+@click.option("--data-layout",
+              type=click.Choice(sem.utils.DATA_LAYOUTS),
+              default='flat',
+              show_default=True,
+              help="The layout of the folder containing simulation outputs")
+@click.option("--output-store",
+              type=click.Choice(['directories', 'segments']),
+              default='directories',
+              show_default=True,
+              help="Whether to keep simulation outputs in their own "
+              "directories or to pack them in segment files")
+@click.option("--compression",
+              type=click.Choice(list(sem.store.COMPRESSION_SUFFIXES)),
+              default=None,
+              help="The algorithm used to compress simulation outputs")
 def run(ns_3_path, results_dir, script, no_optimization, parameters,
-        max_processes, runner_type, skip_repo_check):
+        max_processes, runner_type, skip_repo_check, backend_type,
+        data_layout, output_store, compression):
     """
     Run multiple simulations.
     """
@@ -112,7 +155,11 @@ def run(ns_3_path, results_dir, script, no_optimization, parameters,
                                        optimized=not no_optimization,
                                        runner_type=runner_type,
                                        check_repo=skip_repo_check,
-                                       max_parallel_processes=max_processes)
+                                       max_parallel_processes=max_processes,
+                                       backend_type=backend_type,
+                                       data_layout=data_layout,
+                                       output_store=output_store,
+                                       compression=compression)
 
     # Print campaign info
     click.echo(campaign)
@@ -183,12 +230,19 @@ def view(results_dir, result_id, hide_simulation_output, parameters, no_pager):
     if hide_simulation_output:
         get_results_function = campaign.db.get_results
     else:
-        get_results_function = campaign.db.get_complete_results
+        get_results_function = campaign.db.iter_complete_results
+
+    def format_results(results):
+        # Results are formatted one at a time, so that output files are only
+        # read when the corresponding result is printed
+        for idx, item in enumerate(results):
+            if 'output' in item:
+                item['output'] = dict(item['output'])
+            yield ('\n\n\n' if idx else '') + pprint.pformat(item)
 
     # If a result id was specified, just query for that result
     if result_id:
-        output = '\n\n\n'.join([pprint.pformat(item) for item in
-                                get_results_function(result_id=result_id)])
+        output = format_results(get_results_function(result_id=result_id))
     else:
 
         [params, defaults] = zip(*get_params_and_defaults(
@@ -205,12 +259,13 @@ def view(results_dir, result_id, hide_simulation_output, parameters, no_pager):
             script_params = import_parameters_from_file(parameters)
 
         # Perform the search
-        output = '\n\n\n'.join([pprint.pformat(item) for item in
-                                get_results_function(script_params)])
+        output = format_results(get_results_function(script_params))
 
     # Print the results
     if no_pager:
-        click.echo(output)
+        for chunk in output:
+            click.echo(chunk, nl=False)
+        click.echo()
     else:
         click.echo_via_pager(output)
 
@@ -263,19 +318,29 @@ def command(results_dir, result_id):
               show_default=True,
               help="File containing the parameter specification,"
                    " in form of a python dictionary")
+@click.option("--partition-by",
+              multiple=True,
+              help="Parameter to split Parquet exports by, in subfolders."
+              " Can be specified multiple times")
 @click.argument('filename', type=click.Path(resolve_path=True))
-def export(results_dir, filename, do_not_try_parsing, parameters):
+def export(results_dir, filename, do_not_try_parsing, parameters,
+           partition_by):
     """
     Export results to file.
 
     An extension in filename is required to deduce the file type. If no
     extension is specified, a directory tree export will be used. Note that
-    this command automatically tries to parse the simulation output.
+    this command automatically tries to parse the simulation output. Parquet
+    and Arrow exports contain one row per result, with columns for the
+    parameters and for the (parsed, unless --do-not-try-parsing is
+    specified) contents of stdout and stderr.
 
     Supported extensions:
 
     .mat (Matlab file),
     .npy (Numpy file),
+    .parquet (Parquet file, or folder if --partition-by is used),
+    .arrow (Arrow IPC file),
     no extension (Directory tree)
     """
 
@@ -289,8 +354,10 @@ def export(results_dir, filename, do_not_try_parsing, parameters):
 
     if do_not_try_parsing:
         parsing_function = None
+        table_parsing_function = get_standard_streams
     else:
         parsing_function = sem.utils.automatic_parser
+        table_parsing_function = parse_standard_streams
 
     if not parameters:
         # Convert to string
@@ -308,6 +375,15 @@ def export(results_dir, filename, do_not_try_parsing, parameters):
     elif extension == ".npy":
         campaign.save_to_npy_file(parameter_query, parsing_function, filename,
                                   runs=click.prompt("Runs", type=int))
+    elif extension == ".parquet":
+        campaign.save_to_parquet_file(filename, table_parsing_function,
+                                      params=parameter_query,
+                                      runs=click.prompt("Runs", type=int),
+                                      partition_by=list(partition_by) or None)
+    elif extension == ".arrow":
+        campaign.save_to_arrow_file(filename, table_parsing_function,
+                                    params=parameter_query,
+                                    runs=click.prompt("Runs", type=int))
     elif extension == "":
         campaign.save_to_folders(parameter_query, filename,
                                  runs=click.prompt("Runs", type=int))
@@ -338,56 +414,150 @@ def merge(move, output_dir, sources):
     if interrupted), the move option can be used to directly move results to
     the new folder.
     """
-    # Get paths for all campaign JSONS
-    jsons = []
-    for s in sources:
-        filename = "%s.json" % os.path.split(s)[1]
-        jsons += [os.path.join(s, filename)]
-
-    # Check that the configuration for all campaigns is the same
-    reference_config = TinyDB(jsons[0]).table('config')
-    for j in jsons[1:]:
-        for i, j in zip(reference_config.all(), TinyDB(j).table('config').all()):
-            assert i == j
-
-    # Create folders for new results directory
-    filename = "%s.json" % os.path.split(output_dir)[1]
-    output_json = os.path.join(output_dir, filename)
-    output_data = os.path.join(output_dir, 'data')
-    os.makedirs(output_data)
-
-    # Create new database
-    db = TinyDB(output_json)
-    db.table('config').insert_multiple(reference_config.all())
-
-    # Import results from all databases to the new JSON file
-    new_doc_id = 1
-    for s in sources:
-        filename = "%s.json" % os.path.split(s)[1]
-        current_db = TinyDB(os.path.join(s, filename))
-
-        # Assign a globally unique document ID to the result entries
-        for result in current_db.table('results').all():
-            db.table('results').insert(Document(result, doc_id=new_doc_id))
-            new_doc_id = new_doc_id + 1
-
-    # Copy or move results to new data folder
-    for s in sources:
-        for r in glob.glob(os.path.join(s, 'data/*')):
-            basename = os.path.basename(r)
-            if move:
-                shutil.move(r, os.path.join(output_data, basename))
-            else:
-                shutil.copytree(r, os.path.join(output_data, basename))
+    # Load all campaign databases
+    source_dbs = [sem.DatabaseManager.load(s) for s in sources]
+
+    # Check that the configuration for all campaigns is the same, regardless
+    # of how they store their outputs
+    reference_config = source_dbs[0].get_config()
+    reference_config.pop('data_layout', None)
+    reference_config.pop('output_store', None)
+    reference_config.pop('compression', None)
+    for db in source_dbs[1:]:
+        config = db.get_config()
+        config.pop('data_layout', None)
+        config.pop('output_store', None)
+        config.pop('compression', None)
+        assert reference_config == config
+
+    # Create new database, using the same backend, data layout and compression
+    # as the first campaign, and the folder for its results
+    db = sem.DatabaseManager.new(
+        script=reference_config['script'],
+        commit=reference_config['commit'],
+        params=reference_config['params'],
+        campaign_dir=output_dir,
+        backend_type=source_dbs[0].get_backend_type(),
+        data_layout=source_dbs[0].get_data_layout(),
+        output_store=source_dbs[0].get_output_store(),
+        compression=source_dbs[0].get_compression())
+    os.makedirs(db.get_data_dir())
+
+    for current_db in source_dbs:
+        results = []
+        for result in current_db.get_results():
+            # Copy or move results to new data folder, unpacking (and
+            # decompressing) outputs that were packed in segments
+            source_dir = current_db.get_result_dir(result['meta']['id'])
+            destination_dir = db.get_result_dir(result['meta']['id'])
+            if os.path.exists(source_dir):
+                os.makedirs(os.path.dirname(destination_dir), exist_ok=True)
+                if move:
+                    shutil.move(source_dir, destination_dir)
+                else:
+                    shutil.copytree(source_dir, destination_dir)
+            elif 'files' in result:
+                os.makedirs(destination_dir)
+                for name, filepath in current_db.get_result_files(
+                        result).items():
+                    sem.store.copy_output_file(
+                        filepath, os.path.join(destination_dir, name))
+            results.append({k: v for k, v in result.items() if k != 'files'})
+
+        # Import results to the new database. Results are inserted as they
+        # are, without validating them against the current format.
+        db.import_results(results)
+        db.write_to_disk()
+    db.close()
 
     if move:
-        for s in sources:
+        for s, current_db in zip(sources, source_dbs):
+            current_db.close()
             shutil.rmtree(os.path.join(s, 'data/'))
-            os.remove(os.path.join(s, "%s.json" % os.path.split(s)[1]))
+            # Remove the database file, and any file the backend kept next to
+            # it
+            for f in os.listdir(s):
+                if f.startswith("%s." % os.path.split(s)[1]):
+                    os.remove(os.path.join(s, f))
             if not os.listdir(s):
                 shutil.rmtree(s)
 
 
+###########
+# Migrate #
+###########
+@cli.command()
+@click.option("--results-dir",
+              type=click.Path(exists=True, dir_okay=True, resolve_path=True),
+              prompt='Directory containing results',
+              help='Directory containing the simulation results.')
+@click.option("--data-layout",
+              type=click.Choice(sem.utils.DATA_LAYOUTS),
+              default='sharded',
+              show_default=True,
+              help="The layout to convert the data folder to")
+def migrate(results_dir, data_layout):
+    """
+    Convert the data folder of a campaign to a different layout, in place.
+
+    If interrupted, the conversion can be resumed by running this command
+    again.
+    """
+    db = sem.DatabaseManager.load(results_dir)
+    db.set_data_layout(data_layout)
+    db.close()
+
+
+############
+# Compress #
+############
+@cli.command()
+@click.option("--results-dir",
+              type=click.Path(exists=True, dir_okay=True, resolve_path=True),
+              prompt='Directory containing results',
+              help='Directory containing the simulation results.')
+@click.option("--compression",
+              type=click.Choice(list(sem.store.COMPRESSION_SUFFIXES)),
+              default='gzip',
+              show_default=True,
+              help="The algorithm used to compress simulation outputs")
+@click.option("--max-processes",
+              type=click.INT,
+              default=None,
+              help="The maximum number of files to compress in parallel")
+def compress(results_dir, compression, max_processes):
+    """
+    Compress the outputs of a campaign, in place.
+
+    Results can be read while this command is running, and new results will
+    be compressed as well. If interrupted, compression can be resumed by
+    running this command again.
+    """
+    db = sem.DatabaseManager.load(results_dir)
+    db.compress_results(compression, processes=max_processes)
+    db.close()
+
+
+@sem.utils.only_load_some_files(['stdout', 'stderr'])
+@sem.utils.output_labels(['stdout', 'stderr'])
+def get_standard_streams(result):
+    """
+    Parsing function returning the contents of stdout and stderr.
+    """
+    return [result['output']['stdout'], result['output']['stderr']]
+
+
+@sem.utils.only_load_some_files(['stdout', 'stderr'])
+@sem.utils.output_labels(['stdout', 'stderr'])
+def parse_standard_streams(result):
+    """
+    Parsing function returning the contents of stdout and stderr, as parsed
+    by sem.utils.automatic_parser.
+    """
+    parsed = sem.utils.automatic_parser(result)
+    return [parsed['stdout'], parsed['stderr']]
+
+
 def get_params_and_defaults(param_list, db):
     """
     Deduce [parameter, default] pairs from simulations available in the db.
@@ -1,116 +1,112 @@
 from .runner import SimulationRunner
-from multiprocessing import Pool, Queue, Lock, Array, cpu_count
-import queue
+from .threadpoolrunner import ThreadPoolRunner
+from .utils import CallbackBase, get_combination_key
+import collections
 import copy
-import numpy as np
-from copy import deepcopy
-import itertools
+import os
 from tqdm import tqdm
 
 
-class ConditionalRunner(SimulationRunner):
-    # TODO Update documentation
+class ConditionalRunner(ThreadPoolRunner):
     """
     A Runner which can perform simulations in parallel on the current machine,
-    prioritizing longest tasks as to minimize the makespan time.
-
-    Due to inheritance and code cleanliness reasons, as of now this runner does
-    not query the database to get running statistics from previous runs, and
-    only creates its statistics as it performs simulations.
+    running new replications of each parameter combination until a stopping
+    condition is met.
+
+    Before using this runner, the stopping_function attribute must be set to
+    a function taking a parameter combination and returning True once no more
+    runs are needed for it, and the next_runs attribute must be set to an
+    iterator yielding unused RngRun values.
+
+    The stopping condition of each combination is checked once at the
+    beginning, and then only after one of its runs ends (and after the
+    corresponding result is yielded, so that it can be saved in the database
+    before the check). At most max_runs_in_flight runs of each combination are
+    performed at the same time, so that no more than max_runs_in_flight - 1
+    surplus runs are started for a combination that just converged. By
+    default, available processes are spread evenly among combinations.
     """
 
-    def __init__(self, path, script, optimized, skip_configuration=False, max_parallel_processes=None):
+    def __init__(self, path, script, optimized, skip_configuration=False,
+                 max_parallel_processes=None, max_runs_in_flight=None):
         SimulationRunner.__init__(self, path, script, optimized,
                                   skip_configuration, max_parallel_processes)
-        self.parameter_runtime_map = {}
+        self.max_runs_in_flight = max_runs_in_flight
 
-    def run_simulations(self, parameter_list, data_folder, stop_on_errors=True):
+    def run_simulations(self, parameter_list, data_folder,
+                        callbacks: [CallbackBase] = None,
+                        stop_on_errors=True):
         """
         This function runs multiple simulations in parallel.
 
         Args:
             parameter_list (list): list of parameter combinations to simulate.
             data_folder (str): folder in which to create output folders.
+            callbacks (list): list of callbacks to be triggered
+            stop_on_errors (bool): check whether simulation has to stop on errors or not
         """
-
-        # print("Running simulations...")
-
-        self.data_folder = data_folder
-
-        # Create a copy of the parameter list
-        unique_param_list = copy.deepcopy(parameter_list)
-        param_list_with_check = [
-            list(i) for i in zip(unique_param_list,
-                                 [False for _ in unique_param_list])]
-
-        def process(q, iolock, outq):
-            while True:
-                next_sim = q.get()
-                if next_sim is None:
-                    break
-                # with iolock:
-                    # print("processing", next_sim)
-                result = next(
-                    SimulationRunner.run_simulations(self,
-                                                     [next_sim],
-                                                     self.data_folder,
-                                                     stop_on_errors=False))
-                outq.put(result)
-
-        # Create queue and processing pool
-        q = Queue(1)
-        outq = Queue()
-        iolock = Lock()
-        pool = Pool(self.max_parallel_processes,
-                    initializer=process,
-                    initargs=(q, iolock, outq))
-
-        progress = tqdm(total=len(param_list_with_check),
+        combinations = collections.OrderedDict()
+        for parameter in parameter_list:
+            combinations.setdefault(get_combination_key(parameter),
+                                    parameter)
+
+        max_workers = self.max_parallel_processes or os.cpu_count()
+        max_runs_in_flight = self.max_runs_in_flight or max(
+            1, -(-max_workers // max(len(combinations), 1)))
+
+        if callbacks is not None:
+            for cb in callbacks:
+                # The total number of runs is not known in advance
+                cb.on_simulation_start(len(combinations))
+                cb.controlled_by_parent = True
+
+        # Combinations that did not converge yet, and those among them that
+        # can start a new run, in round-robin order
+        active = set(key for key, parameter in combinations.items() if
+                     not self.stopping_function(parameter))
+        ready = collections.deque(key for key in combinations if key in
+                                  active)
+        queued = set(ready)
+        runs_in_flight = collections.Counter()
+
+        progress = tqdm(total=len(combinations),
+                        initial=len(combinations) - len(active),
                         unit='parameter combination',
                         desc='Running Simulations')
 
-        # This generates the tasks and adds them to the queue
-        while True:
-            # print("Checking for new results")
-            while True:
-                try:
-                    yield outq.get_nowait()
-                except queue.Empty:
-                    break
-
-            # Update which simulations converged
-            for idx, item in enumerate(param_list_with_check):
-                if not item[1]:
-                    param_list_with_check[idx][1] = self.stopping_function(item[0])
-
-            # print("Converged: %s" % sum(list(zip(*param_list_with_check))[1]))
-            progress.n = sum(list(zip(*param_list_with_check))[1]) - 1
-            progress.update()
-
-            if all(list(zip(*param_list_with_check))[1]):
-                break
-            else:
-                # Push simulations that still haven't converged in the queue
-                new_simulations = [copy.deepcopy(p)
-                                   for p, converged in param_list_with_check
-                                   if not converged]
-                # Assign an RngRun value to all the simulations we need to
-                # run.
-                for s in new_simulations:
-                    s['RngRun'] = next(self.next_runs)
-                for p in new_simulations:
-                    q.put(p, block=True)
-
-        progress.close()
-
-        # This closes everything
-        for _ in range(pool._processes):
-            q.put(None, True)
-        pool.close()
-        pool.join()
-
-        while True:
-            try:
-                yield outq.get_nowait()
-            except queue.Empty:
-                return
+        def next_simulation():
+            # Start a new run of the next combination that did not converge
+            while ready:
+                key = ready.popleft()
+                queued.discard(key)
+                if key not in active:
+                    continue
+                parameter = copy.deepcopy(combinations[key])
+                parameter['RngRun'] = next(self.next_runs)
+                runs_in_flight[key] += 1
+                if runs_in_flight[key] < max_runs_in_flight:
+                    ready.append(key)
+                    queued.add(key)
+                return key, parameter
+            return None
+
+        try:
+            for key, result in self.run_in_threads(
+                    next_simulation, data_folder, callbacks, stop_on_errors):
+                runs_in_flight[key] -= 1
+                yield result
+
+                # Only check the combination that received a new result
+                if key in active:
+                    if self.stopping_function(combinations[key]):
+                        active.discard(key)
+                        progress.update()
+                    elif key not in queued:
+                        ready.append(key)
+                        queued.add(key)
+        finally:
+            progress.close()
+
+        if callbacks is not None:
+            for cb in callbacks:
+                cb.on_simulation_end()
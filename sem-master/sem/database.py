@@ -1,20 +1,272 @@
+import io
 import os
-from functools import reduce
+import json
+import bisect
 import itertools
-from operator import and_, or_
 from pathlib import Path
 from copy import deepcopy
 import re
 import shutil
-import collections
+import collections.abc
 import glob
+from multiprocessing import Pool
 from pprint import pformat
-from tinydb import TinyDB, where
-from tinydb.storages import JSONStorage
-from tinydb.middlewares import CachingMiddleware
+from .backends import BACKENDS
+from .cache import ResultCache
+from .store import (TEMPORARY_SUFFIX, SegmentStore, check_compression,
+                    compress_result_dir, open_output_file, open_output_stream,
+                    split_compressed_name)
+from .statistics import (add_to_statistics, remove_from_statistics,
+                         summarize_statistics)
+from .utils import (DATA_LAYOUTS, get_combination_key, get_hashable_value,
+                    get_result_dir, list_param_combinations)
 
 REUSE_RNGRUN_VALUES = False
 
+
+class RngRunAllocator(object):
+    """
+    Keep track of the RngRun values that are used in a campaign.
+
+    Instead of a list of all used values, this class only keeps a high-water
+    mark (the value following the largest used value) and the sorted list of
+    intervals of unused values below it. Since RngRun values are typically
+    allocated sequentially, this list is usually empty or very short, and
+    finding the next free value or marking a value as used does not depend on
+    the number of results in the campaign.
+
+    Values that are not integers are ignored.
+    """
+
+    def __init__(self, next_value=0, free=None):
+        """
+        Args:
+            next_value (int): the high-water mark: all values from this one
+                onwards are free.
+            free (list): a sorted list of [start, end) intervals of free
+                values below next_value.
+        """
+        self.next_value = next_value
+        self.starts = [start for start, _ in free or []]
+        self.ends = [end for _, end in free or []]
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state['next'], state['free'])
+
+    def to_dict(self):
+        return {'next': self.next_value,
+                'free': [[s, e] for s, e in zip(self.starts, self.ends)]}
+
+    @staticmethod
+    def to_int(value):
+        """
+        Convert an RngRun value to an integer, or return None if it does not
+        represent one.
+        """
+        try:
+            converted = int(value)
+        except (TypeError, ValueError):
+            return None
+        if converted != float(value) or converted < 0:
+            return None
+        return converted
+
+    def mark_used(self, value):
+        """
+        Mark a value as used. Return whether this changed the allocator.
+        """
+        value = RngRunAllocator.to_int(value)
+        if value is None:
+            return False
+        if value >= self.next_value:
+            if value > self.next_value:
+                self.starts.append(self.next_value)
+                self.ends.append(value)
+            self.next_value = value + 1
+            return True
+        # Look for the free interval containing value, and split it
+        idx = bisect.bisect_right(self.starts, value) - 1
+        if idx < 0 or value >= self.ends[idx]:
+            return False
+        start, end = self.starts[idx], self.ends[idx]
+        del self.starts[idx], self.ends[idx]
+        if value + 1 < end:
+            self.starts.insert(idx, value + 1)
+            self.ends.insert(idx, end)
+        if start < value:
+            self.starts.insert(idx, start)
+            self.ends.insert(idx, value)
+        return True
+
+    def mark_free(self, value):
+        """
+        Mark a value as free. Return whether this changed the allocator.
+        """
+        value = RngRunAllocator.to_int(value)
+        if value is None or value >= self.next_value:
+            return False
+        idx = bisect.bisect_right(self.starts, value) - 1
+        if idx >= 0 and value < self.ends[idx]:
+            return False
+        # Insert the new interval, merging it with its neighbours
+        start, end = value, value + 1
+        if idx >= 0 and self.ends[idx] == value:
+            start = self.starts[idx]
+            del self.starts[idx], self.ends[idx]
+            idx -= 1
+        if idx + 1 < len(self.starts) and self.starts[idx + 1] == value + 1:
+            end = self.ends[idx + 1]
+            del self.starts[idx + 1], self.ends[idx + 1]
+        # Free intervals ending at the high-water mark lower it instead
+        if end == self.next_value:
+            self.next_value = start
+        else:
+            self.starts.insert(idx + 1, start)
+            self.ends.insert(idx + 1, end)
+        return True
+
+    def get_free_values(self):
+        """
+        Yield the free values, in increasing order.
+
+        The allocator is not modified: values are only marked as used when a
+        result using them is inserted in the database, or when they are
+        reserved.
+        """
+        intervals = list(zip(self.starts, self.ends))
+        next_value = self.next_value
+        for start, end in intervals:
+            yield from range(start, end)
+        yield from itertools.count(next_value)
+
+    def reserve(self, count):
+        """
+        Mark the lowest count free values as used, and return them.
+        """
+        values = list(itertools.islice(self.get_free_values(), count))
+        for value in values:
+            self.mark_used(value)
+        return values
+
+
+def read_output_file(filepath, use_mmap=False):
+    """
+    Read an output file, given its path or its PackedFile locator.
+
+    By default, the file is decoded to a string, or replaced by 'RAW' if it
+    cannot be decoded. If use_mmap is True, the file is instead memory-mapped
+    and returned as a read-only bytes-like object, that can be searched and
+    sliced without reading the whole file in memory. Compressed files are
+    decompressed transparently.
+    """
+    if use_mmap:
+        return open_output_file(filepath, use_mmap=True)
+    with io.TextIOWrapper(open_output_stream(filepath)) as file_contents:
+        try:
+            return file_contents.read()
+        except UnicodeDecodeError:
+            # If this is not decodable, we leave this output alone
+            return 'RAW'
+
+
+def list_result_files(location):
+    """
+    Return a dictionary containing filename: filepath values for each output
+    file of a result, given its location as returned by
+    DatabaseManager.get_result_location.
+
+    Since locations are cheap to send to other processes, this allows
+    listing output files in the process that reads them.
+    """
+    if not isinstance(location, str):
+        # Packed files are already located
+        return dict(location)
+    result_files = {}
+    for entry in os.scandir(location):
+        if not entry.is_file() or entry.name.endswith(TEMPORARY_SUFFIX):
+            continue
+        name, compression = split_compressed_name(entry.name)
+        # While a file is being compressed, both versions may exist
+        if compression is not None or name not in result_files:
+            result_files[name] = entry.path
+    return result_files
+
+
+def get_lazy_output(location, files_to_load=r'.*', use_mmap=False):
+    """
+    Return a LazyOutput object containing the output files of a result, given
+    its location as returned by DatabaseManager.get_result_location.
+
+    See DatabaseManager.iter_complete_results for a description of the
+    arguments.
+    """
+    available_files = {
+        name: filepath for name, filepath in
+        list_result_files(location).items()
+        if ((isinstance(files_to_load, str) and
+             re.search(files_to_load, name)) or
+            (isinstance(files_to_load, list) and name in files_to_load))}
+    return LazyOutput(available_files, use_mmap)
+
+
+def remove_empty_dirs(path):
+    """
+    Remove a directory tree, if it only contains empty directories.
+    """
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            remove_empty_dirs(entry.path)
+    if not os.listdir(path):
+        os.rmdir(path)
+
+
+class LazyOutput(collections.abc.Mapping):
+    """
+    Read-only dictionary of filename: file_contents pairs, that only reads a
+    file when its contents are accessed.
+
+    Contents are kept after being read, so that each file is read at most
+    once. Objects of this class only hold file paths until they are accessed,
+    and can thus be cheaply sent to other processes.
+    """
+
+    def __init__(self, files, use_mmap=False):
+        self.files = files
+        self.use_mmap = use_mmap
+        self.contents = {}
+
+    def __getitem__(self, name):
+        if name not in self.contents:
+            self.contents[name] = read_output_file(self.files[name],
+                                                   self.use_mmap)
+        return self.contents[name]
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def open(self, name, binary=False):
+        """
+        Open an output file for reading, and return a file object.
+
+        This allows reading large files line by line, instead of loading them
+        in memory at once. Compressed files are decompressed as they are read.
+        """
+        stream = open_output_stream(self.files[name])
+        return stream if binary else io.TextIOWrapper(stream)
+
+    def __repr__(self):
+        return 'LazyOutput(%s)' % list(self.files)
+
+    def __getstate__(self):
+        # Memory-mapped files cannot be pickled, and are cheap to re-open
+        return {'files': self.files, 'use_mmap': self.use_mmap,
+                'contents': {} if self.use_mmap else self.contents}
+
+
 class DatabaseManager(object):
     """
     This serves as an interface with the simulation campaign database.
@@ -29,7 +281,8 @@ class DatabaseManager(object):
 
     def __init__(self, db, campaign_dir):
         """
-        Initialize the DatabaseManager with a TinyDB instance.
+        Initialize the DatabaseManager with a storage backend instance (see
+        the sem.backends module).
 
         This function assumes that the DB is already complete with a config
         entry, as created by the new and load classmethods, and should not be
@@ -38,9 +291,19 @@ class DatabaseManager(object):
         """
         self.campaign_dir = campaign_dir
         self.db = db
+        self.rngruns = None
+        self.cache = None
+        self.data_layout = None
+        self.output_store = None
+        self.segment_store = None
+        # Result directories that were packed in segments, and can be removed
+        # once the database is written to disk
+        self.packed_dirs = []
 
     @classmethod
-    def new(cls, script, commit, params, campaign_dir, overwrite=False):
+    def new(cls, script, commit, params, campaign_dir, overwrite=False,
+            backend_type='TinyDB', data_layout='flat',
+            output_store='directories', compression=None):
         """
         Initialize a new class instance with a set configuration and filename.
 
@@ -56,8 +319,37 @@ class DatabaseManager(object):
             campaign_dir (str): The path of the file where to save the DB.
             overwrite (bool): Whether or not existing directories should be
                 overwritten.
+            backend_type (str): the storage backend to use for the database.
+                Value can be: TinyDB (for a JSON file that is kept in memory,
+                with changes saved to a journal), SQLite (for an indexed
+                SQLite database, better suited to campaigns with many
+                results).
+            data_layout (str): the layout of the data folder. Value can be:
+                flat (each result's output is saved in data/<id>), sharded
+                (each result's output is saved in data/<ab>/<cd>/<id>, where
+                ab and cd are the first four characters of the id, better
+                suited to campaigns with many results).
+            output_store (str): how to store output files. Value can be:
+                directories (each result's output files are kept in their own
+                directory), segments (output files are packed in a few large
+                segment files, see sem.store).
+            compression (str): the algorithm used to compress output files,
+                after each simulation ends. Value can be: None (output files
+                are not compressed), gzip, zstd (requires the zstandard
+                package).
 
         """
+        if backend_type not in BACKENDS:
+            raise ValueError("Unknown backend type: %s" % backend_type)
+
+        if data_layout not in DATA_LAYOUTS:
+            raise ValueError("Unknown data layout: %s" % data_layout)
+
+        if output_store not in ['directories', 'segments']:
+            raise ValueError("Unknown output store: %s" % output_store)
+
+        if compression is not None:
+            check_compression(compression)
 
         # We only accept absolute paths
         if not Path(campaign_dir).is_absolute():
@@ -71,7 +363,12 @@ class DatabaseManager(object):
             campaign_dir_name = os.path.basename(campaign_dir)
             folder_contents = set(os.listdir(campaign_dir))
             allowed_files = set(
-                ['data', '%s.json' % campaign_dir_name] +
+                ['data'] +
+                # Allow database files created by any backend, including the
+                # temporary files SQLite keeps next to the database
+                ['%s.%s%s' % (campaign_dir_name, backend.extension, suffix)
+                 for backend in BACKENDS.values()
+                 for suffix in ['', '-wal', '-shm', '-journal']] +
                 # Allow hidden files (like .DS_STORE in macos)
                 [os.path.basename(os.path.normpath(f)) for f in
                  glob.glob(os.path.join(campaign_dir, ".*"))])
@@ -83,11 +380,7 @@ class DatabaseManager(object):
             shutil.rmtree(campaign_dir)
 
         # Create the directory and database file in it
-        # The indent and separators ensure the database is human readable.
         os.makedirs(campaign_dir)
-        tinydb = TinyDB(os.path.join(campaign_dir, "%s.json" %
-                                     os.path.basename(campaign_dir)),
-                        storage=CachingMiddleware(JSONStorage))
 
         # Save the configuration in the database
         config = {
@@ -95,23 +388,33 @@ class DatabaseManager(object):
             'commit': commit,
             'params': params
         }
+        # Optional settings are only saved if they differ from the default
+        if data_layout != 'flat':
+            config['data_layout'] = data_layout
+        if output_store != 'directories':
+            config['output_store'] = output_store
+        if compression is not None:
+            config['compression'] = compression
 
-        tinydb.table('config').insert(config)
+        backend = BACKENDS[backend_type]
+        db = backend.create(
+            DatabaseManager.get_database_path(campaign_dir, backend), config)
 
-        tinydb.storage.flush()
-
-        return cls(tinydb, campaign_dir)
+        return cls(db, campaign_dir)
 
     @classmethod
-    def load(cls, campaign_dir):
+    def load(cls, campaign_dir, backend_type=None):
         """
         Initialize from an existing database.
 
-        It is assumed that the database json file has the same name as its
-        containing folder.
+        It is assumed that the database file has the same name as its
+        containing folder, and an extension depending on the backend.
 
         Args:
             campaign_dir (str): The path to the campaign directory.
+            backend_type (str): the storage backend the database was created
+                with. If None, the backend is detected from the files that
+                are available in the campaign directory.
         """
 
         # We only accept absolute paths
@@ -122,33 +425,81 @@ class DatabaseManager(object):
         if not Path(campaign_dir).exists():
             raise ValueError("Directory does not exist")
 
-        # Extract filename from campaign dir
-        filename = "%s.json" % os.path.split(campaign_dir)[1]
-        filepath = os.path.join(campaign_dir, filename)
+        # Find the backend that created the database, defaulting to TinyDB
+        if backend_type is None:
+            backend_type = next(
+                (k for k, v in BACKENDS.items() if os.path.exists(
+                    DatabaseManager.get_database_path(campaign_dir, v))),
+                'TinyDB')
+        elif backend_type not in BACKENDS:
+            raise ValueError("Unknown backend type: %s" % backend_type)
+        backend = BACKENDS[backend_type]
+        filepath = DatabaseManager.get_database_path(campaign_dir, backend)
+        existed = os.path.exists(filepath)
 
         try:
-            # Read TinyDB instance from file
-            tinydb = TinyDB(filepath,
-                            storage=CachingMiddleware(JSONStorage))
-            
-            # Make sure the configuration is a valid dictionary
-            assert set(
-                tinydb.table('config').all()[0].keys()) == set(['script',
-                                                                'params',
-                                                                'commit'])
+            # Read database from file
+            db = backend.open(filepath)
+
+            # Make sure the configuration is a valid dictionary, possibly
+            # containing optional settings
+            config_keys = set(db.get_config().keys())
+            assert config_keys >= set(['script', 'params', 'commit'])
+            assert config_keys <= set(['script', 'params', 'commit',
+                                       'data_layout', 'output_store',
+                                       'compression'])
         except:
-            # Remove the database instance created by tinydb
-            os.remove(filepath)
+            # Remove the database instance created by the backend
+            if not existed and os.path.exists(filepath):
+                os.remove(filepath)
             raise ValueError("Specified campaign directory seems corrupt")
 
-        return cls(tinydb, campaign_dir)
+        return cls(db, campaign_dir)
+
+    @staticmethod
+    def get_database_path(campaign_dir, backend):
+        """
+        Return the path of the database file of a campaign, for a certain
+        backend class.
+        """
+        return os.path.join(campaign_dir, "%s.%s" % (
+            os.path.basename(campaign_dir), backend.extension))
 
     ###################
     # Database access #
     ###################
 
     def write_to_disk(self):
-        self.db.storage.flush()
+        self.db.flush()
+        self.remove_packed_dirs()
+
+    def compact(self):
+        """
+        Compact the database's on-disk representation.
+
+        For the TinyDB backend, this rewrites the JSON file and empties the
+        journal. For the SQLite backend, this checkpoints the write-ahead log
+        into the database file.
+        """
+        self.db.compact()
+
+    def close(self):
+        """
+        Write the database to disk and release it.
+        """
+        self.db.close()
+        self.remove_packed_dirs()
+        if self.segment_store is not None:
+            self.segment_store.close()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def get_backend_type(self):
+        """
+        Return the name of the storage backend used by this database.
+        """
+        return self.db.backend_type
 
     def get_config(self):
         """
@@ -163,7 +514,7 @@ class DatabaseManager(object):
         """
 
         # Read from self.db and return the config entry of the database
-        return self.db.table('config').all()[0]
+        return self.db.get_config()
 
     def get_data_dir(self):
         """
@@ -171,6 +522,298 @@ class DatabaseManager(object):
         """
         return os.path.join(self.campaign_dir, 'data')
 
+    def get_data_layout(self):
+        """
+        Return the layout of the data directory (see sem.utils.DATA_LAYOUTS).
+        """
+        if self.data_layout is None:
+            self.data_layout = self.get_config().get('data_layout', 'flat')
+        return self.data_layout
+
+    def get_result_dir(self, result_id):
+        """
+        Return the directory containing the output files of a result.
+        """
+        return get_result_dir(self.get_data_dir(), result_id,
+                              self.get_data_layout())
+
+    def set_data_layout(self, data_layout):
+        """
+        Change the layout of the data directory, moving the output of each
+        result to its new location.
+
+        If this operation is interrupted, it can be safely resumed by calling
+        this method again with the same layout.
+        """
+        if data_layout not in DATA_LAYOUTS:
+            raise ValueError("Unknown data layout: %s" % data_layout)
+
+        old_layout = self.get_data_layout()
+        for result in self.get_results():
+            old_dir = get_result_dir(self.get_data_dir(), result['meta']['id'],
+                                     old_layout)
+            new_dir = get_result_dir(self.get_data_dir(), result['meta']['id'],
+                                     data_layout)
+            if old_dir != new_dir and os.path.exists(old_dir):
+                os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+                os.rename(old_dir, new_dir)
+        # Remove the shard directories that were emptied
+        if old_layout == 'sharded' and data_layout != 'sharded':
+            for shard in os.listdir(self.get_data_dir()):
+                if len(shard) == 2:
+                    remove_empty_dirs(os.path.join(self.get_data_dir(),
+                                                   shard))
+
+        # Only update the configuration once all results were moved
+        config = self.get_config()
+        if data_layout != 'flat':
+            config['data_layout'] = data_layout
+        else:
+            config.pop('data_layout', None)
+        self.db.set_config(config)
+        self.data_layout = data_layout
+        self.write_to_disk()
+
+    def get_output_store(self):
+        """
+        Return how output files are stored: either 'directories' or
+        'segments'.
+        """
+        if self.output_store is None:
+            self.output_store = self.get_config().get('output_store',
+                                                      'directories')
+        return self.output_store
+
+    def get_segment_store(self):
+        """
+        Return the SegmentStore containing packed output files, which is kept
+        in campaign_directory/data/segments.
+        """
+        if self.segment_store is None:
+            self.segment_store = SegmentStore(
+                os.path.join(self.get_data_dir(), 'segments'))
+        return self.segment_store
+
+    def get_compression(self):
+        """
+        Return the algorithm used to compress the output files of new
+        results, or None if they are not compressed.
+        """
+        return self.get_config().get('compression')
+
+    def compress_results(self, compression, processes=None):
+        """
+        Compress the output files of the results that are already in the
+        campaign, and use the specified algorithm for new results from now
+        on.
+
+        Files are compressed in parallel, using the specified number of
+        processes (by default, one per CPU). Each compressed file replaces the
+        original one only once it is complete, so that results can be read
+        while this operation is running, and so that it can be safely resumed
+        if interrupted. Output files that are packed in segments are left as
+        they are.
+        """
+        check_compression(compression)
+
+        # Compress new results right away, so that all results are
+        # compressed once this operation ends
+        config = self.get_config()
+        config['compression'] = compression
+        self.db.set_config(config)
+        self.write_to_disk()
+
+        result_dirs = [self.get_result_dir(result['meta']['id']) for result in
+                       self.get_results() if 'files' not in result]
+        with Pool(processes=processes) as pool:
+            pool.starmap(compress_result_dir,
+                         [(result_dir, compression) for result_dir in
+                          result_dirs if os.path.isdir(result_dir)])
+
+    def store_outputs(self, results):
+        """
+        Prepare the output files of newly inserted results for storage, by
+        compressing them and packing them in segments, depending on the
+        campaign's configuration.
+
+        Return the results to save in the database.
+        """
+        compression = self.get_compression()
+        if compression is not None:
+            for result in results:
+                result_dir = self.get_result_dir(result['meta']['id'])
+                if 'files' not in result and os.path.isdir(result_dir):
+                    compress_result_dir(result_dir, compression)
+        if self.get_output_store() == 'segments':
+            results, packed_dirs = self.pack_results(results)
+            self.packed_dirs += packed_dirs
+        return results
+
+    def pack_results(self, results):
+        """
+        Pack the output files of results in the segment store.
+
+        Return a list containing a copy of each result, with the location of
+        its packed files under the files key, and a list of the directories
+        whose files were packed. Results whose output is too large to be
+        packed are returned as they are (see sem.store.SPILL_SIZE).
+        """
+        store = self.get_segment_store()
+        packed_results = []
+        packed_dirs = []
+        for result in results:
+            result_dir = self.get_result_dir(result['meta']['id'])
+            locations = None
+            if 'files' not in result and os.path.isdir(result_dir):
+                locations = store.pack(result_dir)
+            if locations is not None:
+                result = dict(result, files=locations)
+                packed_dirs.append(result_dir)
+            packed_results.append(result)
+        store.sync()
+        return packed_results, packed_dirs
+
+    def remove_packed_dirs(self):
+        """
+        Remove the directories of packed results, once they are saved in the
+        database.
+        """
+        for result_dir in self.packed_dirs:
+            shutil.rmtree(result_dir, ignore_errors=True)
+        self.packed_dirs = []
+
+    def get_cache_dir(self):
+        """
+        Return the directory containing the cache of parsed results, which is
+        simply campaign_directory/.cache.
+        """
+        return os.path.join(self.campaign_dir, '.cache')
+
+    def get_cache(self):
+        """
+        Return the ResultCache object of this campaign, creating it if
+        necessary.
+        """
+        if self.cache is None:
+            self.cache = ResultCache(self.get_cache_dir())
+        return self.cache
+
+    def clear_cache(self):
+        """
+        Remove all parsed results from the cache.
+        """
+        if os.path.exists(self.get_cache_dir()):
+            self.get_cache().clear()
+
+    def get_statistics_key(self, fingerprint, params):
+        """
+        Return the key under which the statistics of the outputs of a parsing
+        function, for a parameter combination, are saved in the state table.
+        """
+        return 'statistics/%s/%s' % (fingerprint,
+                                     json.dumps(get_combination_key(params)))
+
+    def check_statistics(self):
+        """
+        Make sure the statistics of parsed outputs are available.
+
+        Statistics are saved in the database, and updated as results are
+        inserted and removed. For campaigns created before they were
+        introduced, they are built from the available results the first time
+        they are needed.
+        """
+        if not self.db.get_state('statistics'):
+            self.rebuild_statistics()
+
+    def rebuild_statistics(self):
+        """
+        Compute the statistics of parsed outputs from scratch, from the
+        available results.
+        """
+        for key, _ in self.db.get_state_items('statistics/'):
+            self.db.remove_state(key)
+        self.db.set_state('statistics', True)
+        self.update_statistics(self.db.iter_all_results())
+
+    def update_statistics(self, results, remove=False):
+        """
+        Add the parsed outputs of results to the statistics of their
+        parameter combination, or remove them if remove is True.
+
+        Results without a parsed output, and outputs that are not numbers or
+        lists of numbers of the same shape (see
+        sem.statistics.add_to_statistics), are skipped.
+        """
+        groups = collections.defaultdict(list)
+        for result in results:
+            if 'parsed' in result:
+                groups[self.get_statistics_key(result['parsed']['function'],
+                                               result['params'])].append(
+                                                   result)
+        for key, group in groups.items():
+            statistics = self.db.get_state(key)
+            for result in group:
+                try:
+                    if not remove:
+                        statistics = add_to_statistics(
+                            statistics,
+                            {k: v for k, v in result['params'].items() if
+                             k != 'RngRun'},
+                            result['parsed']['output'])
+                    elif statistics is not None:
+                        statistics = remove_from_statistics(
+                            statistics, result['parsed']['output'])
+                except (ValueError, TypeError):
+                    continue
+            if statistics is None:
+                self.db.remove_state(key)
+            else:
+                self.db.set_state(key, statistics)
+
+    def get_statistics(self, fingerprint, params=None, confidence=0.95):
+        """
+        Return the statistics of the outputs of a parsing function, over the
+        runs of each parameter combination.
+
+        Statistics are computed from the parsed outputs saved with results
+        (see CampaignManager.run_simulations), and are kept up to date as
+        results are inserted and removed, so that no result needs to be read
+        or parsed.
+
+        Args:
+            fingerprint (str): the fingerprint of the parsing function (see
+                sem.cache.get_function_fingerprint).
+            params (dict): parameter specification of the desired parameter
+                combinations, as described in the get_results documentation.
+            confidence (float): the confidence level of the confidence
+                intervals.
+
+        Returns:
+            A list of dictionaries, one for each parameter combination, as
+            returned by sem.statistics.summarize_statistics: the params key
+            contains the parameter combination, and the count, mean,
+            variance and ci keys contain the number of outputs, their mean,
+            their sample variance and the half-width of the confidence
+            interval of their mean.
+        """
+        self.check_statistics()
+        query = {k: v for k, v in (params or {}).items() if k != 'RngRun'}
+        if query and set(query) == set(self.get_params()):
+            # Look up each parameter combination directly
+            statistics = [self.db.get_state(self.get_statistics_key(
+                fingerprint, p)) for p in list_param_combinations(query)]
+            statistics = [s for s in statistics if s is not None]
+        else:
+            query = {k: set(get_hashable_value(v) for v in
+                            (values if isinstance(values, list) else
+                             [values])) for k, values in query.items()}
+            statistics = [
+                s for _, s in self.db.get_state_items(
+                    'statistics/%s/' % fingerprint) if
+                all(get_hashable_value(s['params'].get(k)) in values for
+                    k, values in query.items())]
+        return [summarize_statistics(s, confidence) for s in statistics]
+
     def get_commit(self):
         """
         Return the commit at which the campaign is operating.
@@ -192,10 +835,56 @@ class DatabaseManager(object):
     def get_next_rngruns(self):
         """
         Yield the next RngRun values that can be used in this campaign.
+
+        Values are yielded in increasing order, starting from the lowest value
+        that is not used by any result, and are not reserved: use
+        reserve_rngruns to obtain values that are guaranteed not to be handed
+        out again.
+        """
+        yield from self.get_rngrun_allocator().get_free_values()
+
+    def reserve_rngruns(self, count):
+        """
+        Return a list of count RngRun values that are not used in this
+        campaign, and mark them as used.
+
+        Subsequent calls to this method and to get_next_rngruns will not
+        return these values again, so that concurrent runners can be handed
+        disjoint blocks of values.
         """
-        available_runs = [result['params']['RngRun'] for result in
-                          self.get_results()]
-        yield from DatabaseManager.get_next_values(self, available_runs)
+        allocator = self.get_rngrun_allocator()
+        values = allocator.reserve(count)
+        self.db.set_state('rngruns', allocator.to_dict())
+        return values
+
+    def get_rngrun_allocator(self):
+        """
+        Return the RngRunAllocator keeping track of the RngRun values used in
+        this campaign.
+
+        The allocator is saved in the database, and updated as results are
+        inserted. For campaigns created before it was introduced, it is built
+        from the available results the first time it is needed.
+        """
+        if self.rngruns is None:
+            state = self.db.get_state('rngruns')
+            if state is not None:
+                self.rngruns = RngRunAllocator.from_dict(state)
+            else:
+                self.rngruns = RngRunAllocator()
+                for value in self.db.get_distinct_values('RngRun'):
+                    self.rngruns.mark_used(value)
+                self.db.set_state('rngruns', self.rngruns.to_dict())
+        return self.rngruns
+
+    def update_rngrun_allocator(self, results):
+        """
+        Mark the RngRun values of results as used.
+        """
+        allocator = self.get_rngrun_allocator()
+        changed = [allocator.mark_used(r['params']['RngRun']) for r in results]
+        if any(changed):
+            self.db.set_state('rngruns', allocator.to_dict())
 
     def insert_results(self, results):
 
@@ -208,7 +897,7 @@ class DatabaseManager(object):
 
         for result in results:
             # Verify result format is correct
-            if not(DatabaseManager.have_same_structure(result, example_result)):
+            if not(DatabaseManager.has_result_structure(result, example_result)):
                 raise ValueError(
                     '%s:\nExpected: %s\nGot: %s' % (
                         "Result dictionary does not correspond to database format",
@@ -216,7 +905,19 @@ class DatabaseManager(object):
                         pformat(result, depth=2)))
 
         # Insert results
-        self.db.table('results').insert_multiple(results)
+        self.import_results(results)
+
+    def import_results(self, results):
+        """
+        Insert results in the database as they are, without verifying that
+        they correspond to the current database format (for instance, to
+        import results from another campaign).
+        """
+        self.check_statistics()
+        results = self.store_outputs(results)
+        self.db.insert_results(results)
+        self.update_rngrun_allocator(results)
+        self.update_statistics(results)
 
     def insert_result(self, result):
         """
@@ -243,6 +944,10 @@ class DatabaseManager(object):
         execution took, and id is a UUID uniquely identifying the result, and
         which is used to locate the output files in the campaign_dir/data
         folder.
+
+        Results can additionally contain a parsed entry, in the form
+        {'function': fingerprint, 'output': parsed_output}, holding the output
+        of a result parsing function.
         """
 
         # This dictionary serves as a model for how the keys in the newly
@@ -254,7 +959,7 @@ class DatabaseManager(object):
         }
 
         # Verify result format is correct
-        if not(DatabaseManager.have_same_structure(result, example_result)):
+        if not(DatabaseManager.has_result_structure(result, example_result)):
             raise ValueError(
                 '%s:\nExpected: %s\nGot: %s' % (
                     "Result dictionary does not correspond to database format",
@@ -262,7 +967,11 @@ class DatabaseManager(object):
                     pformat(result, depth=1)))
 
         # Insert result
-        self.db.table('results').insert(deepcopy(result))
+        self.check_statistics()
+        results = self.store_outputs([deepcopy(result)])
+        self.db.insert_results(results)
+        self.update_rngrun_allocator([result])
+        self.update_statistics(results)
 
     def get_results(self, params=None, result_id=None):
         """
@@ -293,24 +1002,67 @@ class DatabaseManager(object):
             same structure as results inserted with the insert_result method.
         """
 
-        # In this case, return all results
-        # A cast to dict is necessary, since self.db.table() contains TinyDB's
-        # Document object (which is simply a wrapper for a dictionary, thus the
-        # simple cast).
         if result_id is not None:
-            return [dict(i) for i in self.db.table('results').all() if
-                    i['meta']['id'] == result_id]
+            return self.db.get_results_by_id(result_id)
 
+        # In this case, return all results
         if params is None:
-            return [dict(i) for i in self.db.table('results').all()]
+            return self.db.get_all_results()
 
         # If we are passed a list of parameter combinations, we concatenate
         # results for the queries corresponding to each dictionary in the list
         if isinstance(params, list):
-            return sum([self.get_results(x) for x in params], [])
+            return list(itertools.chain.from_iterable(
+                self.get_grouped_results(params)))
 
-        # Verify parameter format is correct
+        query_params = self.get_query_params(params)
+
+        # Handle case where query params has no keys
+        if not query_params.keys():
+            return self.db.get_all_results()
+
+        return self.db.search_results(query_params)
+
+    def iter_results(self):
+        """
+        Iterate over all the results available in the database, like
+        get_results without arguments.
+
+        Backends keeping results in memory return them without copying
+        them, which makes full scans of large campaigns cheaper: returned
+        results must thus not be modified.
+        """
+        return self.db.iter_all_results()
+
+    def get_grouped_results(self, param_list):
+        """
+        Return the results matching each of the parameter combinations in
+        param_list, grouped by combination.
+
+        This is equivalent to [self.get_results(p) for p in param_list], but
+        the whole list is validated once and passed to the database in a
+        single query, which is much faster for long lists of combinations.
+
+        Args:
+            param_list (list): a list of parameter specifications, in the
+                format described in the get_results documentation.
+
+        Returns:
+            A list containing, for each item of param_list, the list of
+            results matching it.
+        """
         all_params = set(['RngRun'] + list(self.get_params().keys()))
+        return self.db.search_results_grouped(
+            [self.get_query_params(p, all_params) for p in param_list])
+
+    def get_query_params(self, params, all_params=None):
+        """
+        Validate a parameter specification, and convert it to a query, i.e.,
+        a dictionary of parameter: list-of-values pairs.
+        """
+        # Verify parameter format is correct
+        if all_params is None:
+            all_params = set(['RngRun'] + list(self.get_params().keys()))
         param_subset = set(params.keys())
         if not all_params.issuperset(param_subset):
             raise ValueError(
@@ -329,24 +1081,34 @@ class DatabaseManager(object):
             else:
                 query_params[key] = params[key]
 
-        # Handle case where query params has no keys
-        if not query_params.keys():
-            return [dict(i) for i in self.db.table('results').all()]
-
-        # Create the TinyDB query
-        # In the docstring example above, this is equivalent to:
-        # AND(OR(param1 == value1), OR(param2 == value2, param2 == value3))
-        query = reduce(and_, [reduce(or_, [
-            where('params')[key] == v for v in value]) for key, value in
-                              query_params.items()])
-
-        return [dict(i) for i in self.db.table('results').search(query)]
+        return query_params
 
     def get_result_files(self, result):
         """
         Return a dictionary containing filename: filepath values for each
         output file associated with an id.
 
+        For results whose output files are packed in segments, filepath is a
+        sem.store.PackedFile locator, which can be read with
+        sem.store.open_output_file. Compressed files are listed under their
+        original name (e.g., stdout instead of stdout.gz), and are
+        decompressed by sem.store.open_output_file and
+        sem.store.open_output_stream.
+
+        Result can be either a result dictionary (e.g., obtained with the
+        get_results() method) or a result id.
+        """
+        return list_result_files(self.get_result_location(result))
+
+    def get_result_location(self, result):
+        """
+        Return the location of the output files of a result: either the
+        directory containing them, or, for results whose output files are
+        packed in segments, a dictionary of filename: PackedFile pairs.
+
+        Unlike get_result_files, this does not list the result directory, so
+        that this can be done by list_result_files in another process.
+
         Result can be either a result dictionary (e.g., obtained with the
         get_results() method) or a result id.
         """
@@ -354,16 +1116,27 @@ class DatabaseManager(object):
             result_id = result['meta']['id']
         else:  # Should already be a string containing the id
             result_id = result
-
-        result_data_dir = os.path.join(self.get_data_dir(), result_id)
-
-        filenames = next(os.walk(result_data_dir))[2]
-
-        filename_path_pairs = [
-            (f, os.path.join(self.get_data_dir(), result_id, f))
-            for f in filenames]
-
-        return {k: v for k, v in filename_path_pairs}
+            result = {}
+
+        result_data_dir = self.get_result_dir(result_id)
+
+        # Packed output files are located through the files entry of results
+        files = result.get('files')
+        if (files is None and self.get_output_store() == 'segments' and
+                not os.path.isdir(result_data_dir)):
+            stored_results = self.get_results(result_id=result_id)
+            if stored_results:
+                files = stored_results[0].get('files')
+        if files is not None:
+            store = self.get_segment_store()
+            result_files = {}
+            for name, location in files.items():
+                name, compression = split_compressed_name(name)
+                result_files[name] = store.get_packed_file(location,
+                                                           compression)
+            return result_files
+
+        return result_data_dir
 
     def get_complete_results(self, params=None, result_id=None, files_to_load=r'.*'):
         """
@@ -401,25 +1174,51 @@ class DatabaseManager(object):
         they are empty.
         """
 
+        results = []
+        for result in self.iter_complete_results(params, result_id,
+                                                 files_to_load):
+            result['output'] = dict(result['output'])
+            results.append(result)
+        return results
+
+    def iter_complete_results(self, params=None, result_id=None,
+                              files_to_load=r'.*', use_mmap=False):
+        """
+        Yield available results one at a time, analogously to
+        get_complete_results.
+
+        Instead of a dictionary, the output key of each result contains a
+        LazyOutput object, which only reads a file when its contents are
+        accessed: this way, only the files that are actually used are read,
+        and only one result at a time needs to be kept in memory.
+
+        Args:
+          params (dict): parameter specification of the desired parameter
+            values, as described in the get_results documentation.
+          result_id (str): id of the desired result.
+          files_to_load (str or list): regular expression or list of names
+            specifying which output files to include.
+          use_mmap (bool): whether to memory-map output files, instead of
+            reading them into strings (see read_output_file).
+        """
         if result_id is not None:
-            results = deepcopy(self.get_results(result_id=result_id))
+            results = self.get_results(result_id=result_id)
         else:
-            results = deepcopy(self.get_results(params))
-
-        for r in results:
-            r['output'] = {}
-            available_files = self.get_result_files(r['meta']['id'])
-            for name, filepath in available_files.items():
-                if ((isinstance(files_to_load, str) and re.search(files_to_load, name)) or
-                    (isinstance(files_to_load, list) and name in files_to_load)):
-                    with open(filepath, 'r') as file_contents:
-                        try:
-                            r['output'][name] = file_contents.read()
-                        except UnicodeDecodeError:
-                            # If this is not decodable, we leave this output alone
-                            # (but still insert its name in the result)
-                            r['output'][name] = 'RAW'
-        return results
+            results = self.get_results(params)
+
+        for result in results:
+            yield self.get_lazy_result(result, files_to_load, use_mmap)
+
+    def get_lazy_result(self, result, files_to_load=r'.*', use_mmap=False):
+        """
+        Return a copy of a result, with a LazyOutput object containing its
+        output files under the output key.
+
+        See iter_complete_results for a description of the arguments.
+        """
+        return dict(deepcopy(result),
+                    output=get_lazy_output(self.get_result_location(result),
+                                           files_to_load, use_mmap))
 
     def wipe_results(self):
         """
@@ -427,21 +1226,46 @@ class DatabaseManager(object):
 
         This also removes all output files, and cannot be undone.
         """
-        # Clean results table
-        self.db.drop_table('results')
+        # Clean results table, and forget about the used RngRun values and
+        # the statistics of parsed outputs
+        self.db.drop_results()
+        self.rngruns = RngRunAllocator()
+        self.db.set_state('rngruns', self.rngruns.to_dict())
+        self.rebuild_statistics()
         self.write_to_disk()
+        self.clear_cache()
 
-        # Get rid of contents of data dir
-        map(shutil.rmtree, glob.glob(os.path.join(self.get_data_dir(), '*.*')))
+        # Get rid of contents of data dir, including segments
+        if self.segment_store is not None:
+            self.segment_store.close()
+        self.packed_dirs = []
+        if os.path.exists(self.get_data_dir()):
+            for entry in os.scandir(self.get_data_dir()):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path)
 
     def delete_result(self, result):
         """
         Remove the specified result from the database, based on its id.
         """
-        # Get rid of contents of data dir
-        shutil.rmtree(os.path.join(self.get_data_dir(), result['meta']['id']))
-        # Remove entry from results table
-        self.db.table('results').remove(where('meta')['id'] == result['meta']['id'])
+        # Get rid of contents of data dir. Packed output files are left in
+        # their segment.
+        if os.path.exists(self.get_result_dir(result['meta']['id'])):
+            shutil.rmtree(self.get_result_dir(result['meta']['id']))
+        # Remove entry from results table, and its parsed outputs
+        self.check_statistics()
+        self.db.remove_result(result['meta']['id'])
+        self.update_statistics([result], remove=True)
+        if os.path.exists(self.get_cache_dir()):
+            self.get_cache().remove_results([result['meta']['id']])
+        # Free the RngRun value, if no other result uses it
+        value = result['params']['RngRun']
+        int_value = RngRunAllocator.to_int(value)
+        if int_value is not None and not self.get_results(
+                {'RngRun': [value, int_value, str(int_value)]}):
+            allocator = self.get_rngrun_allocator()
+            if allocator.mark_free(int_value):
+                self.db.set_state('rngruns', allocator.to_dict())
         self.write_to_disk()
 
     #############
@@ -468,7 +1292,8 @@ class DatabaseManager(object):
 
         [2, 5, 6, ...]
         """
-        yield from filter(lambda x: x not in values_list,
+        values_set = set(values_list)
+        yield from filter(lambda x: x not in values_set,
                           itertools.count())
 
     def have_same_structure(d1, d2):
@@ -511,6 +1336,30 @@ class DatabaseManager(object):
 
         return True
 
+    @staticmethod
+    def has_result_structure(result, example_result):
+        """
+        Check whether a result has the same structure as example_result,
+        allowing an additional parsed entry containing the function and
+        output keys, and an additional files entry containing the location
+        of packed output files.
+        """
+        if 'parsed' in result:
+            if (not isinstance(result['parsed'], dict) or
+                    set(result['parsed'].keys()) != {'function', 'output'}):
+                return False
+        if 'files' in result and not isinstance(result['files'], dict):
+            return False
+        result = {k: v for k, v in result.items() if k not in ['parsed',
+                                                               'files']}
+        return DatabaseManager.have_same_structure(result, example_result)
+
+    def get_distinct_values(self, param):
+        """
+        Return the distinct values a parameter takes in the available results.
+        """
+        return self.db.get_distinct_values(param)
+
     def get_all_values_of_all_params(self):
         """
         Return a dictionary containing all values that are taken by all
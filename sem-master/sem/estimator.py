@@ -0,0 +1,115 @@
+import math
+import numbers
+
+import numpy as np
+
+from .utils import get_hashable_value
+
+# Shortest runtime, in seconds, considered by RuntimeEstimator, so that the
+# logarithm of runtimes is always defined
+MINIMUM_RUNTIME = 1e-3
+
+# Regularization strength of the regression fitted by RuntimeEstimator, which
+# keeps predictions stable when parameters are few or collinear
+REGULARIZATION = 1e-3
+
+
+class RuntimeEstimator(object):
+    """
+    Model predicting the runtime of simulations from their parameters, trained
+    on the elapsed times of the results of a campaign.
+
+    The logarithm of the runtime is modelled as a linear function of the
+    parameters: numeric parameters contribute through their logarithm (if
+    they are always positive, so that power laws, like runtimes growing with
+    the square of the number of nodes, are captured) or their value, while
+    any other parameter contributes a separate effect for each of its
+    values. Parameters that always take the same value are ignored, and
+    values that were never seen do not contribute to predictions.
+
+    Example:
+
+        >>> estimator = RuntimeEstimator(campaign.db.get_results())
+        >>> estimator.predict({'nodes': 100, 'mode': 'fast'})
+
+    """
+
+    def __init__(self, results=()):
+        self.fit(results)
+
+    def fit(self, results):
+        """
+        Train the model on an iterable of results.
+        """
+        params = []
+        runtimes = []
+        for result in results:
+            params.append({k: v for k, v in result['params'].items() if k !=
+                           'RngRun'})
+            runtimes.append(math.log(max(float(result['meta']['elapsed_time']),
+                                         MINIMUM_RUNTIME)))
+        self.count = len(runtimes)
+        self.features = []
+        if not runtimes:
+            return
+
+        # Choose how each parameter is encoded
+        names = sorted(set(k for p in params for k in p))
+        for name in names:
+            values = [p.get(name) for p in params]
+            if len(set(get_hashable_value(v) for v in values)) < 2:
+                continue
+            if all(isinstance(v, numbers.Real) and not isinstance(v, bool)
+                   for v in values):
+                use_log = all(v > 0 for v in values)
+                column = np.log(values) if use_log else np.asarray(
+                    values, dtype=float)
+                self.features.append(
+                    (name, 'log' if use_log else 'linear', column.mean(),
+                     column.std() or 1))
+            else:
+                for value in sorted(set(get_hashable_value(v) for v in
+                                        values), key=repr):
+                    self.features.append((name, 'value', value, None))
+
+        # Fit a ridge regression on standardized features
+        x = np.array([self.get_features(p) for p in params]).reshape(
+            len(params), len(self.features))
+        y = np.asarray(runtimes)
+        self.intercept = y.mean()
+        if not self.features:
+            self.coefficients = np.zeros(0)
+            return
+        self.coefficients = np.linalg.solve(
+            x.T @ x + REGULARIZATION * len(y) * np.eye(len(self.features)),
+            x.T @ (y - self.intercept))
+
+    def get_features(self, params):
+        """
+        Return the feature vector of a parameter combination.
+        """
+        features = []
+        for name, encoding, first, second in self.features:
+            value = params.get(name)
+            if encoding == 'value':
+                features.append(float(get_hashable_value(value) == first))
+            elif (not isinstance(value, numbers.Real) or
+                  isinstance(value, bool) or
+                  (encoding == 'log' and value <= 0)):
+                # Values the model cannot encode are treated as average
+                features.append(0.)
+            else:
+                value = math.log(value) if encoding == 'log' else float(value)
+                features.append((value - first) / second)
+        return features
+
+    def predict(self, params):
+        """
+        Return the predicted runtime, in seconds, of a simulation with the
+        specified parameters, or infinity if the model was not trained on
+        any result.
+        """
+        if not self.count:
+            return float('Inf')
+        return float(math.exp(self.intercept + np.dot(
+            self.coefficients, self.get_features(params))))
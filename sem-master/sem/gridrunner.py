@@ -2,7 +2,7 @@ from .runner import SimulationRunner
 import os
 import re
 import uuid
-from .utils import DRMAA_AVAILABLE
+from .utils import DRMAA_AVAILABLE, get_result_dir
 if DRMAA_AVAILABLE:
     import drmaa
 import time
@@ -47,7 +47,9 @@ class GridRunner(SimulationRunner):
 
             # Run from dedicated temporary folder
             current_result['meta']['id'] = str(uuid.uuid4())
-            temp_dir = os.path.join(data_folder, current_result['meta']['id'])
+            temp_dir = get_result_dir(data_folder,
+                                      current_result['meta']['id'],
+                                      self.data_layout)
             if not os.path.exists(temp_dir):
                 os.makedirs(temp_dir)
 
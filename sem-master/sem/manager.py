@@ -1,35 +1,187 @@
+import asyncio
 import collections
+import functools
 import gc
+import itertools
 import os
-import shutil
+import queue
+import traceback
 from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 from random import shuffle
 
 from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import numpy as np
 import xarray as xr
 from scipy.io import savemat
 from tqdm import tqdm
 
-from .database import DatabaseManager
+from .database import DatabaseManager, get_lazy_output
+from .estimator import RuntimeEstimator
+from .statistics import check_relative_ci
+from .cache import CachedParsingFunction, get_function_fingerprint
+from .store import copy_output_file
 from .lptrunner import LptRunner
 from .parallelrunner import ParallelRunner
 from .conditionalrunner import ConditionalRunner
+from .asyncrunner import AsyncRunner
 from .runner import SimulationRunner
-from .utils import DRMAA_AVAILABLE, list_param_combinations
+from .utils import (DRMAA_AVAILABLE, get_combination_key, get_hashable_value,
+                    iter_param_combinations, list_param_combinations)
 import pandas as pd
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    import netCDF4
+    NETCDF_AVAILABLE = True
+except ImportError:
+    try:
+        # h5netcdf provides the same interface as netCDF4
+        import h5netcdf.legacyapi as netCDF4
+        NETCDF_AVAILABLE = True
+    except ImportError:
+        NETCDF_AVAILABLE = False
+
 if DRMAA_AVAILABLE:
     from .gridrunner import GridRunner
 
+# Maximum number of results that are sent to a worker process at once when
+# parsing results in parallel
+PARSING_CHUNK_SIZE = 64
+
+# Maximum number of results that are parsed at once when saving a parameter
+# space to a NetCDF file. Each hyperslab of the space containing this many
+# results is also saved as a separate chunk of the file.
+HYPERSLAB_RESULTS = 10000
+
 def parse_result(param):
     result, function_yields_multiple_results, result_parsing_function, param_columns = param
+    return get_result_rows(result, result_parsing_function(result),
+                           function_yields_multiple_results, param_columns)
+
+def apply_parsing_function(param):
+    """
+    Parse a result, returning its id and the output of the parsing function.
+    """
+    result, function_yields_multiple_results, result_parsing_function = param
+    parsed = result_parsing_function(result)
+    if function_yields_multiple_results:
+        parsed = list(parsed)
+    return result['meta']['id'], parsed
+
+def load_and_parse_results(param):
+    """
+    Parse a chunk of results, returning the id and the output of the parsing
+    function of each of them.
+
+    Results are paired with the location of their output files (see
+    DatabaseManager.get_result_location), so that files are listed and read
+    in the worker process running this function, and only the outputs of the
+    parsing function are sent back.
+    """
+    results, function_yields_multiple_results, result_parsing_function, files_to_load = param
+    return [apply_parsing_function(
+        [dict(result, output=get_lazy_output(location, files_to_load)),
+         function_yields_multiple_results, result_parsing_function])
+        for result, location in results]
+
+def imap_bounded(pool, function, arguments, max_in_flight):
+    """
+    Apply function to each of the arguments in a pool, yielding results in
+    order, like Pool.imap.
+
+    Unlike Pool.imap, which submits all tasks right away, a new task is only
+    submitted when less than max_in_flight tasks are pending, so that
+    arguments are only generated, and results are only kept in memory, as
+    they are needed.
+    """
+    pending = collections.deque()
+    for argument in arguments:
+        pending.append(pool.apply_async(function, (argument,)))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def track_estimated_progress(results, estimates):
+    """
+    Yield results, showing a progress bar that measures the estimated runtime
+    of the completed simulations.
+
+    Args:
+        results (generator): the results yielded by a runner.
+        estimates (dict): the estimated runtime of each simulation, by
+            parameter combination key (including the RngRun).
+    """
+    with tqdm(total=sum(estimates.values()), desc='Running simulations',
+              bar_format='{desc}: {percentage:3.0f}%|{bar}| '
+              '[{elapsed}<{remaining}]') as progress:
+        for result in results:
+            progress.update(estimates.get(
+                get_combination_key(result['params'], exclude=()), 0))
+            yield result
+
+def parse_result_on_ingest(param):
+    """
+    Parse a freshly obtained result, attaching the parsed output to it under
+    the parsed key.
+
+    Outputs that would not be read back unchanged from the database (see
+    is_json_value) are not attached, so that export functions parse the
+    result again, and return the same rows whether or not results were parsed
+    as they were obtained.
+
+    Errors are not raised, but returned together with the result, so that
+    the result can still be saved.
+    """
+    result, function_yields_multiple_results, result_parsing_function, fingerprint = param
+    try:
+        parsed = result_parsing_function(result)
+        if function_yields_multiple_results:
+            parsed = list(parsed)
+        error = None
+    except Exception:
+        parsed = None
+        error = traceback.format_exc()
+    result = {k: v for k, v in result.items() if k != 'output'}
+    if error is None and is_json_value(parsed):
+        result['parsed'] = {'function': fingerprint, 'output': parsed}
+    return result, error
+
+def is_json_value(value):
+    """
+    Check whether a value is only made of dictionaries with string keys,
+    lists, strings, numbers, booleans and None, which are saved to JSON and
+    read back without changing their type.
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return True
+    if isinstance(value, list):
+        return all(is_json_value(v) for v in value)
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and is_json_value(v)
+                   for k, v in value.items())
+    return False
+
+def get_result_rows(result, parsed, function_yields_multiple_results,
+                    param_columns):
+    """
+    Build the DataFrame rows corresponding to the parsed output of a result.
+    """
     data = []
     if function_yields_multiple_results:
-        for r in result_parsing_function(result):
+        for r in parsed:
             param_values = list(deepcopy(result['params']).values())
             if param_columns != 'all':
                 param_keys = list(deepcopy(result['params']).keys())
@@ -45,11 +197,133 @@ def parse_result(param):
             param_values_to_keep = list([v for k, v in list(zip(param_keys, param_values)) if k in param_columns])
         else:
             param_values_to_keep = param_values
-        parsed = result_parsing_function(result)
         param_values_to_keep += [parsed] if not isinstance(parsed, list) else parsed
         data += [param_values_to_keep]
     return data
 
+def group_results(results, parameter_space, runs=None):
+    """
+    Group results by their position in a parameter space, in a single pass.
+
+    Args:
+        results (list): the results to group.
+        parameter_space (dict): parameter/list-of-values pairs, describing
+            the coordinates of each dimension of the space. Parameters that
+            are not in parameter_space can take any value.
+        runs (int): the maximum number of results to keep at each position.
+            If None, all results are kept.
+
+    Returns:
+        A dictionary mapping tuples of indexes along each dimension to the
+        list of results found at that position, in the order they appear in
+        results.
+    """
+    # Map each value to its indexes along its dimension (a value may appear
+    # more than once)
+    keys = list(parameter_space.keys())
+    indexes = []
+    for values in parameter_space.values():
+        value_indexes = collections.defaultdict(list)
+        for idx, value in enumerate(values if isinstance(values, list) else
+                                    [values]):
+            value_indexes[get_hashable_value(value)].append(idx)
+        indexes.append(value_indexes)
+
+    grouped = collections.defaultdict(list)
+    for result in results:
+        position = []
+        for key, value_indexes in zip(keys, indexes):
+            idx = value_indexes.get(
+                get_hashable_value(result['params'][key]))
+            if idx is None:
+                break
+            position.append(idx)
+        else:
+            for coordinates in itertools.product(*position):
+                if runs is None or len(grouped[coordinates]) < runs:
+                    grouped[coordinates].append(result)
+    return grouped
+
+
+def fill_space_array(shape, grouped, outputs, runs=None):
+    """
+    Arrange parsed outputs in a numpy array with the specified shape, plus a
+    run dimension and the dimensions of the outputs.
+
+    Args:
+        shape (list): the size of each dimension of the parameter space.
+        grouped (dict): results at each position, as returned by
+            group_results.
+        outputs (dict): the parsed output of each result, by result id.
+        runs (int): the size of the run dimension. If None, this is the
+            largest number of results at one position.
+
+    Missing runs are filled with NaN. If outputs are numbers, or arrays of
+    numbers of the same shape, they are saved in a preallocated array of the
+    appropriate type (using floats instead of integers if NaNs are needed),
+    and in an array of objects otherwise.
+    """
+    if runs is None:
+        runs = max([len(r) for r in grouped.values()] + [0])
+    complete = (len(grouped) == int(np.prod(shape)) and
+                all(len(r) == runs for r in grouped.values()))
+    arrays = {k: np.asarray(v) for k, v in outputs.items()}
+    output_shapes = set(a.shape for a in arrays.values())
+    dtypes = set(a.dtype for a in arrays.values())
+    dtype = np.dtype(object)
+    output_shape = ()
+    if len(output_shapes) == 1 and dtypes and all(d.kind in 'biufc' or
+                                                  (complete and d.kind in 'SU')
+                                                  for d in dtypes):
+        output_shape = output_shapes.pop()
+        dtype = functools.reduce(np.promote_types, dtypes)
+        if not complete and dtype.kind in 'biu':
+            dtype = np.dtype(float)
+
+    if dtype.kind in 'fco':
+        data = np.full(tuple(shape) + (runs,) + output_shape, np.nan, dtype)
+    else:
+        data = np.empty(tuple(shape) + (runs,) + output_shape, dtype)
+    for coordinates, results in grouped.items():
+        for run, result in enumerate(results):
+            if dtype.kind == 'O':
+                # Avoid numpy trying to unpack outputs into the array
+                data[coordinates + (run,)] = outputs[result['meta']['id']]
+            else:
+                data[coordinates + (run,)] = arrays[result['meta']['id']]
+    return data
+
+
+def create_netcdf_variable(dataset, name, dtype, dimensions, **kwargs):
+    """
+    Create a variable in a NetCDF dataset, storing booleans as bytes and
+    other non-numeric types as strings.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'b':
+        variable = dataset.createVariable(name, 'i1', dimensions, **kwargs)
+        # Same convention xarray uses, so that booleans are decoded back
+        variable.setncattr('dtype', 'bool')
+    elif dtype.kind in 'iuf':
+        variable = dataset.createVariable(name, dtype, dimensions, **kwargs)
+    else:
+        variable = dataset.createVariable(name, str, dimensions, **kwargs)
+    return variable
+
+
+def create_netcdf_coordinate(dataset, name, values):
+    """
+    Create a dimension in a NetCDF dataset, and a variable containing its
+    coordinates.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in 'biuf':
+        values = values.astype(str).astype(object)
+    dataset.createDimension(name, len(values))
+    variable = create_netcdf_variable(dataset, name, values.dtype, (name,))
+    variable[:] = values.astype('i1') if values.dtype.kind == 'b' else values
+
+
 class CampaignManager(object):
     """
     This Simulation Execution Manager class can be used as an interface to
@@ -90,7 +364,9 @@ class CampaignManager(object):
     @classmethod
     def new(cls, ns_path, script, campaign_dir, runner_type='Auto',
             overwrite=False, optimized=True, check_repo=True,
-            skip_configuration=False, max_parallel_processes=None):
+            skip_configuration=False, max_parallel_processes=None,
+            backend_type='TinyDB', data_layout='flat',
+            output_store='directories', compression=None):
         """
         Create a new campaign from an ns-3 installation and a campaign
         directory.
@@ -121,8 +397,10 @@ class CampaignManager(object):
             runner_type (str): implementation of the SimulationRunner to use.
                 Value can be: SimulationRunner (for running sequential
                 simulations locally), ParallelRunner (for running parallel
-                simulations locally), GridRunner (for running simulations using
-                a DRMAA-compatible parallel task scheduler). Use Auto to
+                simulations locally), AsyncRunner (for running parallel
+                simulations locally from an asyncio event loop), GridRunner
+                (for running simulations using a DRMAA-compatible parallel
+                task scheduler). Use Auto to
                 automatically pick the best runner.
             overwrite (bool): whether to overwrite already existing
                 campaign_dir folders. This deletes the directory if and only if
@@ -133,6 +411,26 @@ class CampaignManager(object):
                 and only perform compilation.
                 NOTE: if skip_configuration=True and optimized=True, the build
                 folder should be manually set to --out=build/optimized.
+            backend_type (str): storage backend of the campaign database.
+                Value can be: TinyDB (a JSON file, the default) or SQLite (an
+                indexed database, better suited to large campaigns). This is
+                ignored if an existing campaign is loaded.
+            data_layout (str): layout of the folder containing simulation
+                outputs. Value can be: flat (one folder per result, directly
+                inside the data folder, the default) or sharded (result
+                folders are spread over nested subfolders, better suited to
+                large campaigns). This is ignored if an existing campaign is
+                loaded.
+            output_store (str): how to store output files. Value can be:
+                directories (the default) or segments (output files are
+                packed in a few large files, saving disk space and file
+                system operations for campaigns with many small outputs).
+                This is ignored if an existing campaign is loaded.
+            compression (str): algorithm used to compress output files after
+                each simulation ends. Value can be: None (the default), gzip
+                or zstd (requires the zstandard package). Compressed files
+                are decompressed transparently when results are read. This
+                is ignored if an existing campaign is loaded.
         """
         # Convert paths to be absolute
         ns_path = os.path.abspath(ns_path)
@@ -177,14 +475,18 @@ class CampaignManager(object):
                                  params=params,
                                  commit=commit,
                                  campaign_dir=campaign_dir,
-                                 overwrite=overwrite)
+                                 overwrite=overwrite,
+                                 backend_type=backend_type,
+                                 data_layout=data_layout,
+                                 output_store=output_store,
+                                 compression=compression)
 
         return cls(db, runner, check_repo)
 
     @classmethod
     def load(cls, campaign_dir, ns_path=None, runner_type='Auto',
              optimized=True, check_repo=True, skip_configuration=False,
-             max_parallel_processes=None):
+             max_parallel_processes=None, backend_type=None):
         """
         Load an existing simulation campaign.
 
@@ -201,12 +503,16 @@ class CampaignManager(object):
             runner_type (str): implementation of the SimulationRunner to use.
                 Value can be: SimulationRunner (for running sequential
                 simulations locally), ParallelRunner (for running parallel
-                simulations locally), GridRunner (for running simulations using
-                a DRMAA-compatible parallel task scheduler).
+                simulations locally), AsyncRunner (for running parallel
+                simulations locally from an asyncio event loop), GridRunner
+                (for running simulations using a DRMAA-compatible parallel
+                task scheduler).
             optimized (bool): whether to configure the runner to employ an
                 optimized ns-3 build.
             skip_configuration (bool): whether to skip the configuration step,
                 and only perform compilation.
+            backend_type (str): storage backend of the campaign database. If
+                None, it is detected from the campaign directory contents.
         """
         # Convert paths to be absolute
         if ns_path is not None:
@@ -214,7 +520,7 @@ class CampaignManager(object):
         campaign_dir = os.path.abspath(campaign_dir)
 
         # Read the existing configuration into the new DatabaseManager
-        db = DatabaseManager.load(campaign_dir)
+        db = DatabaseManager.load(campaign_dir, backend_type=backend_type)
         script = db.get_script()
 
         runner = None
@@ -240,8 +546,10 @@ class CampaignManager(object):
             runner_type (str): implementation of the SimulationRunner to use.
                 Value can be: SimulationRunner (for running sequential
                 simulations locally), ParallelRunner (for running parallel
-                simulations locally), GridRunner (for running simulations using
-                a DRMAA-compatible parallel task scheduler). If Auto,
+                simulations locally), AsyncRunner (for running parallel
+                simulations locally from an asyncio event loop), GridRunner
+                (for running simulations using a DRMAA-compatible parallel
+                task scheduler). If Auto,
                 automatically pick the best available runner (GridRunner if
                 DRMAA is available, ParallelRunner otherwise).
             optimized (bool): whether to configure the runner to employ an
@@ -284,13 +592,14 @@ class CampaignManager(object):
             # Automatically fill remaining parameters with defaults
             additional_required_parameters = set(available) - set(passed)
             for additional_parameter in additional_required_parameters:
-                p[additional_parameter] = self.db.get_params()[additional_parameter]
+                parameter[additional_parameter] = self.db.get_params()[additional_parameter]
 
     ######################
     # Simulation running #
     ######################
 
-    def run_simulations(self, param_list, show_progress=True, callbacks: list = [], stop_on_errors=True):
+    def run_simulations(self, param_list, show_progress=True, callbacks: list = [], stop_on_errors=True,
+                        result_parsing_function=None):
         """
         Run several simulations specified by a list of parameter combinations.
 
@@ -302,13 +611,26 @@ class CampaignManager(object):
             param_list (list): list of parameter combinations to execute.
                 Items of this list are dictionaries, with one key for each
                 parameter, and a value specifying the parameter value (which
-                can be either a string or a number).
+                can be either a string or a number). Items can also be
+                [parameter combination, estimated runtime] pairs, as returned
+                by get_missing_simulations with with_time_estimate=True: in
+                this case, estimates are used by the LptRunner to schedule
+                simulations, and the progress bar measures the estimated
+                runtime of completed simulations, instead of their number,
+                for more accurate time predictions.
             show_progress (bool): whether or not to show a progress bar with
                 percentage and expected remaining time.
             callbacks (list): list of objects extending CallbackBase to be 
                 triggered during the run.
             stop_on_errors (bool): whether or not to stop the execution of the simulations 
                 if an error occurs.
+            result_parsing_function (function): function to parse results
+                with as soon as they are available. Parsed outputs are saved
+                in the database, and are used by the export functions instead
+                of parsing results again. Outputs that are not made of
+                lists, dictionaries with string keys, strings, numbers,
+                booleans and None are not saved, since they would be read
+                back from the database with different types.
         """
 
         # Make sure we have a runner to run simulations with.
@@ -333,11 +655,22 @@ class CampaignManager(object):
         # At this point, we can assume the project was already configured
         self.runner.configure_and_build(skip_configuration=True)
 
+        # Save outputs according to the campaign's data layout
+        self.runner.data_layout = self.db.get_data_layout()
+
         # Shuffle simulations
         # This mixes up long and short simulations, and gives better time
         # estimates for the simple ParallelRunner.
         shuffle(param_list)
 
+        # Only the LptRunner uses runtime estimates
+        estimates = None
+        if isinstance(param_list[0], list):
+            estimates = {get_combination_key(p, exclude=()): t for p, t in
+                         param_list}
+            if not isinstance(self.runner, LptRunner):
+                param_list = [p for p, _ in param_list]
+
         # Offload simulation execution to self.runner
         # Note that this only creates a generator for the results, no
         # computation is performed on this line.
@@ -347,14 +680,97 @@ class CampaignManager(object):
                                               stop_on_errors=stop_on_errors)
 
         # Wrap the result generator in the progress bar generator.
-        if show_progress:
+        if (show_progress and estimates is not None and
+                np.all(np.isfinite(list(estimates.values()))) and
+                sum(estimates.values()) > 0):
+            result_generator = track_estimated_progress(results, estimates)
+        elif show_progress:
             result_generator = tqdm(results, total=len(param_list),
                                     unit='simulation',
                                     desc='Running simulations')
         else:
             result_generator = results
 
-        self.run_and_save_results(result_generator)
+        if result_parsing_function is None:
+            self.run_and_save_results(result_generator)
+        else:
+            errors = []
+            self.run_and_save_results(self.parse_results_on_ingest(
+                result_generator, result_parsing_function, errors))
+            self.raise_parsing_errors(errors)
+
+    def parse_results_on_ingest(self, results, result_parsing_function,
+                                errors, synchronous=False):
+        """
+        Parse results as they are yielded by a generator, using a pool of
+        worker processes, and yield them with the parsed output attached.
+
+        Parsing happens while simulations are still running, and while the
+        output files of each result are likely to still be in memory.
+
+        Results with a non-zero exit code are not parsed. Results whose
+        parsing fails are yielded without parsed output, and the
+        corresponding errors are appended to the errors list.
+
+        If synchronous is True, each result is yielded as soon as it is
+        parsed, before the next one is requested from the generator: this
+        way, generators like the ConditionalRunner's can check the database
+        after each yield, knowing that the previous result was saved.
+        """
+        fingerprint = get_function_fingerprint(result_parsing_function)
+        files_to_load = result_parsing_function.__dict__.get('files_to_load',
+                                                             None) or r".*"
+        function_yields_multiple_results = result_parsing_function.__dict__.get(
+            'yields_multiple_results', None) is not None
+
+        parsed_results = queue.Queue()
+        pending = 0
+
+        def put_parsed_result(future, result):
+            # Parsing functions that cannot be sent to workers, and workers
+            # that die, make the future fail without a parsed result
+            try:
+                parsed_results.put(future.result())
+            except Exception:
+                parsed_results.put((result, traceback.format_exc()))
+
+        with ProcessPoolExecutor(
+                max_workers=self.runner.max_parallel_processes) as executor:
+            for result in results:
+                if result['meta'].get('exitcode', 0):
+                    yield result
+                    continue
+                try:
+                    future = executor.submit(
+                        parse_result_on_ingest,
+                        [self.db.get_lazy_result(result, files_to_load),
+                         function_yields_multiple_results,
+                         result_parsing_function,
+                         fingerprint])
+                    future.add_done_callback(functools.partial(
+                        put_parsed_result, result=result))
+                except BrokenProcessPool:
+                    parsed_results.put((result, traceback.format_exc()))
+                pending += 1
+                # Yield the results that were parsed in the meantime
+                while (synchronous and pending) or not parsed_results.empty():
+                    parsed_result, error = parsed_results.get()
+                    pending -= 1
+                    if error is not None:
+                        errors.append(error)
+                    yield parsed_result
+            while pending:
+                parsed_result, error = parsed_results.get()
+                pending -= 1
+                if error is not None:
+                    errors.append(error)
+                yield parsed_result
+
+    def raise_parsing_errors(self, errors):
+        if errors:
+            raise Exception("Parsing failed for %s results, which were saved"
+                            " without parsed output. First error:\n%s" %
+                            (len(errors), errors[0]))
 
     def run_and_save_results(self, result_generator, batch_results=True):
         # Insert result object in db. Using the generator here ensures we
@@ -382,19 +798,64 @@ class CampaignManager(object):
         self.db.insert_results(results_batch)
         self.db.write_to_disk()
 
-    def get_missing_simulations(self, param_list, runs=None, with_time_estimate=False):
+    def count_available_runs(self, keys=None):
+        """
+        Return a dictionary containing, for each parameter combination key
+        (see sem.utils.get_combination_key), a [runs, elapsed_time] pair,
+        where runs is the number of available runs of the combination, and
+        elapsed_time is their average duration (or infinity, if no runs are
+        available).
+
+        Results are scanned in a single pass. If keys is specified, only the
+        corresponding combinations are counted.
+        """
+        available_runs = {}
+        if keys is not None:
+            available_runs = {key: [0, float("Inf")] for key in keys}
+        for r in self.db.iter_results():
+            key = get_combination_key(r['params'])
+            if keys is None:
+                available_runs.setdefault(key, [0, float("Inf")])
+            elif key not in available_runs:
+                continue
+            runs, elapsed_time = available_runs[key]
+            if runs:
+                elapsed_time += (float(r['meta']['elapsed_time']) -
+                                 elapsed_time) / (runs + 1)
+            else:
+                elapsed_time = float(r['meta']['elapsed_time'])
+            available_runs[key] = [runs + 1, elapsed_time]
+        return available_runs
+
+    def get_missing_simulations(self, param_list, runs=None,
+                                with_time_estimate=False,
+                                available_runs=None, estimator=None):
         """
         Return a list of the simulations among the required ones that are not
         available in the database.
 
         Args:
-            param_list (list): a list of dictionaries containing all the
-                parameters combinations.
+            param_list (list, dict): a list of dictionaries containing all the
+                parameters combinations, or a parameter specification to be
+                expanded into a list through the list_param_combinations
+                function (including any constraints it contains).
             runs (int): an integer representing how many repetitions are wanted
                 for each parameter combination, None if the dictionaries in
                 param_list already feature the desired RngRun value.
-            with_time_estimate (bool): a boolean representing ...
+            with_time_estimate (bool): whether to return
+                [parameter combination, estimated runtime] pairs, where the
+                estimated runtime is the average duration of the available
+                runs of the combination or, if none is available, the
+                runtime predicted by get_runtime_estimator.
+            available_runs (dict): the available runs of each combination, as
+                returned by count_available_runs. If not specified, they are
+                counted from the database.
+            estimator (RuntimeEstimator): the estimator predicting runtimes
+                when with_time_estimate is True. If not specified, it is
+                returned by get_runtime_estimator, when first needed.
         """
+        if isinstance(param_list, dict):
+            param_list = list_param_combinations(param_list)
 
         params_to_simulate = []
 
@@ -406,20 +867,21 @@ class CampaignManager(object):
 
         if runs is not None:  # Get next available runs from the database
             next_runs = self.db.get_next_rngruns()
-            available_results = [r for r in self.db.get_results()]
-            for param_comb in param_list:
-                # Count how many param combinations we found, and remove them
-                # from the list of available_results for faster searching in the
-                # future
-                needed_runs = runs
-                if with_time_estimate:
-                    time_prediction = float("Inf")
-                for i, r in enumerate(available_results):
-                    if param_comb == {k: r['params'][k] for k in
-                                      r['params'].keys() if k != "RngRun"}:
-                        needed_runs -= 1
-                        if with_time_estimate:
-                            time_prediction = float(r['meta']['elapsed_time'])
+            # Count the available runs of each requested combination, in a
+            # single pass over the results
+            keys = [get_combination_key(param_comb) for param_comb in
+                    param_list]
+            if available_runs is None:
+                available_runs = self.count_available_runs(keys)
+            for param_comb, key in zip(param_list, keys):
+                available, time_prediction = available_runs.get(
+                    key, [0, float("Inf")])
+                if with_time_estimate and not available:
+                    # Predict the runtime of combinations without runs
+                    if estimator is None:
+                        estimator = self.get_runtime_estimator()
+                    time_prediction = estimator.predict(param_comb)
+                needed_runs = runs - available
                 new_param_combs = []
                 for needed_run in range(needed_runs):
                     # Here it's important that we make copies of the
@@ -435,29 +897,70 @@ class CampaignManager(object):
                         new_param_combs += [new_param]
                 params_to_simulate += new_param_combs
         else:
-            for param_comb in param_list:
-                previous_results = self.db.get_results(param_comb)
-                if not previous_results:
-                    if with_time_estimate:
-                        # Try and find results with different RngRun to provide
-                        # a time prediction
-                        param_comb_no_rngrun = {k:param_comb[k] for k in
-                                                param_comb.keys() if k != "RngRun"}
-                        prev_results_different_rngrun = self.db.get_results(param_comb_no_rngrun)
-                        if prev_results_different_rngrun:
-                            time_prediction = float(prev_results_different_rngrun[0]['meta']['elapsed_time'])
-                        else:
-                            time_prediction = float("Inf")
-                        params_to_simulate += [[param_comb, time_prediction]]
+            # Query the database for all combinations at once
+            missing = [param_comb for param_comb, previous_results in
+                       zip(param_list, self.db.get_grouped_results(param_list))
+                       if not previous_results]
+            if with_time_estimate:
+                # Try and find results with different RngRun to provide
+                # a time prediction, or predict it
+                missing_no_rngrun = [{k: param_comb[k] for k in
+                                      param_comb.keys() if k != "RngRun"}
+                                     for param_comb in missing]
+                for param_comb, prev_results_different_rngrun in zip(
+                        missing,
+                        self.db.get_grouped_results(missing_no_rngrun)):
+                    if prev_results_different_rngrun:
+                        time_prediction = sum(
+                            float(r['meta']['elapsed_time']) for r in
+                            prev_results_different_rngrun) / len(
+                                prev_results_different_rngrun)
                     else:
-                        params_to_simulate += [param_comb]
+                        if estimator is None:
+                            estimator = self.get_runtime_estimator()
+                        time_prediction = estimator.predict(param_comb)
+                    params_to_simulate += [[param_comb, time_prediction]]
+            else:
+                params_to_simulate += missing
 
         return params_to_simulate
 
+    def get_runtime_estimator(self):
+        """
+        Return a sem.estimator.RuntimeEstimator, trained on the runtimes of
+        the results in the database, which can predict the runtime of
+        parameter combinations that were never simulated.
+        """
+        return RuntimeEstimator(self.db.iter_results())
+
+    def uses_estimates(self, show_progress):
+        """
+        Return whether run_simulations makes use of runtime estimates: they
+        are used by the LptRunner to schedule simulations, and by the
+        progress bar to predict the remaining time.
+        """
+        return show_progress or isinstance(self.runner, LptRunner)
+
+    def estimate_missing_runtime(self, param_list, runs=None):
+        """
+        Return the estimated total runtime, in seconds of a single core, of
+        the simulations that run_missing_simulations would perform with the
+        same arguments.
+
+        Runtimes are estimated as described in get_missing_simulations: the
+        result is infinite if the database does not contain any result to
+        base estimates on.
+        """
+        return sum(estimate for _, estimate in self.get_missing_simulations(
+            param_list, runs, with_time_estimate=True))
+
     def run_missing_simulations(self, param_list, runs=None,
                                 condition_checking_function=None,
                                 callbacks=[],
-                                stop_on_errors=True):
+                                stop_on_errors=True,
+                                result_parsing_function=None,
+                                window=None, max_runs_in_flight=None,
+                                show_progress=True):
         """
         Run the simulations from the parameter list that are not yet available
         in the database.
@@ -472,7 +975,9 @@ class CampaignManager(object):
         Args:
             param_list (list, dict): either a list of parameter combinations or
                 a dictionary to be expanded into a list through the
-                list_param_combinations function.
+                list_param_combinations function. Dictionaries can contain
+                sem.Constraint objects, which are checked while the
+                dictionary is expanded, to skip invalid combinations.
             runs (int): the number of runs to perform for each parameter
                 combination. This parameter is only allowed if the param_list
                 specification doesn't feature an 'RngRun' key already.
@@ -480,46 +985,338 @@ class CampaignManager(object):
                 triggered during the run.
             stop_on_errors (bool): whether or not to stop the execution of the simulations 
                 if an error occurs.
+            result_parsing_function (function): function to parse results
+                with as soon as they are available, as described in the
+                run_simulations documentation.
+            window (int): if specified, parameter combinations are expanded
+                lazily, and simulations are planned and run for window
+                combinations at a time, so that memory usage does not depend
+                on the size of the sweep. Simulations are then shuffled (or
+                sorted by the LptRunner) within each window only. This is not
+                supported together with condition_checking_function.
+            max_runs_in_flight (int): when condition_checking_function is
+                specified, the maximum number of runs of each parameter
+                combination that can be performed at the same time. By
+                default, available processes are spread evenly among
+                parameter combinations.
+            show_progress (bool): whether or not to show a progress bar with
+                percentage and expected remaining time.
         """
+        if window is not None:
+            if condition_checking_function is not None:
+                raise ValueError("Windows cannot be used together with a "
+                                 "condition checking function")
+            self.run_missing_simulations_in_windows(
+                param_list, runs, window, show_progress=show_progress,
+                callbacks=callbacks, stop_on_errors=stop_on_errors,
+                result_parsing_function=result_parsing_function)
+            return
+
         # Expand the parameter specification
         param_list = list_param_combinations(param_list)
 
         # In this case, we need to run simulations in batches
         if runs is None and condition_checking_function:
-            next_runs = self.db.get_next_rngruns()
-            # Create a ConditionalRunner
-            cr = ConditionalRunner(self.runner.path,
-                                   self.runner.script,
-                                   self.runner.optimized,
-                                   max_parallel_processes=self.runner.max_parallel_processes)
-            # Set up the runner's stopping condition function
-            cr.stopping_function = lambda x: condition_checking_function(self, x)
-            # Set up the runner's iterator for next runs
-            cr.next_runs = next_runs
-
-            # Fill up a possibly impartial parameter definition with defaults
-            self.check_and_fill_parameters (param_list, needs_rngrun=False)
-
-            self.run_and_save_results(cr.run_simulations(param_list,
-                                                         self.db.get_data_dir(),
-                                                         stop_on_errors=stop_on_errors),
-                                      batch_results=False)
+            errors = []
+            self.run_conditional_simulations(
+                param_list, condition_checking_function, errors,
+                callbacks=callbacks, stop_on_errors=stop_on_errors,
+                result_parsing_function=result_parsing_function,
+                max_runs_in_flight=max_runs_in_flight)
+            self.raise_parsing_errors(errors)
 
         # Otherwise, we just run all required runs for each combination
         if condition_checking_function is None:
-            # If we are passed a list already, just run the missing simulations
-            if isinstance(self.runner, LptRunner):
-                self.run_simulations(
-                    self.get_missing_simulations(param_list,
-                                                 runs,
-                                                 with_time_estimate=True),
-                    callbacks=callbacks,
-                    stop_on_errors=stop_on_errors)
-            else:
-                self.run_simulations(
-                    self.get_missing_simulations(param_list, runs),
-                    callbacks=callbacks,
-                    stop_on_errors=stop_on_errors)
+            self.run_simulations(
+                self.get_missing_simulations(
+                    param_list, runs, with_time_estimate=self.uses_estimates(
+                        show_progress)),
+                show_progress=show_progress,
+                callbacks=callbacks,
+                stop_on_errors=stop_on_errors,
+                result_parsing_function=result_parsing_function)
+
+    def run_conditional_simulations(self, param_list,
+                                    condition_checking_function, errors,
+                                    callbacks=[], stop_on_errors=True,
+                                    result_parsing_function=None,
+                                    max_runs_in_flight=None):
+        """
+        Run new replications of each parameter combination of an expanded
+        parameter list, until condition_checking_function returns True for
+        it, as described in the run_missing_simulations documentation.
+
+        Parsing errors are appended to the errors list, instead of being
+        raised, so that the condition checking function can inspect them.
+        """
+        next_runs = self.db.get_next_rngruns()
+        # Create a ConditionalRunner
+        cr = ConditionalRunner(self.runner.path,
+                               self.runner.script,
+                               self.runner.optimized,
+                               max_parallel_processes=self.runner.max_parallel_processes,
+                               max_runs_in_flight=max_runs_in_flight)
+        # Set up the runner's stopping condition function
+        cr.stopping_function = lambda x: condition_checking_function(self, x)
+        # Set up the runner's iterator for next runs
+        cr.next_runs = next_runs
+        cr.data_layout = self.db.get_data_layout()
+
+        # Fill up a possibly impartial parameter definition with defaults
+        self.check_and_fill_parameters (param_list, needs_rngrun=False)
+
+        results = cr.run_simulations(param_list,
+                                     self.db.get_data_dir(),
+                                     callbacks=callbacks,
+                                     stop_on_errors=stop_on_errors)
+        if result_parsing_function is None:
+            self.run_and_save_results(results, batch_results=False)
+        else:
+            self.run_and_save_results(
+                self.parse_results_on_ingest(results,
+                                             result_parsing_function,
+                                             errors, synchronous=True),
+                batch_results=False)
+
+    def run_missing_simulations_to_precision(self, param_list,
+                                             result_parsing_function,
+                                             relative_ci, metric=None,
+                                             confidence=0.95, min_runs=3,
+                                             max_runs=None, callbacks=[],
+                                             stop_on_errors=True,
+                                             max_runs_in_flight=None):
+        """
+        Run new replications of the parameter combinations from the
+        parameter list, until the confidence interval of the mean of an
+        output of result_parsing_function is narrow enough.
+
+        Results are parsed as soon as they are available, and the running
+        statistics the database keeps for each parameter combination (see
+        get_statistics) are used to decide whether a combination needs more
+        runs, without reading or parsing any previous result. Only the
+        statistics of the combination that received a new result are
+        checked, so that runs are only performed where outputs are still
+        too noisy.
+
+        Only results that were parsed with result_parsing_function as
+        simulations were run count towards the statistics: previous results
+        of the same combinations that were not parsed are not considered.
+
+        Runs that fail (if stop_on_errors is False), or whose output cannot
+        be parsed, are not added to the statistics, but count towards
+        max_runs. If max_runs is not specified, they are retried, and an
+        exception is raised once min_runs runs of the same combination
+        failed.
+
+        Args:
+            param_list (list, dict): either a list of parameter combinations or
+                a dictionary to be expanded into a list, as described in the
+                run_missing_simulations documentation.
+            result_parsing_function (function): function to parse results
+                with, which must return a number or a list of numbers.
+            relative_ci (float): the largest acceptable half-width of the
+                confidence interval, relative to the absolute value of the
+                mean (for instance, 0.05 for an interval of +-5%).
+            metric (int, str): if result_parsing_function returns a list,
+                the index of the output to check, or its label, as specified
+                with the @sem.utils.output_labels decorator. If None, all
+                outputs are checked.
+            confidence (float): the confidence level of the confidence
+                intervals.
+            min_runs (int): the minimum number of runs of each parameter
+                combination.
+            max_runs (int): if specified, the maximum number of runs of each
+                parameter combination, even if its confidence interval is
+                still too wide.
+            callbacks (list): list of objects extending CallbackBase to be
+                triggered during the run.
+            stop_on_errors (bool): whether or not to stop the execution of
+                the simulations if an error occurs.
+            max_runs_in_flight (int): the maximum number of runs of each
+                parameter combination that can be performed at the same time,
+                as described in the run_missing_simulations documentation.
+        """
+        if isinstance(metric, str):
+            labels = result_parsing_function.__dict__.get('output_labels',
+                                                          None)
+            if labels is None or metric not in labels:
+                raise ValueError("Metric %s is not one of the output labels "
+                                 "of the parsing function" % metric)
+            metric = labels.index(metric)
+
+        fingerprint = get_function_fingerprint(result_parsing_function)
+        # Number of outputs in the statistics of each combination, as of the
+        # last check, and number of runs that did not add an output
+        counts = {}
+        failures = collections.Counter()
+        errors = []
+
+        def condition_checking_function(campaign, params):
+            statistics = campaign.db.get_statistics(fingerprint, params,
+                                                    confidence)
+            count = statistics[0]['count'] if statistics else 0
+            # Combinations are only checked again after receiving a result
+            key = get_combination_key(params)
+            if key in counts and count <= counts[key]:
+                failures[key] += 1
+                if max_runs is None and failures[key] >= max(min_runs, 1):
+                    raise ValueError(
+                        "%s runs of %s were not added to the statistics: "
+                        "make sure the simulation does not fail, and the "
+                        "parsing function returns a number or a list of "
+                        "numbers. First parsing error:\n%s" %
+                        (failures[key], params,
+                         errors[0] if errors else None))
+            counts[key] = count
+            if max_runs is not None and count + failures[key] >= max_runs:
+                return True
+            if count < min_runs:
+                return False
+            return check_relative_ci(statistics[0], relative_ci, metric)
+
+        self.run_conditional_simulations(
+            list_param_combinations(param_list), condition_checking_function,
+            errors, callbacks=callbacks, stop_on_errors=stop_on_errors,
+            result_parsing_function=result_parsing_function,
+            max_runs_in_flight=max_runs_in_flight)
+        self.raise_parsing_errors(errors)
+
+    async def run_missing_simulations_async(self, param_list, runs=None,
+                                            callbacks=[],
+                                            stop_on_errors=True,
+                                            result_parsing_function=None):
+        """
+        Run the simulations from the parameter list that are not yet available
+        in the database, from an asyncio event loop.
+
+        This is an asynchronous generator: simulations are run by an
+        AsyncRunner (the campaign's runner, if it is one, or a new one using
+        the same ns-3 installation otherwise), and results are yielded as
+        soon as they are saved in the database, while the event loop remains
+        free to perform other work: building ns-3, accessing the database and
+        parsing results happen in separate threads. For instance:
+
+            >>> async for result in campaign.run_missing_simulations_async(
+            ...         params, runs=10):
+            ...     print(result['meta']['id'])
+
+        Args:
+            param_list (list, dict): either a list of parameter combinations or
+                a dictionary to be expanded into a list, as described in the
+                run_missing_simulations documentation.
+            runs (int): the number of runs to perform for each parameter
+                combination.
+            callbacks (list): list of objects extending CallbackBase to be
+                triggered during the run.
+            stop_on_errors (bool): whether or not to stop the execution of the
+                simulations if an error occurs.
+            result_parsing_function (function): function to parse results
+                with as soon as they are available, as described in the
+                run_simulations documentation.
+        """
+        if self.runner is None:
+            raise Exception("No runner was ever specified"
+                            " for this CampaignManager.")
+
+        loop = asyncio.get_running_loop()
+
+        # Building ns-3 blocks, so it happens in a separate thread
+        runner = self.runner
+        if isinstance(runner, AsyncRunner):
+            await loop.run_in_executor(None, functools.partial(
+                runner.configure_and_build, skip_configuration=True))
+        else:
+            runner = await loop.run_in_executor(None, functools.partial(
+                AsyncRunner, runner.path, runner.script,
+                optimized=runner.optimized, skip_configuration=True,
+                max_parallel_processes=runner.max_parallel_processes))
+
+        # Database and repository accesses block too: they all happen in
+        # the same separate thread, one at a time
+        database = ThreadPoolExecutor(max_workers=1)
+
+        def get_simulations_to_run():
+            missing = self.get_missing_simulations(param_list, runs)
+            if missing:
+                self.check_and_fill_parameters(missing, needs_rngrun=True)
+                if self.check_repo:
+                    self.check_repo_ok()
+                runner.data_layout = self.db.get_data_layout()
+                shuffle(missing)
+            return missing, self.db.get_data_dir()
+
+        param_list, data_dir = await loop.run_in_executor(
+            database, get_simulations_to_run)
+        if not param_list:
+            database.shutdown()
+            return
+
+        if result_parsing_function is not None:
+            fingerprint = get_function_fingerprint(result_parsing_function)
+            files_to_load = result_parsing_function.__dict__.get(
+                'files_to_load', None) or r".*"
+            function_yields_multiple_results = result_parsing_function.__dict__.get(
+                'yields_multiple_results', None) is not None
+        errors = []
+
+        results = runner.run_simulations_async(param_list, data_dir,
+                                               callbacks=callbacks,
+                                               stop_on_errors=stop_on_errors)
+        try:
+            async for result in results:
+                if (result_parsing_function is not None and
+                        not result['meta'].get('exitcode', 0)):
+                    lazy_result = await loop.run_in_executor(
+                        database, self.db.get_lazy_result, result,
+                        files_to_load)
+                    result, error = await loop.run_in_executor(
+                        None, parse_result_on_ingest,
+                        [lazy_result, function_yields_multiple_results,
+                         result_parsing_function, fingerprint])
+                    if error is not None:
+                        errors.append(error)
+                await loop.run_in_executor(database, self.db.insert_results,
+                                           [result])
+                yield result
+        finally:
+            await results.aclose()
+            await loop.run_in_executor(database, self.db.write_to_disk)
+            database.shutdown()
+        self.raise_parsing_errors(errors)
+
+    def run_missing_simulations_in_windows(self, param_list, runs, window,
+                                           show_progress=True, **kwargs):
+        """
+        Run the missing simulations of a parameter specification, planning
+        and running them for window parameter combinations at a time.
+
+        See run_missing_simulations for a description of the arguments.
+        """
+        if window < 1:
+            raise ValueError("Window size must be positive")
+
+        # Count the runs that are already available once, instead of at each
+        # window
+        available_runs = None
+        if runs is not None:
+            available_runs = self.count_available_runs()
+        # The same goes for the runtime estimator, which is only trained if
+        # estimates are used
+        with_time_estimate = self.uses_estimates(show_progress)
+        estimator = None
+        if with_time_estimate:
+            estimator = self.get_runtime_estimator()
+
+        combinations = iter_param_combinations(param_list)
+        while True:
+            param_window = list(itertools.islice(combinations, window))
+            if not param_window:
+                break
+            self.run_simulations(
+                self.get_missing_simulations(
+                    param_window, runs, with_time_estimate=with_time_estimate,
+                    available_runs=available_runs, estimator=estimator),
+                show_progress=show_progress, **kwargs)
 
     #####################
     # Result management #
@@ -533,7 +1330,8 @@ class CampaignManager(object):
                                  param_columns='all',
                                  drop_constant_columns=False,
                                  parallel_parsing=False,
-                                 verbose=False):
+                                 verbose=False,
+                                 use_cache=False):
         """
         Return a Pandas DataFrame containing results parsed using a
         user-specified function.
@@ -554,18 +1352,269 @@ class CampaignManager(object):
             result_parsing_function (function): user-defined function, taking a
                 result dictionary as input and returning a list of outputs or a list
                 of lists of outputs.
+            use_cache (bool): whether to reuse the outputs of previous calls
+                with the same result_parsing_function, saved in the campaign's
+                cache, and save new outputs to it.
+        """
+
+        all_columns, row_batches = self.get_dataframe_rows(
+            result_parsing_function, columns, params, runs, param_columns,
+            parallel_parsing, verbose, use_cache)
+        df = pd.DataFrame([row for rows in row_batches for row in rows],
+                          columns=all_columns)
+
+        if drop_constant_columns:
+            nunique = df.apply(pd.Series.nunique)
+            cols_to_drop = nunique[nunique == 1].index
+            df = df.drop(cols_to_drop, axis=1)
+            return df
+        else:
+            return df
+
+    def iter_results_as_dataframes(self,
+                                   result_parsing_function,
+                                   columns=None,
+                                   params=None,
+                                   runs=None,
+                                   param_columns='all',
+                                   chunk_size=100000,
+                                   parallel_parsing=False,
+                                   verbose=False,
+                                   use_cache=False):
+        """
+        Yield Pandas DataFrames containing results parsed using a
+        user-specified function, analogously to get_results_as_dataframe,
+        but chunk_size rows at a time.
+
+        Results are parsed in batches as chunks are requested, so that
+        memory usage does not depend on the size of the campaign. The other
+        arguments are described in get_results_as_dataframe.
+        """
+        all_columns, row_batches = self.get_dataframe_rows(
+            result_parsing_function, columns, params, runs, param_columns,
+            parallel_parsing, verbose, use_cache, batch_size=chunk_size)
+        rows = []
+        empty = True
+        for batch in row_batches:
+            rows += batch
+            while len(rows) >= chunk_size:
+                yield pd.DataFrame(rows[:chunk_size], columns=all_columns)
+                del rows[:chunk_size]
+                empty = False
+        # Always yield at least one DataFrame, possibly empty
+        if rows or empty:
+            yield pd.DataFrame(rows, columns=all_columns)
+
+    def save_to_csv_files(self, folder_name, result_parsing_function,
+                          columns=None, params=None, runs=None,
+                          param_columns='all', partition_by=None,
+                          chunk_size=100000, parallel_parsing=False,
+                          verbose=False, use_cache=False):
+        """
+        Save results parsed using a user-specified function to a folder of
+        CSV files, each containing at most chunk_size rows, without keeping
+        the whole DataFrame in memory.
+
+        Args:
+            folder_name (path): the folder to create.
+            partition_by (list): if specified, rows are split in subfolders
+                according to the values of these columns, in the form
+                folder_name/column1=value1/column2=value2/part-00000.csv.
+
+        The other arguments are described in get_results_as_dataframe. Files
+        can be read back with pd.concat(map(pd.read_csv, paths)).
+        """
+        os.makedirs(folder_name)
+        for part, df in enumerate(self.iter_results_as_dataframes(
+                result_parsing_function, columns, params, runs,
+                param_columns, chunk_size, parallel_parsing, verbose,
+                use_cache)):
+            if partition_by is None:
+                groups = [((), df)]
+            else:
+                groups = df.groupby(partition_by, sort=False, dropna=False)
+            for values, group in groups:
+                if not isinstance(values, tuple):
+                    values = (values,)
+                partition_dir = os.path.join(
+                    folder_name, *[("%s=%s" % (k, v)).replace('/', '_') for
+                                   k, v in zip(partition_by or [], values)])
+                os.makedirs(partition_dir, exist_ok=True)
+                group.to_csv(os.path.join(partition_dir,
+                                          'part-%05d.csv' % part),
+                             index=False)
+
+    def save_to_parquet_file(self, filename, result_parsing_function,
+                             columns=None, params=None, runs=None,
+                             param_columns='all', partition_by=None,
+                             chunk_size=100000, parallel_parsing=False,
+                             verbose=False, use_cache=False):
+        """
+        Save results parsed using a user-specified function to a Parquet
+        file, with one typed column for each parameter and for each output
+        of the function. This requires the pyarrow package.
+
+        Results are parsed and written chunk_size rows at a time, each chunk
+        forming a row group of the file, so that the whole table is never
+        kept in memory.
+
+        Args:
+            filename (path): the file to create.
+            partition_by (list): if specified, filename is created as a
+                folder, and rows are split in Parquet files in its
+                subfolders according to the values of these columns, in the
+                form filename/column1=value1/column2=value2/part.parquet.
+                The folder can be read back as a single table with
+                pyarrow.parquet.read_table or pd.read_parquet.
+
+        The other arguments are described in get_results_as_dataframe.
+        """
+        tables = self.iter_results_as_arrow_tables(
+            result_parsing_function, columns, params, runs, param_columns,
+            chunk_size, parallel_parsing, verbose, use_cache)
+        if partition_by is not None:
+            for part, table in enumerate(tables):
+                pyarrow.parquet.write_to_dataset(
+                    table, filename, partition_cols=partition_by,
+                    basename_template='part-%05d-{i}.parquet' % part)
+            return
+        writer = None
+        try:
+            for table in tables:
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(filename,
+                                                           table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def save_to_arrow_file(self, filename, result_parsing_function,
+                           columns=None, params=None, runs=None,
+                           param_columns='all', chunk_size=100000,
+                           parallel_parsing=False, verbose=False,
+                           use_cache=False):
+        """
+        Save results parsed using a user-specified function to an Arrow IPC
+        file (also known as Feather version 2), with one typed column for
+        each parameter and for each output of the function. This requires the
+        pyarrow package.
+
+        Results are parsed and written chunk_size rows at a time, each chunk
+        forming a record batch of the file. The file can be memory-mapped and
+        read without copies, e.g., with pyarrow.ipc.open_file.
+
+        See get_results_as_dataframe for a description of the arguments.
+        """
+        tables = self.iter_results_as_arrow_tables(
+            result_parsing_function, columns, params, runs, param_columns,
+            chunk_size, parallel_parsing, verbose, use_cache)
+        writer = None
+        with pyarrow.OSFile(filename, 'wb') as sink:
+            try:
+                for table in tables:
+                    if writer is None:
+                        writer = pyarrow.ipc.new_file(sink, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    def iter_results_as_arrow_tables(self, result_parsing_function,
+                                     columns=None, params=None, runs=None,
+                                     param_columns='all', chunk_size=100000,
+                                     parallel_parsing=False, verbose=False,
+                                     use_cache=False):
+        """
+        Yield the chunks of iter_results_as_dataframes as pyarrow Tables, all
+        sharing the same schema.
+
+        The type of parameter columns is inferred from all the values each
+        parameter takes in the campaign, while the type of output columns is
+        inferred from the first chunk.
+        """
+        if not PYARROW_AVAILABLE:
+            raise ImportError("Exporting to Parquet and Arrow files requires"
+                              " the pyarrow package")
+
+        schema = None
+        for df in self.iter_results_as_dataframes(
+                result_parsing_function, columns, params, runs,
+                param_columns, chunk_size, parallel_parsing, verbose,
+                use_cache):
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            if schema is None:
+                schema = self.get_arrow_schema(table.schema)
+            try:
+                table = table.cast(schema)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+                raise ValueError(
+                    "Column types do not match the ones of the first chunk:"
+                    "\nExpected: %s\nGot: %s" % (schema, table.schema))
+            yield table
+
+    def get_arrow_schema(self, schema):
+        """
+        Replace the type of parameter columns in a pyarrow schema with the
+        type of all values the parameters take in the campaign.
+        """
+        for idx, field in enumerate(schema):
+            if field.name not in list(self.db.get_params()) + ['RngRun']:
+                continue
+            try:
+                values_type = pyarrow.array(
+                    self.db.get_distinct_values(field.name)).type
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                continue
+            if values_type != pyarrow.null():
+                schema = schema.set(idx, field.with_type(values_type))
+        return schema
+
+    def get_dataframe_rows(self, result_parsing_function, columns=None,
+                           params=None, runs=None, param_columns='all',
+                           parallel_parsing=False, verbose=False,
+                           use_cache=False, batch_size=None):
         """
+        Select the results to export to a DataFrame, and return the list of
+        columns of the DataFrame and a generator yielding its rows, in
+        batches corresponding to batch_size results (or all results, if
+        batch_size is None).
 
+        See get_results_as_dataframe for a description of the arguments.
+        """
         results_list = []
         if params is not None:
-            for param_combination in list_param_combinations(params):
+            for results in self.db.get_grouped_results(
+                    list_param_combinations(params)):
                 if runs is not None:
-                    results_list += list(self.db.get_results(param_combination))[:runs]
+                    results_list += results[:runs]
                 else:
-                    results_list += list(self.db.get_results(param_combination))
+                    results_list += results
         else:
-            results_list = list(self.db.get_results())
+            results_list = list(self.db.iter_results())
+
+        if columns is None and result_parsing_function.__dict__.get('output_labels', None) is None:
+            raise ValueError("Please either specify a column parameter or decorate your function with the @sem.utils.output_labels decorator")
+        elif columns is None:
+            columns = result_parsing_function.__dict__['output_labels']
 
+        if results_list:
+            all_params = list(results_list[0]['params'].keys())
+        else:
+            all_params = list(self.db.get_params().keys()) + ['RngRun']
+        all_columns = [k for k in all_params if param_columns == 'all' or
+                       k in param_columns] + columns
+
+        return all_columns, self.iter_dataframe_rows(
+            results_list, result_parsing_function, param_columns,
+            parallel_parsing, verbose, use_cache, batch_size)
+
+    def iter_dataframe_rows(self, results_list, result_parsing_function,
+                            param_columns, parallel_parsing, verbose,
+                            use_cache, batch_size):
+        """
+        Parse results in batches, and yield the DataFrame rows of each batch.
+        """
         if result_parsing_function.__dict__.get('files_to_load', None) is not None:
             files_to_load = result_parsing_function.__dict__['files_to_load']
         else:
@@ -576,59 +1625,163 @@ class CampaignManager(object):
         else:
             function_yields_multiple_results = False
 
+        fingerprint = get_function_fingerprint(result_parsing_function)
+        progress = tqdm(total=len(results_list), unit='result',
+                        desc='Parsing Results', disable=not verbose)
+        pool = None
+        if parallel_parsing:
+            # Campaigns loaded without an ns-3 installation have no runner
+            processes = (self.runner.max_parallel_processes if self.runner
+                         is not None else None) or os.cpu_count()
+            pool = Pool(processes=processes)
+        try:
+            for start in range(0, len(results_list),
+                               batch_size or len(results_list) or 1):
+                batch = results_list[start:start + (batch_size or
+                                                    len(results_list))]
+
+                # Outputs of the parsing function, indexed by result id:
+                # reuse those that were saved when running simulations, and
+                # those in the cache
+                parsed_outputs = {r['meta']['id']: r['parsed']['output'] for r
+                                  in batch if r.get('parsed', {}).get(
+                                      'function') == fingerprint}
+                if use_cache:
+                    parsed_outputs.update(self.db.get_cache().get_outputs(
+                        fingerprint, [r['meta']['id'] for r in batch if
+                                      r['meta']['id'] not in parsed_outputs]))
+                results_to_parse = [r for r in batch if r['meta']['id'] not
+                                    in parsed_outputs]
+                progress.update(len(batch) - len(results_to_parse))
+
+                # Output files are only read when the parsing function
+                # accesses them. When parsing in parallel, workers receive
+                # chunks of results and the location of their files, and do
+                # all the I/O themselves, while a bounded number of chunks is
+                # in flight.
+                if pool is not None:
+                    chunk_size = max(1, min(PARSING_CHUNK_SIZE, -(
+                        -len(results_to_parse) // (processes * 4))))
+                    chunks = (
+                        [[(result, self.db.get_result_location(result)) for
+                          result in results_to_parse[i:i + chunk_size]],
+                         function_yields_multiple_results,
+                         result_parsing_function, files_to_load]
+                        for i in range(0, len(results_to_parse), chunk_size))
+                    parsed_results = itertools.chain.from_iterable(
+                        imap_bounded(pool, load_and_parse_results, chunks,
+                                     2 * processes))
+                else:
+                    parsed_results = map(apply_parsing_function, (
+                        [self.db.get_lazy_result(result, files_to_load),
+                         function_yields_multiple_results,
+                         result_parsing_function]
+                        for result in results_to_parse))
+
+                new_outputs = {}
+                for result_id, parsed in parsed_results:
+                    new_outputs[result_id] = parsed
+                    progress.update()
+                if use_cache:
+                    self.db.get_cache().set_outputs(fingerprint, new_outputs)
+                parsed_outputs.update(new_outputs)
+                del new_outputs
+
+                rows = []
+                for result in batch:
+                    rows += get_result_rows(
+                        result, parsed_outputs.pop(result['meta']['id']),
+                        function_yields_multiple_results, param_columns)
+                yield rows
+        finally:
+            if pool is not None:
+                pool.terminate()
+            progress.close()
+
+    def get_statistics(self, result_parsing_function, params=None,
+                       confidence=0.95):
+        """
+        Return the mean, variance and confidence interval of the outputs of
+        a result parsing function, over the runs of each parameter
+        combination.
+
+        Statistics are only available for results that were parsed with
+        result_parsing_function as simulations were run (see
+        run_simulations), and are maintained by the database as results are
+        inserted, so that this method does not read or parse any result. For
+        instance, the condition_checking_function of run_missing_simulations
+        can use this to check the confidence interval of a combination
+        without parsing all of its runs.
+
+        Args:
+            result_parsing_function (function): the function results were
+                parsed with, which must return a number or a list of numbers.
+            params (dict): parameter specification of the desired parameter
+                combinations, as described in the get_results documentation
+                of DatabaseManager.
+            confidence (float): the confidence level of the confidence
+                intervals.
+
+        Returns:
+            A list of dictionaries, one for each parameter combination, as
+            described in DatabaseManager.get_statistics.
+        """
+        return self.db.get_statistics(
+            get_function_fingerprint(result_parsing_function), params,
+            confidence)
+
+    def get_statistics_as_dataframe(self, result_parsing_function,
+                                    columns=None, params=None,
+                                    confidence=0.95):
+        """
+        Return the statistics returned by get_statistics as a DataFrame.
+
+        The DataFrame contains one row for each parameter combination, with
+        one column for each parameter, a count column, and the
+        <label>_mean, <label>_variance and <label>_ci columns for each
+        output of the parsing function.
+
+        Args:
+            columns (list): the labels of the outputs of
+                result_parsing_function. If None, the labels specified with
+                the @sem.utils.output_labels decorator are used.
+
+        See get_statistics for a description of the other arguments.
+        """
         if columns is None and result_parsing_function.__dict__.get('output_labels', None) is None:
             raise ValueError("Please either specify a column parameter or decorate your function with the @sem.utils.output_labels decorator")
         elif columns is None:
             columns = result_parsing_function.__dict__['output_labels']
 
+        param_columns = list(self.db.get_params().keys())
         data = []
-
-        if parallel_parsing:
-            with Pool(processes=self.runner.max_parallel_processes) as pool:
-                for parsed_result in tqdm(pool.imap_unordered(parse_result,
-                                                              [[self.db.get_complete_results(result_id=result['meta']['id'],
-                                                                                             files_to_load=files_to_load)[0],
-                                                                function_yields_multiple_results,
-                                                                result_parsing_function,
-                                                                param_columns] for result in results_list]),
-                                          total=len(results_list),
-                                          unit='result',
-                                          desc='Parsing Results',
-                                          disable=not verbose):
-                    data += parsed_result
-        else:
-            for parsed_result in tqdm((parse_result([self.db.get_complete_results(result_id=result['meta']['id'],
-                                                                                  files_to_load=files_to_load)[0],
-                                                     function_yields_multiple_results,
-                                                     result_parsing_function,
-                                                     param_columns]) for result in results_list),
-                                      total=len(results_list),
-                                      unit='result',
-                                      desc='Parsing Results',
-                                      disable=not verbose):
-                data += parsed_result
-
-        if param_columns == 'all':
-            param_columns = list(self.db.get_results()[0]['params'].keys())
-        all_columns = ([k for k in list(self.db.get_results()[0]['params'].keys()) if k in param_columns] + columns)
-
-        df = pd.DataFrame(data, columns=all_columns)
-
-        if drop_constant_columns:
-            nunique = df.apply(pd.Series.nunique)
-            cols_to_drop = nunique[nunique == 1].index
-            df = df.drop(cols_to_drop, axis=1)
-            return df
-        else:
-            return df
+        for statistics in self.get_statistics(result_parsing_function, params,
+                                              confidence):
+            row = [statistics['params'][k] for k in param_columns]
+            row.append(statistics['count'])
+            values = [np.atleast_1d(statistics[k]) for k in ['mean',
+                                                              'variance',
+                                                              'ci']]
+            for idx in range(len(columns)):
+                row += [float(v[idx]) for v in values]
+            data.append(row)
+        return pd.DataFrame(
+            data, columns=param_columns + ['count'] + [
+                '%s_%s' % (label, statistic) for label in columns for
+                statistic in ['mean', 'variance', 'ci']])
 
     def get_results_as_numpy_array(self, parameter_space,
                                    result_parsing_function, runs=None,
-                                   extract_complete_results=True):
+                                   extract_complete_results=True,
+                                   use_cache=False):
         """
         Return the results relative to the desired parameter space in the form
         of a numpy array.
 
+        The array has one dimension for each parameter, one for the runs, and
+        the dimensions of the parsed outputs. Runs that are not available
+        are filled with NaN.
+
         Args:
             parameter_space (dict): dictionary containing
                 parameter/list-of-values pairs.
@@ -637,17 +1790,92 @@ class CampaignManager(object):
                 result files and return a list of values.
             runs (int): number of runs to gather for each parameter
                 combination.
+            use_cache (bool): whether to reuse the outputs of previous calls
+                with the same result_parsing_function, saved in the campaign's
+                cache, and save new outputs to it.
+        """
+        return self.get_space_array(parameter_space, result_parsing_function,
+                                    runs, extract_complete_results, use_cache)
+
+    def get_space_array(self, parameter_space, result_parsing_function,
+                        runs=None, extract_complete_results=True,
+                        use_cache=False):
+        """
+        Return a numpy array containing the parsed outputs of the results in
+        a parameter space.
+
+        The array has one dimension for each parameter in parameter_space,
+        one for the runs, and the dimensions of the outputs returned by
+        result_parsing_function. Results are grouped by their position in
+        the space in a single pass (see group_results), each result is
+        parsed once, and outputs are saved in a preallocated array (see
+        fill_space_array), where missing runs are NaN.
+
+        See get_results_as_numpy_array for a description of the arguments.
+        """
+        grouped = group_results(self.db.iter_results(), parameter_space, runs)
+        result_parsing_function = self.get_cached_parsing_function(
+            result_parsing_function,
+            [r for group in grouped.values() for r in group], use_cache,
+            extract_complete_results)
+
+        outputs = self.parse_grouped_results(grouped, result_parsing_function,
+                                             extract_complete_results)
+        result_parsing_function.save()
+
+        shape = [len(v) if isinstance(v, list) else 1 for v in
+                 parameter_space.values()]
+        return fill_space_array(shape, grouped, outputs, runs)
+
+    def parse_grouped_results(self, grouped, result_parsing_function,
+                              extract_complete_results=True):
+        """
+        Parse each of the results returned by group_results once, and return
+        a dictionary containing the output of each result, by result id.
+        """
+        outputs = {}
+        for group in grouped.values():
+            for r in group:
+                if r['meta']['id'] in outputs:
+                    continue
+                # Make results complete: output files are only read when the
+                # parsing function accesses them
+                if extract_complete_results:
+                    complete_result = self.db.get_lazy_result(r)
+                else:
+                    complete_result = dict(deepcopy(r),
+                                           output=self.db.get_result_files(
+                                               r['meta']['id']))
+                outputs[r['meta']['id']] = result_parsing_function(
+                    complete_result)
+        return outputs
+
+    def get_cached_parsing_function(self, result_parsing_function, results,
+                                    use_cache=False,
+                                    extract_complete_results=True):
+        """
+        Wrap a result parsing function in a CachedParsingFunction, which
+        reuses the outputs saved in the results when simulations were run
+        and, if use_cache is True, those found in the campaign's cache.
         """
-        data = self.get_space(
-            self.db.get_results(), {},
-            collections.OrderedDict([(k, v) for k, v in
-                                     parameter_space.items()]),
-            result_parsing_function, runs, extract_complete_results)
-        return np.array(data)
+        if result_parsing_function is None:
+            result_parsing_function = CampaignManager.files_in_dictionary
+        # Functions receiving file paths instead of contents yield different
+        # outputs, and are cached separately
+        if extract_complete_results:
+            fingerprint = get_function_fingerprint(result_parsing_function)
+        else:
+            fingerprint = get_function_fingerprint(
+                result_parsing_function, extract_complete_results=False)
+        if use_cache:
+            return CachedParsingFunction(
+                result_parsing_function, fingerprint, self.db.get_cache(),
+                [r['meta']['id'] for r in results])
+        return CachedParsingFunction(result_parsing_function, fingerprint)
 
     def save_to_mat_file(self, parameter_space,
                          result_parsing_function,
-                         filename, runs):
+                         filename, runs, use_cache=False):
         """
         Return the results relative to the desired parameter space in the form
         of a .mat file.
@@ -681,23 +1909,25 @@ class CampaignManager(object):
             {'results':
              self.get_results_as_numpy_array(parameter_space,
                                              result_parsing_function,
-                                             runs=runs).astype(object),
+                                             runs=runs,
+                                             use_cache=use_cache).astype(object),
              'dimension_labels': dimension_labels})
 
     def save_to_npy_file(self, parameter_space,
                          result_parsing_function,
-                         filename, runs):
+                         filename, runs, use_cache=False):
         """
         Save results to a numpy array file format.
         """
         np.save(filename, self.get_results_as_numpy_array(
-            parameter_space, result_parsing_function, runs=runs))
+            parameter_space, result_parsing_function, runs=runs,
+            use_cache=use_cache))
 
     def save_to_folders(self, parameter_space, folder_name, runs):
         """
         Save results to a folder structure.
         """
-        self.space_to_folders(self.db.get_results(), {}, parameter_space, runs,
+        self.space_to_folders(list(self.db.iter_results()), {}, parameter_space, runs,
                               folder_name)
 
     def space_to_folders(self, current_result_list, current_query, param_space,
@@ -714,7 +1944,7 @@ class CampaignManager(object):
                 new_dir = os.path.join(current_directory, "run=%s" % run)
                 os.makedirs(new_dir, exist_ok=True)
                 for filename, filepath in files.items():
-                    shutil.copyfile(filepath, os.path.join(new_dir, filename))
+                    copy_output_file(filepath, os.path.join(new_dir, filename))
             return
 
         [key, value] = list(param_space.items())[0]
@@ -744,7 +1974,8 @@ class CampaignManager(object):
     def get_results_as_xarray(self, parameter_space,
                               result_parsing_function,
                               output_labels, runs=None,
-                              extract_complete_results=True):
+                              extract_complete_results=True,
+                              use_cache=False):
         """
         Return the results relative to the desired parameter space in the form
         of an xarray data structure.
@@ -758,6 +1989,9 @@ class CampaignManager(object):
                 dimensions, output by the result_parsing_function.
             runs (int): the number of runs to export for each parameter
                 combination.
+            use_cache (bool): whether to reuse the outputs of previous calls
+                with the same result_parsing_function, saved in the campaign's
+                cache, and save new outputs to it.
         """
         # Create a parameter space only containing the variable parameters
         clean_parameter_space = collections.OrderedDict(
@@ -768,22 +2002,151 @@ class CampaignManager(object):
         if isinstance(output_labels, list):
             clean_parameter_space['metrics'] = output_labels
 
-        data = self.get_space(
-            self.db.get_results(), {},
-            collections.OrderedDict([(k, v) for k, v in
-                                     parameter_space.items()]),
-            result_parsing_function, runs)
+        data = self.get_space_array(parameter_space, result_parsing_function,
+                                    runs, extract_complete_results, use_cache)
         xr_array = xr.DataArray(data, coords=clean_parameter_space,
                                 dims=list(clean_parameter_space.keys()))
 
         return xr_array
 
+    def save_to_netcdf_file(self, parameter_space, result_parsing_function,
+                            output_labels, filename, runs=None,
+                            extract_complete_results=True, use_cache=False,
+                            compression_level=4):
+        """
+        Save the results relative to the desired parameter space to a NetCDF
+        file, without building the whole array in memory.
+
+        The file, which is also an HDF5 file, contains the same array
+        returned by get_results_as_xarray, with the same dimensions and
+        coordinates. The array is written one hyperslab at a time: results
+        are parsed for a block of parameter combinations, containing at most
+        HYPERSLAB_RESULTS results, and each block is saved as a compressed
+        chunk of the file. Runs that are not available are filled with NaN,
+        and outputs are saved as 64-bit floats, whatever their type.
+
+        The file can be opened lazily, only reading the slices that are
+        accessed, with xarray.open_dataarray(filename).
+
+        Requires either the netCDF4 or the h5netcdf package.
+
+        Args:
+            parameter_space (dict): The space of parameters to export.
+            result_parsing_function (function): user-defined function, taking a
+                result dictionary as argument, that can be used to parse the
+                result files and return a number or a list of numbers.
+            output_labels (list): a list of labels to apply to the results
+                dimensions, output by the result_parsing_function.
+            filename (str): the path of the file to create.
+            runs (int): the number of runs to export for each parameter
+                combination. If None, this is the largest number of runs
+                available for a combination.
+            use_cache (bool): whether to reuse the outputs of previous calls
+                with the same result_parsing_function, saved in the campaign's
+                cache, and save new outputs to it.
+            compression_level (int): zlib compression level, from 0 (no
+                compression) to 9.
+        """
+        if not NETCDF_AVAILABLE:
+            raise ImportError("NetCDF export requires the netCDF4 or h5netcdf"
+                              " package")
+
+        space = collections.OrderedDict(
+            [(k, v) if isinstance(v, list) else (k, [v]) for k, v in
+             parameter_space.items()])
+        shape = [len(v) for v in space.values()]
+        grouped = group_results(self.db.iter_results(), parameter_space, runs)
+        if runs is None:
+            runs = max([len(r) for r in grouped.values()] + [0])
+        result_parsing_function = self.get_cached_parsing_function(
+            result_parsing_function,
+            [r for group in grouped.values() for r in group], use_cache,
+            extract_complete_results)
+
+        # Split the space along its leading dimensions, so that each
+        # hyperslab contains at most HYPERSLAB_RESULTS results
+        split = 0
+        while (split < len(shape) and
+               int(np.prod(shape[split:])) * runs > HYPERSLAB_RESULTS):
+            split += 1
+        hyperslabs = collections.defaultdict(dict)
+        for coordinates, results in grouped.items():
+            hyperslabs[coordinates[:split]][coordinates[split:]] = results
+
+        dimensions = list(space.keys()) + ['runs']
+        with netCDF4.Dataset(filename, 'w') as dataset:
+            for name, values in space.items():
+                create_netcdf_coordinate(dataset, name, values)
+            create_netcdf_coordinate(dataset, 'runs', list(range(runs)))
+            if isinstance(output_labels, list):
+                create_netcdf_coordinate(dataset, 'metrics', output_labels)
+                dimensions.append('metrics')
+
+            variable = None
+            for index in sorted(hyperslabs):
+                hyperslab = hyperslabs.pop(index)
+                outputs = self.parse_grouped_results(
+                    hyperslab, result_parsing_function,
+                    extract_complete_results)
+                data = fill_space_array(shape[split:], hyperslab, outputs,
+                                        runs)
+                output_shape = data.shape[len(shape) - split + 1:]
+                if data.dtype.kind not in 'biuf':
+                    raise ValueError("Only numbers, or arrays of numbers"
+                                     " of the same shape, can be saved"
+                                     " to NetCDF files")
+                if variable is None:
+                    # The type of outputs is not known in advance, and may
+                    # differ among hyperslabs (e.g., a parser returning 0 or
+                    # a float): all numbers are saved as floats
+                    variable = self.create_netcdf_results(
+                        dataset, dimensions, float, output_shape,
+                        [1] * split + shape[split:] + [runs],
+                        compression_level)
+                elif output_shape != variable.shape[len(shape) + 1:]:
+                    raise ValueError("Outputs of different shapes cannot be"
+                                     " saved to NetCDF files")
+                variable[index + (Ellipsis,)] = data.astype(float)
+            if variable is None:
+                # No results are available, only save the coordinates
+                self.create_netcdf_results(
+                    dataset, dimensions, float, (),
+                    [1] * split + shape[split:] + [runs], compression_level)
+        result_parsing_function.save()
+
+    @staticmethod
+    def create_netcdf_results(dataset, dimensions, dtype, output_shape,
+                              chunk_shape, compression_level):
+        """
+        Create the variable containing the results in a NetCDF file.
+
+        If the results have more dimensions than those in dimensions (either
+        because no output_labels were specified, or because outputs are
+        arrays with more than one dimension), dimensions named output_0,
+        output_1 and so on are created.
+        """
+        dimensions = list(dimensions)
+        if (len(output_shape) < len(dimensions) - len(chunk_shape) or
+                any(len(dataset.dimensions[name]) != size for name, size in
+                    zip(dimensions[len(chunk_shape):], output_shape))):
+            raise ValueError("Outputs do not match output_labels")
+        for idx, size in enumerate(
+                output_shape[len(dimensions) - len(chunk_shape):]):
+            dimensions.append('output_%d' % idx)
+            dataset.createDimension(dimensions[-1], size)
+        chunk_shape = list(chunk_shape) + list(output_shape)
+        return create_netcdf_variable(
+            dataset, 'results', dtype, tuple(dimensions),
+            zlib=compression_level > 0, complevel=compression_level,
+            chunksizes=tuple(chunk_shape) if all(chunk_shape) else None,
+            fill_value=np.nan if np.dtype(dtype).kind == 'f' else None)
+
     def files_in_dictionary(result):
         """
         Parsing function that returns a dictionary containing one entry for
         each file. Typically used to perform parsing externally.
         """
-        return result['output']
+        return dict(result['output'])
 
     def get_space(self, current_result_list, current_query, param_space,
                   result_parsing_function,
@@ -835,16 +2198,13 @@ class CampaignManager(object):
             parsed = []
             for r in results[:runs]:
 
-                # Make results complete, by reading the output from file
-                # TODO Extract this into a function
-                r['output'] = {}
-                available_files = self.db.get_result_files(r['meta']['id'])
-                for name, filepath in available_files.items():
-                    if extract_complete_results:
-                        with open(filepath, 'r') as file_contents:
-                            r['output'][name] = file_contents.read()
-                    else:
-                        r['output'][name] = filepath
+                # Make results complete: output files are only read when the
+                # parsing function accesses them
+                if extract_complete_results:
+                    r = self.db.get_lazy_result(r)
+                else:
+                    r = dict(r, output=self.db.get_result_files(
+                        r['meta']['id']))
                 parsed.append(result_parsing_function(r))
                 del r
             del results
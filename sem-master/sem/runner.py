@@ -19,6 +19,11 @@ class SimulationRunner(object):
     system.
     """
 
+    # Layout of the folder in which simulation outputs are saved (see
+    # sem.utils.DATA_LAYOUTS). The CampaignManager sets this to the layout
+    # used by the campaign.
+    data_layout = 'flat'
+
     ##################
     # Initialization #
     ##################
@@ -312,21 +317,9 @@ class SimulationRunner(object):
 
         for _, parameter in enumerate(parameter_list):
 
-            current_result = {
-                'params': {},
-                'meta': {}
-                }
-            current_result['params'].update(parameter)
-
-            command = [self.script_executable] + ['--%s=%s' % (param, value)
-                                                  for param, value in
-                                                  parameter.items()]
-
-            # Run from dedicated temporary folder
-            sim_uuid = str(uuid.uuid4())
-            current_result['meta']['id'] = sim_uuid
-            temp_dir = os.path.join(data_folder, current_result['meta']['id'])
-            os.makedirs(temp_dir)
+            current_result, command, temp_dir = self.prepare_simulation(
+                parameter, data_folder)
+            sim_uuid = current_result['meta']['id']
 
             start = time.time()  # Time execution
             stdout_file_path = os.path.join(temp_dir, 'stdout')
@@ -348,31 +341,8 @@ class SimulationRunner(object):
                 for cb in callbacks:
                     cb.on_run_end(sim_uuid, return_code, end - start)
 
-            if return_code != 0:
-
-                with open(stdout_file_path, 'r') as stdout_file, open(
-                        stderr_file_path, 'r') as stderr_file:
-                    complete_command = sem.utils.get_command_from_result(self.script, current_result)
-                    complete_command_debug = sem.utils.get_command_from_result(self.script, current_result, debug=True)
-                    error_message = ('\nSimulation exited with an error.\n'
-                                     'Params: %s\n'
-                                     'Stderr: %s\n'
-                                     'Stdout: %s\n'
-                                     'Use this command to reproduce:\n'
-                                     '%s\n'
-                                     'Debug with gdb:\n'
-                                     '%s'
-                                     % (parameter,
-                                        stderr_file.read(),
-                                        stdout_file.read(),
-                                        complete_command,
-                                        complete_command_debug))
-                    if stop_on_errors:
-                        raise Exception(error_message)
-                    print(error_message) 
-
-            current_result['meta']['elapsed_time'] = end-start
-            current_result['meta']['exitcode'] = return_code
+            self.finalize_simulation(current_result, temp_dir, return_code,
+                                     end - start, stop_on_errors)
 
             yield current_result
         
@@ -381,3 +351,72 @@ class SimulationRunner(object):
             for cb in callbacks:
                 if not cb.is_controlled_by_parent():
                     cb.on_simulation_end()
+
+    def prepare_simulation(self, parameter, data_folder):
+        """
+        Create the output folder of a simulation, and return its result
+        skeleton, the command running it and the path of the folder.
+
+        Args:
+            parameter (dict): the parameter combination to simulate.
+            data_folder (str): folder in which to create the output folder.
+        """
+        current_result = {
+            'params': {},
+            'meta': {}
+            }
+        current_result['params'].update(parameter)
+
+        command = [self.script_executable] + ['--%s=%s' % (param, value)
+                                              for param, value in
+                                              parameter.items()]
+
+        # Run from dedicated temporary folder
+        current_result['meta']['id'] = str(uuid.uuid4())
+        temp_dir = sem.utils.get_result_dir(data_folder,
+                                            current_result['meta']['id'],
+                                            self.data_layout)
+        os.makedirs(temp_dir)
+
+        return current_result, command, temp_dir
+
+    def finalize_simulation(self, current_result, temp_dir, return_code,
+                            elapsed_time, stop_on_errors):
+        """
+        Complete the result of a simulation that just ended, reporting any
+        error.
+
+        Args:
+            current_result (dict): the result, as returned by
+                prepare_simulation.
+            temp_dir (str): the output folder of the simulation.
+            return_code (int): the exit code of the simulation.
+            elapsed_time (float): the duration of the simulation, in seconds.
+            stop_on_errors (bool): whether to raise an exception, instead of
+                printing a message, if the simulation exited with an error.
+        """
+        if return_code != 0:
+
+            with open(os.path.join(temp_dir, 'stdout'), 'r') as stdout_file, open(
+                    os.path.join(temp_dir, 'stderr'), 'r') as stderr_file:
+                complete_command = sem.utils.get_command_from_result(self.script, current_result)
+                complete_command_debug = sem.utils.get_command_from_result(self.script, current_result, debug=True)
+                error_message = ('\nSimulation exited with an error.\n'
+                                 'Params: %s\n'
+                                 'Stderr: %s\n'
+                                 'Stdout: %s\n'
+                                 'Use this command to reproduce:\n'
+                                 '%s\n'
+                                 'Debug with gdb:\n'
+                                 '%s'
+                                 % (current_result['params'],
+                                    stderr_file.read(),
+                                    stdout_file.read(),
+                                    complete_command,
+                                    complete_command_debug))
+                if stop_on_errors:
+                    raise Exception(error_message)
+                print(error_message)
+
+        current_result['meta']['elapsed_time'] = elapsed_time
+        current_result['meta']['exitcode'] = return_code
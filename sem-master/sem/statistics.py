@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import stats
+
+
+def add_to_statistics(statistics, params, output):
+    """
+    Update the running statistics of a parameter combination with the output
+    of a new result, using Welford's algorithm.
+
+    Statistics are dictionaries containing the parameter combination, the
+    number of outputs they aggregate, their mean and the sum of squared
+    differences from the mean (m2), and can be saved in the database as they
+    are. If statistics is None, new statistics are created.
+
+    Outputs can be numbers, or lists of numbers of the same shape: in this
+    case, statistics are computed element-wise. A ValueError is raised if
+    output cannot be aggregated with the previous outputs.
+    """
+    output = np.asarray(output, dtype=float)
+    if statistics is None:
+        return {'params': params, 'count': 1, 'mean': output.tolist(),
+                'm2': np.zeros_like(output).tolist()}
+    mean = np.asarray(statistics['mean'])
+    if mean.shape != output.shape:
+        raise ValueError("Outputs of different shapes cannot be aggregated")
+    count = statistics['count'] + 1
+    delta = output - mean
+    mean = mean + delta / count
+    m2 = np.asarray(statistics['m2']) + delta * (output - mean)
+    return dict(statistics, count=count, mean=mean.tolist(), m2=m2.tolist())
+
+
+def remove_from_statistics(statistics, output):
+    """
+    Remove the output of a result from the running statistics of a parameter
+    combination, reversing add_to_statistics.
+
+    Return None if no outputs are left.
+    """
+    output = np.asarray(output, dtype=float)
+    mean = np.asarray(statistics['mean'])
+    if mean.shape != output.shape:
+        raise ValueError("Outputs of different shapes cannot be aggregated")
+    if statistics['count'] <= 1:
+        return None
+    count = statistics['count'] - 1
+    new_mean = (mean * statistics['count'] - output) / count
+    # Rounding errors may make m2 slightly negative
+    m2 = np.maximum(np.asarray(statistics['m2']) -
+                    (output - mean) * (output - new_mean), 0)
+    return dict(statistics, count=count, mean=new_mean.tolist(),
+                m2=m2.tolist())
+
+
+def summarize_statistics(statistics, confidence=0.95):
+    """
+    Return a dictionary containing the parameter combination, the number of
+    aggregated outputs, and their mean, sample variance and the half-width
+    of the Student's t confidence interval of the mean, at the specified
+    confidence level.
+
+    Variance and confidence interval are NaN if only one output is available.
+    """
+    count = statistics['count']
+    mean = np.asarray(statistics['mean'])
+    if count > 1:
+        variance = np.asarray(statistics['m2']) / (count - 1)
+        ci = (stats.t.ppf((1 + confidence) / 2, count - 1) *
+              np.sqrt(variance / count))
+    else:
+        variance = ci = np.full_like(mean, np.nan)
+    return {'params': statistics['params'], 'count': count,
+            'mean': mean.tolist(), 'variance': variance.tolist(),
+            'ci': ci.tolist()}
+
+
+def check_relative_ci(summary, relative_ci, index=None):
+    """
+    Return True if the half-width of the confidence interval in the summary
+    of some statistics (see summarize_statistics) is at most relative_ci
+    times the absolute value of the mean.
+
+    If outputs are lists, only the element at the specified index is
+    checked, or all elements if index is None. Since the confidence interval
+    is not defined for a single output, False is returned in this case.
+    """
+    mean = np.atleast_1d(np.asarray(summary['mean'], dtype=float))
+    ci = np.atleast_1d(np.asarray(summary['ci'], dtype=float))
+    if index is not None:
+        mean = mean[index]
+        ci = ci[index]
+    # Comparisons with NaN are False
+    return bool(np.all(ci <= relative_ci * np.abs(mean)))
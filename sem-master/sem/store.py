@@ -0,0 +1,314 @@
+import io
+import os
+import gzip
+import mmap
+import shutil
+import collections
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Maximum size, in bytes, of a segment file. Once a segment reaches this size,
+# outputs are appended to a new one.
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+# Results whose output files are larger than this size, in bytes, in total,
+# are not packed in segments, and are left in their own directory instead.
+SPILL_SIZE = 1024 * 1024
+
+# Available compression algorithms for output files, and the suffix that is
+# appended to the name of compressed files. zstd requires the zstandard
+# package.
+COMPRESSION_SUFFIXES = collections.OrderedDict([('gzip', '.gz'),
+                                                ('zstd', '.zst')])
+
+# Suffix of files that are being compressed
+TEMPORARY_SUFFIX = '.sem-tmp'
+
+# Location of an output file inside a segment file, and the algorithm it is
+# compressed with, if any
+PackedFile = collections.namedtuple('PackedFile',
+                                    ['path', 'offset', 'size', 'compression'],
+                                    defaults=[None])
+
+
+def get_compression(filepath):
+    """
+    Return the algorithm an output file is compressed with, given its path or
+    its PackedFile locator, or None if it is not compressed.
+    """
+    if isinstance(filepath, PackedFile):
+        return filepath.compression
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if filepath.endswith(suffix):
+            return compression
+    return None
+
+
+def split_compressed_name(filename):
+    """
+    Return the name of an output file before compression, and the algorithm
+    it is compressed with.
+
+    Example:
+
+        >>> split_compressed_name('stdout.gz')
+        ('stdout', 'gzip')
+
+    """
+    compression = get_compression(filename)
+    if compression is None:
+        return filename, None
+    return filename[:-len(COMPRESSION_SUFFIXES[compression])], compression
+
+
+def check_compression(compression):
+    """
+    Raise an error if the specified compression algorithm is not available.
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unknown compression: %s" % compression)
+    if compression == 'zstd' and not ZSTD_AVAILABLE:
+        raise ImportError("zstd compression requires the zstandard package")
+
+
+def decompressing_reader(raw_file, compression):
+    """
+    Wrap a binary file object in a reader decompressing its contents as they
+    are read.
+    """
+    check_compression(compression)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw_file, mode='rb')
+    return zstandard.ZstdDecompressor().stream_reader(raw_file,
+                                                      closefd=True)
+
+
+class SegmentReader(io.RawIOBase):
+    """
+    Binary file object reading the slice of a segment file that contains a
+    packed output file, so that it can be read as a stream without loading
+    it in memory.
+    """
+
+    file = None
+
+    def __init__(self, path, offset, size):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.size = size
+        self.position = 0
+        self.file.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Never read past the end of the packed file
+        count = self.file.readinto(
+            memoryview(buffer)[:max(0, self.size - self.position)])
+        self.position += count
+        return count
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        if position < 0:
+            raise ValueError("Negative seek position %s" % position)
+        self.position = position
+        self.file.seek(self.offset + position)
+        return position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        io.RawIOBase.close(self)
+
+
+def open_output_stream(filepath):
+    """
+    Open an output file for reading, given its path or its PackedFile
+    locator, and return a binary file object. Compressed files are
+    decompressed as they are read.
+    """
+    if isinstance(filepath, PackedFile):
+        raw_file = io.BufferedReader(SegmentReader(filepath.path,
+                                                   filepath.offset,
+                                                   filepath.size))
+    else:
+        raw_file = open(filepath, 'rb')
+    compression = get_compression(filepath)
+    if compression is None:
+        return raw_file
+    stream = decompressing_reader(raw_file, compression)
+    if compression == 'gzip':
+        # GzipFile does not close file objects it did not open
+        stream.myfileobj = raw_file
+    return stream
+
+
+def compress_file(filepath, compression):
+    """
+    Compress an output file, replacing it with a file with the same name and
+    the compression suffix.
+    """
+    check_compression(compression)
+    destination = filepath + COMPRESSION_SUFFIXES[compression]
+    temporary = destination + TEMPORARY_SUFFIX
+    with open(filepath, 'rb') as source, open(temporary, 'wb') as raw_file:
+        if compression == 'gzip':
+            with gzip.GzipFile(fileobj=raw_file, mode='wb') as compressed:
+                shutil.copyfileobj(source, compressed)
+        else:
+            with zstandard.ZstdCompressor().stream_writer(
+                    raw_file, closefd=False) as compressed:
+                shutil.copyfileobj(source, compressed)
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
+    # The compressed file only appears once it is complete
+    os.replace(temporary, destination)
+    os.remove(filepath)
+
+
+def compress_result_dir(result_dir, compression):
+    """
+    Compress all the uncompressed output files in a result directory.
+    """
+    for entry in os.scandir(result_dir):
+        if (entry.is_file() and get_compression(entry.name) is None and
+                not entry.name.endswith(TEMPORARY_SUFFIX)):
+            compress_file(entry.path, compression)
+
+
+def open_output_file(filepath, use_mmap=False):
+    """
+    Return the contents of an output file as bytes, given either its path or
+    a PackedFile locator.
+
+    If use_mmap is True, the file is memory-mapped instead, and a read-only
+    bytes-like object (an mmap object, or a memoryview of one for packed
+    files) is returned. Compressed files cannot be memory-mapped, and their
+    decompressed contents are returned instead.
+    """
+    if get_compression(filepath) is not None:
+        with open_output_stream(filepath) as stream:
+            return stream.read()
+    if isinstance(filepath, PackedFile):
+        path, offset, size, _ = filepath
+    else:
+        path, offset, size = filepath, 0, os.path.getsize(filepath)
+    if not size:
+        # Empty files cannot be memory-mapped
+        return b''
+    with open(path, 'rb') as output_file:
+        if not use_mmap:
+            output_file.seek(offset)
+            return output_file.read(size)
+        if not isinstance(filepath, PackedFile):
+            return mmap.mmap(output_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Mappings need to start at a multiple of the allocation granularity
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        mapping = mmap.mmap(output_file.fileno(), offset + size - start,
+                            offset=start, access=mmap.ACCESS_READ)
+        return memoryview(mapping)[offset - start:]
+
+
+def copy_output_file(filepath, destination):
+    """
+    Copy an output file, given either its path or a PackedFile locator, to
+    the destination path, decompressing it if necessary.
+    """
+    with open_output_stream(filepath) as source, open(destination,
+                                                       'wb') as destination_file:
+        shutil.copyfileobj(source, destination_file)
+
+
+class SegmentStore(object):
+    """
+    Store packing the output files of many results in a few large segment
+    files, in order to avoid creating a directory and several files for each
+    result.
+
+    Segments are only ever appended to, and the location of each file is
+    returned by the pack method, to be saved in the database. Locations are
+    relative to the store directory, so that campaigns can be moved.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.segment = None
+
+    def get_segment_path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def get_packed_file(self, location, compression=None):
+        """
+        Convert a location returned by pack to a PackedFile locator.
+        """
+        name, offset, size = location
+        return PackedFile(self.get_segment_path(name), offset, size,
+                          compression)
+
+    def open_segment(self):
+        """
+        Open the last segment for appending, or a new one if it is full.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        names = sorted(f for f in os.listdir(self.store_dir) if
+                       f.endswith('.seg'))
+        if (not names or os.path.getsize(self.get_segment_path(names[-1])) >=
+                SEGMENT_SIZE):
+            names.append('%08d.seg' % (int(names[-1][:-4]) + 1 if names else
+                                       0))
+        self.segment_name = names[-1]
+        self.segment = open(self.get_segment_path(self.segment_name), 'ab')
+
+    def pack(self, result_dir):
+        """
+        Append the files in result_dir to the current segment, and return a
+        dictionary of filename: [segment, offset, size] entries.
+
+        Return None, without packing anything, if the directory contains
+        subdirectories or if its files exceed SPILL_SIZE.
+        """
+        entries = list(os.scandir(result_dir))
+        if (any(not entry.is_file() for entry in entries) or
+                sum(entry.stat().st_size for entry in entries) > SPILL_SIZE):
+            return None
+
+        if self.segment is None or self.segment.tell() >= SEGMENT_SIZE:
+            self.close()
+            self.open_segment()
+
+        locations = {}
+        for entry in entries:
+            with open(entry.path, 'rb') as output_file:
+                contents = output_file.read()
+            locations[entry.name] = [self.segment_name, self.segment.tell(),
+                                     len(contents)]
+            self.segment.write(contents)
+        return locations
+
+    def sync(self):
+        """
+        Make sure packed outputs are written to disk.
+        """
+        if self.segment is not None:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
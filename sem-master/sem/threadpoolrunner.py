@@ -0,0 +1,70 @@
+from .runner import SimulationRunner
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+# As in ParallelRunner, simulations are launched from threads: each of them
+# waits for an ns-3 process, and callbacks can be shared among them.
+
+
+class ThreadPoolRunner(SimulationRunner):
+    """
+    Base class of the Runners which perform simulations in parallel on the
+    current machine, deciding which simulation to start each time one ends.
+    """
+
+    def run_in_threads(self, next_simulation, data_folder, callbacks,
+                       stop_on_errors):
+        """
+        Run simulations on a pool of max_parallel_processes threads (or as
+        many as the available CPUs, if it is None), yielding (key, result)
+        pairs as simulations end.
+
+        Each time a thread is free, next_simulation is called, and must
+        return a (key, parameter combination) pair describing the next
+        simulation to start, or None if no simulation can be started until
+        a running one ends. Iteration stops when no simulation is running,
+        and next_simulation returns None. If it is interrupted, simulations
+        that were not started yet are cancelled.
+
+        Args:
+            next_simulation (function): function returning the next
+                simulation to start.
+            data_folder (str): folder in which to create output folders.
+            callbacks (list): list of callbacks to be triggered
+            stop_on_errors (bool): check whether simulation has to stop on errors or not
+        """
+        max_workers = self.max_parallel_processes or os.cpu_count()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        running = {}
+        try:
+            while True:
+                # Keep all workers busy
+                while len(running) < max_workers:
+                    simulation = next_simulation()
+                    if simulation is None:
+                        break
+                    key, parameter = simulation
+                    running[executor.submit(
+                        self.launch_simulation, parameter, data_folder,
+                        callbacks, stop_on_errors)] = key
+                if not running:
+                    break
+
+                # Sleep until a simulation ends
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield running.pop(future), future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def launch_simulation(self, parameter, data_folder, callbacks,
+                          stop_on_errors):
+        """
+        Launch a single simulation, using SimulationRunner's facilities.
+
+        Args:
+            parameter (dict): the parameter combination to simulate.
+        """
+        return next(SimulationRunner.run_simulations(self, [parameter],
+                                                     data_folder,
+                                                     callbacks=callbacks,
+                                                     stop_on_errors=stop_on_errors))
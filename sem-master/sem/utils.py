@@ -1,4 +1,6 @@
 import io
+import os
+import json
 import math
 import copy
 import warnings
@@ -67,38 +69,221 @@ def list_param_combinations(param_ranges):
         >>> list_param_combinations(param_ranges)
         [{'a': 1, 'b': 2}, {'a': 1, 'b': 3}]
 
+    See iter_param_combinations for a version of this function that does not
+    keep all combinations in memory.
+    """
+    return list(iter_param_combinations(param_ranges))
+
+
+def iter_param_combinations(param_ranges):
+    """
+    Yield all parameter combinations from a dictionary specifying desired
+    parameter values as lists, one at a time and in the same order as
+    list_param_combinations.
+
+    Combinations are generated as they are needed, so that very large sweeps
+    can be iterated over without creating all combinations in advance.
+
+    Values can also be functions, that are called with each combination of
+    the other parameters, and return the value (or list of values) to use for
+    their parameter. Functions are called in the order their parameters
+    appear in param_ranges, so that a function can depend on the values
+    returned by the previous ones.
+
+    Example:
+
+        >>> param_ranges = {'a': [1, 2], 'b': lambda p: [p['a'], 10 * p['a']]}
+        >>> list(iter_param_combinations(param_ranges))
+        [{'a': 1, 'b': 1}, {'a': 1, 'b': 10}, {'a': 2, 'b': 2}, {'a': 2, 'b': 20}]
+
+    Finally, param_ranges can contain Constraint objects, under any key that
+    is not a parameter, to only yield the combinations satisfying them (see
+    the Constraint class).
     """
-    param_ranges_copy = copy.deepcopy(param_ranges)
     # If we are passed a list, we want to expand each nested specification
-    if isinstance(param_ranges_copy, list):
-        return sum([list_param_combinations(x) for x in param_ranges_copy], [])
-    # If it's a dictionary, we need to make sure lists with 1 item are reduced
-    # to the item itself.
-    if isinstance(param_ranges_copy, dict):
-        # Convert non-list values to single-element lists
-        for key, value in param_ranges_copy.items():
-            if isinstance(value, list) and len(value) == 1:
-                param_ranges_copy[key] = value[0]
-    # If it's a dictionary and all items are lists, we need to expand it
-    if isinstance(param_ranges_copy, dict):
-        for key, value in param_ranges_copy.items():
-            if isinstance(value, list):
-                # Expand all values that are not functions
-                new_dictionaries = []
-                for v in value:
-                    c = copy.deepcopy(param_ranges_copy)
-                    c[key] = [v]
-                    new_dictionaries += [c]
-                # Iterate again to check
-                return list_param_combinations(new_dictionaries)
-    # If we get to this point, we have a dictionary and all items have length 1
-    # Now it's time to expand the functions.
-    if isinstance(param_ranges_copy, dict):
-        for key, value in param_ranges_copy.items():
-            if callable(value):
-                param_ranges_copy[key] = value(param_ranges_copy)
-                return list_param_combinations(param_ranges_copy)
-    return [param_ranges_copy]
+    if isinstance(param_ranges, list):
+        for specification in param_ranges:
+            yield from iter_param_combinations(specification)
+        return
+    if not isinstance(param_ranges, dict):
+        yield copy.deepcopy(param_ranges)
+        return
+
+    keys = [k for k, v in param_ranges.items() if not isinstance(v,
+                                                                 Constraint)]
+    constraints = [v for v in param_ranges.values() if isinstance(v,
+                                                                  Constraint)]
+    if constraints:
+        # Expand functions last, as in expand_param_functions
+        dimensions = ([k for k in keys if not callable(param_ranges[k])] +
+                      [k for k in keys if callable(param_ranges[k])])
+        yield from expand_constrained_params(param_ranges, keys, dimensions,
+                                             {}, constraints)
+        return
+
+    # Functions are only expanded once all other values are fixed
+    ranges = [[value] if callable(value) else flatten_param_values(value) for
+              value in param_ranges.values()]
+    for values in product(*ranges):
+        yield from expand_param_functions(dict(zip(keys, values)))
+
+
+class Constraint(object):
+    """
+    Condition that parameter combinations must satisfy, to be included in a
+    parameter specification.
+
+    The function passed to the constructor is called with a dictionary
+    containing the parameter values of a combination, and returns whether the
+    combination is valid. Constraints are checked while the specification is
+    expanded, as soon as the parameters they use have a value: this way,
+    invalid combinations of the first parameters are discarded without
+    expanding the following ones. Constraints can thus use any parameter of
+    the specification, including the ones whose values are functions, but
+    must not catch the KeyError raised when accessing parameters that do not
+    have a value yet.
+
+    Example:
+
+        >>> param_ranges = {'a': [1, 2, 3], 'b': [1, 2, 3],
+        ...                 'small_product': Constraint(
+        ...                     lambda p: p['a'] * p['b'] <= 2)}
+        >>> list(iter_param_combinations(param_ranges))
+        [{'a': 1, 'b': 1}, {'a': 1, 'b': 2}, {'a': 2, 'b': 1}]
+
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def check(self, params):
+        return self.function(params)
+
+    def __repr__(self):
+        return 'Constraint(%r)' % self.function
+
+
+def expand_constrained_params(param_ranges, keys, dimensions, assigned,
+                              pending):
+    """
+    Yield the combinations of a parameter specification containing
+    constraints, depth first, given the values assigned to the first
+    dimensions and the constraints that could not be checked yet.
+    """
+    # Check the constraints that only use parameters with a value
+    still_pending = []
+    for constraint in pending:
+        try:
+            if not constraint.check(assigned):
+                return
+        except KeyError:
+            if len(assigned) == len(dimensions):
+                raise
+            still_pending.append(constraint)
+
+    if len(assigned) == len(dimensions):
+        # Make sure combinations do not share mutable values
+        yield {k: assigned[k] if isinstance(assigned[k], PARAM_VALUE_TYPES)
+               else copy.deepcopy(assigned[k]) for k in keys}
+        return
+
+    key = dimensions[len(assigned)]
+    value = param_ranges[key]
+    if callable(value):
+        # Functions see the functions that were not called yet as they are
+        value = value({k: assigned.get(k, param_ranges[k]) for k in keys})
+    for v in flatten_param_values(value):
+        assigned[key] = v
+        yield from expand_constrained_params(param_ranges, keys, dimensions,
+                                             assigned, still_pending)
+        del assigned[key]
+
+
+def flatten_param_values(value):
+    """
+    Return the list of values a parameter can take, given its specification:
+    lists (possibly nested) are flattened, and other values are treated as a
+    single-element list.
+    """
+    if not isinstance(value, list):
+        return [value]
+    return [v for item in value for v in flatten_param_values(item)]
+
+
+def expand_param_functions(combination):
+    """
+    Yield the combinations obtained by calling the functions appearing as
+    values in a parameter combination, in order.
+    """
+    for key, value in combination.items():
+        if callable(value):
+            for v in flatten_param_values(value(combination)):
+                expanded = dict(combination)
+                expanded[key] = v
+                yield from expand_param_functions(expanded)
+            return
+    # Make sure combinations do not share mutable values
+    yield {k: v if isinstance(v, PARAM_VALUE_TYPES) else copy.deepcopy(v) for
+           k, v in combination.items()}
+
+
+# Immutable types of parameter values, which can be shared by different
+# parameter combinations without being copied
+PARAM_VALUE_TYPES = (str, bytes, bool, int, float, type(None))
+
+
+def get_combination_key(params, exclude=('RngRun',)):
+    """
+    Return a hashable key identifying a parameter combination.
+
+    Parameters listed in exclude are not part of the key, so that by default
+    all the runs of a parameter combination share the same key. Keys do not
+    depend on the order of the parameters.
+
+    Example:
+
+        >>> get_combination_key({'b': 2, 'a': 1, 'RngRun': 0})
+        (('a', 1), ('b', 2))
+
+    """
+    return tuple(sorted((k, get_hashable_value(v)) for k, v in params.items()
+                        if k not in exclude))
+
+
+def get_hashable_value(value):
+    """
+    Return a hashable version of a parameter value: lists and dictionaries are
+    converted to their JSON encoding, while other values are left as they are.
+    """
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+# Available layouts of the data folder of a campaign. In the flat layout,
+# the output of each result is saved in data/<id>. In the sharded layout, it
+# is saved in data/<first two characters of id>/<next two characters>/<id>,
+# so that no directory contains too many entries.
+DATA_LAYOUTS = ['flat', 'sharded']
+
+
+def get_result_dir(data_folder, result_id, data_layout='flat'):
+    """
+    Return the folder containing the output of a result, according to the
+    layout of the data folder.
+
+    Example:
+
+        >>> get_result_dir('data', 'abcdef', 'sharded')
+        'data/ab/cd/abcdef'
+
+    """
+    if data_layout == 'flat':
+        return os.path.join(data_folder, result_id)
+    elif data_layout == 'sharded':
+        return os.path.join(data_folder, result_id[0:2], result_id[2:4],
+                            result_id)
+    raise ValueError("Unknown data layout: %s" % data_layout)
 
 
 def get_command_from_result(script, result, debug=False):
@@ -0,0 +1,72 @@
+import functools
+
+import sem
+from sem import cache
+from sem.cache import ResultCache, get_function_fingerprint
+
+
+THRESHOLD = 10
+
+
+def parse(result):
+    return [float(result['output']['stdout']) > THRESHOLD]
+
+
+def test_function_fingerprint(monkeypatch):
+    fingerprint = get_function_fingerprint(parse)
+    assert get_function_fingerprint(parse) == fingerprint
+
+    # Options and referenced globals are part of the fingerprint
+    assert get_function_fingerprint(parse, option=True) != fingerprint
+    monkeypatch.setitem(parse.__globals__, 'THRESHOLD', 20)
+    assert get_function_fingerprint(parse) != fingerprint
+
+    # So are decorator attributes
+    assert (get_function_fingerprint(sem.utils.output_labels(['a'])(parse)) !=
+            get_function_fingerprint(sem.utils.output_labels(['b'])(parse)))
+
+    # So are closures and partial arguments
+    def make_parser(threshold):
+        def parser(result):
+            return [float(result['output']['stdout']) > threshold]
+        return parser
+    assert (get_function_fingerprint(make_parser(1)) ==
+            get_function_fingerprint(make_parser(1)))
+    assert (get_function_fingerprint(make_parser(1)) !=
+            get_function_fingerprint(make_parser(2)))
+
+    def parser(result, threshold):
+        return [float(result['output']['stdout']) > threshold]
+    assert (get_function_fingerprint(functools.partial(parser, threshold=1)) !=
+            get_function_fingerprint(functools.partial(parser, threshold=2)))
+
+
+def test_result_cache(tmpdir, monkeypatch):
+    result_cache = ResultCache(str(tmpdir.join('.cache')))
+    result_cache.set_outputs('a', {'1': [1, 2], '2': [3, 4]})
+    result_cache.set_outputs('b', {'1': [5, 6]})
+    assert result_cache.get_outputs('a', ['1', '2', '3']) == {'1': [1, 2],
+                                                             '2': [3, 4]}
+    assert result_cache.get_outputs('b', ['1', '2']) == {'1': [5, 6]}
+
+    # Outputs are persistent
+    result_cache.close()
+    result_cache = ResultCache(str(tmpdir.join('.cache')))
+    assert result_cache.get_outputs('a', ['2']) == {'2': [3, 4]}
+
+    result_cache.remove_results(['1'])
+    assert result_cache.get_outputs('a', ['1', '2']) == {'2': [3, 4]}
+    assert result_cache.get_outputs('b', ['1', '2']) == {}
+
+    # The least recently used outputs are evicted first
+    monkeypatch.setattr(cache, 'CACHE_SIZE', 1000)
+    result_cache.set_outputs('c', {str(i): 'x' * 300 for i in range(3)})
+    assert result_cache.get_outputs('c', ['0', '1', '2']).keys() == {
+        '0', '1', '2'}
+    assert result_cache.get_outputs('a', ['2']) == {'2': [3, 4]}
+    result_cache.set_outputs('c', {'3': 'x' * 300})
+    assert result_cache.get_outputs('c', ['0', '1', '2', '3']).keys() == {
+        '1', '2', '3'}
+
+    result_cache.clear()
+    assert result_cache.get_outputs('c', ['1', '2', '3']) == {}
@@ -1,6 +1,7 @@
 import sem
 # For testing the command line we leverage click facilities
 from click.testing import CliRunner
+import os
 import re
 import pytest
 
@@ -186,3 +187,32 @@ def test_cli_workflow(tmpdir, ns_3_compiled, config):
                                 'output.fake_format'],
                       input="\n\n1\n",
                       catch_exceptions=False)
+
+
+def test_cli_export_table(tmpdir, config):
+    pq = pytest.importorskip('pyarrow.parquet')
+    db = sem.DatabaseManager.new(**config)
+    for runIdx in range(3):
+        result_id = str(runIdx)
+        os.makedirs(db.get_result_dir(result_id))
+        for name, contents in [('stdout', '%s 2\n' % runIdx),
+                               ('stderr', '')]:
+            with open(os.path.join(db.get_result_dir(result_id), name),
+                      'w') as output_file:
+                output_file.write(contents)
+        db.insert_result({'params': {'dict': 'words', 'time': False,
+                                     'RngRun': runIdx},
+                          'meta': {'elapsed_time': 1, 'id': result_id}})
+    db.write_to_disk()
+    db.close()
+
+    # Outputs are parsed, unless parsing is disabled
+    runner = CliRunner()
+    filename = str(tmpdir.join('results.parquet'))
+    for options, stdout in [([], [[0, 2], [1, 2], [2, 2]]),
+                            (['--do-not-try-parsing'],
+                             ['0 2\n', '1 2\n', '2 2\n'])]:
+        runner.invoke(sem.cli, ['export', '--results-dir=%s' %
+                                config['campaign_dir']] + options +
+                      [filename], input="\n\n3\n", catch_exceptions=False)
+        assert pq.read_table(filename).column('stdout').to_pylist() == stdout
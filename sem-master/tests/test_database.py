@@ -1,8 +1,14 @@
+import sem
 from sem import DatabaseManager
+from sem.database import RngRunAllocator
+from sem.statistics import check_relative_ci
+from sem.backends import TinyDBBackend
 import pytest
 import os
 from copy import deepcopy
 import itertools
+import pickle
+import uuid
 
 
 ############
@@ -56,6 +62,96 @@ def test_db_loading(config, db, tmpdir):
         DatabaseManager.load(campaign_path)
 
 
+@pytest.mark.parametrize('backend_type', ['TinyDB', 'SQLite'])
+def test_db_backends(config, result, backend_type):
+    db = DatabaseManager.new(backend_type=backend_type, **config)
+    assert db.get_backend_type() == backend_type
+
+    for runIdx in range(10):
+        result['params']['RngRun'] = runIdx
+        result['meta']['id'] = str(runIdx)
+        db.insert_result(result)
+    db.write_to_disk()
+    db.close()
+
+    # The backend is detected when loading
+    db = DatabaseManager.load(config['campaign_dir'])
+    assert db.get_backend_type() == backend_type
+    del config['campaign_dir']
+    assert db.get_config() == config
+
+    # Results are returned as they were inserted, in insertion order
+    results = db.get_results()
+    assert [r['params']['RngRun'] for r in results] == list(range(10))
+    assert results[3]['params'] == dict(result['params'], RngRun=3)
+    assert list(db.iter_results()) == results
+    assert db.get_results(result_id='3') == [results[3]]
+    assert db.get_results({'RngRun': [2, 4], 'time': False}) == [results[2],
+                                                                results[4]]
+    assert db.get_results({'time': True}) == []
+
+    os.makedirs(os.path.join(db.get_data_dir(), '3'))
+    db.delete_result(results[3])
+    assert len(db.get_results()) == 9
+    assert db.get_results(result_id='3') == []
+
+    db.wipe_results()
+    assert db.get_results() == []
+
+
+def test_db_journal(config, result):
+    db = DatabaseManager.new(**config)
+    database_path = DatabaseManager.get_database_path(config['campaign_dir'],
+                                                      TinyDBBackend)
+    journal_path = database_path + '-journal'
+    snapshot = open(database_path).read()
+
+    for runIdx in range(5):
+        result['params']['RngRun'] = runIdx
+        result['meta']['id'] = str(runIdx)
+        db.insert_results([deepcopy(dict(result,
+                                         meta=dict(result['meta'], exitcode=0)))])
+    db.write_to_disk()
+
+    # New results are only appended to the journal
+    assert open(database_path).read() == snapshot
+    journal_length = len(open(journal_path).readlines())
+    assert len([line for line in open(journal_path)
+                if line.startswith('["insert_results"')]) == 5
+
+    # Loading replays the journal, and ignores incomplete operations
+    with open(journal_path, 'a') as journal:
+        journal.write('["insert_results", [[{"par')
+    journal_contents = open(journal_path).read()
+    loaded = DatabaseManager.load(config['campaign_dir'])
+    assert loaded.get_results() == db.get_results()
+
+    # Files are left untouched until the database is modified
+    loaded.write_to_disk()
+    loaded.close()
+    assert open(journal_path).read() == journal_contents
+    assert open(database_path).read() == snapshot
+    loaded = DatabaseManager.load(config['campaign_dir'])
+    loaded.db.set_state('key', 'value')
+    loaded.write_to_disk()
+    assert len(open(journal_path).readlines()) == journal_length + 1
+    assert (DatabaseManager.load(config['campaign_dir']).db.get_state('key')
+            == 'value')
+
+    # Compaction moves the results to the JSON file
+    loaded.compact()
+    assert open(database_path).read() != snapshot
+    assert len(open(journal_path).readlines()) == 1
+    assert (DatabaseManager.load(config['campaign_dir']).get_results() ==
+            db.get_results())
+
+    # Stale journals are not replayed on top of newer snapshots
+    with open(journal_path, 'w') as journal:
+        journal.write('{"generation": 0}\n["drop_results", []]\n')
+    assert (DatabaseManager.load(config['campaign_dir']).get_results() ==
+            db.get_results())
+
+
 def test_db_does_not_delete_user_data(config, db, tmpdir):
     # Add a file to the test_campaign folder
     with open(
@@ -111,6 +207,59 @@ def test_get_next_rngruns(db, result):
     assert list(itertools.islice(db.get_next_rngruns(), 3)) == [1, 3, 4]
 
 
+def test_import_results(db, result):
+    # Results are imported without checking their format, and their RngRun
+    # values are marked as used
+    result['params']['RngRun'] = 1
+    result['meta'] = {'id': 'imported', 'elapsed_time': 1}
+    db.import_results([result])
+    assert db.get_results(result_id='imported')[0] == result
+    assert db.get_distinct_values('RngRun') == [1]
+    assert list(itertools.islice(db.get_next_rngruns(), 2)) == [0, 2]
+
+
+@pytest.mark.parametrize('backend_type', ['TinyDB', 'SQLite'])
+def test_reserve_rngruns(config, result, backend_type):
+    db = DatabaseManager.new(backend_type=backend_type, **config)
+    for run in [0, 1, 4]:
+        result['params']['RngRun'] = run
+        result['meta']['id'] = str(run)
+        db.insert_result(result)
+
+    # Reserved blocks are disjoint, and skip used values
+    assert db.reserve_rngruns(2) == [2, 3]
+    assert db.reserve_rngruns(3) == [5, 6, 7]
+    assert next(db.get_next_rngruns()) == 8
+
+    # The allocator is saved in the database
+    db.write_to_disk()
+    db.close()
+    db = DatabaseManager.load(config['campaign_dir'])
+    assert next(db.get_next_rngruns()) == 8
+
+    # Deleting the only result using a value frees it
+    os.makedirs(os.path.join(db.get_data_dir(), '1'))
+    db.delete_result(db.get_results(result_id='1')[0])
+    assert list(itertools.islice(db.get_next_rngruns(), 2)) == [1, 8]
+
+    # Wiping the results frees all values
+    db.wipe_results()
+    assert next(db.get_next_rngruns()) == 0
+
+
+def test_rngrun_allocator():
+    allocator = RngRunAllocator()
+    for value in [5, 2, 0, 9, 'not-a-number', 1.5]:
+        allocator.mark_used(value)
+    assert list(itertools.islice(allocator.get_free_values(), 8)) == [
+        1, 3, 4, 6, 7, 8, 10, 11]
+    allocator.mark_free(9)
+    allocator.mark_free(0)
+    assert allocator.to_dict() == {'next': 6, 'free': [[0, 2], [3, 5]]}
+    assert RngRunAllocator.from_dict(allocator.to_dict()).to_dict() == \
+        allocator.to_dict()
+
+
 def test_results(db, result):
     # Test insertion of valid result
     db.insert_result(result)
@@ -180,6 +329,105 @@ def test_results_queries(db, result):
                                                                           1))
 
 
+def test_results_indexes(config, db, result):
+    # Insert runs for two parameter combinations
+    for runIdx in range(10):
+        result['params']['RngRun'] = runIdx
+        result['params']['time'] = bool(runIdx % 2)
+        result['meta']['id'] = str(runIdx)
+        db.insert_result(result)
+    db.write_to_disk()
+
+    # Indexes are rebuilt when the database is loaded
+    db = DatabaseManager.load(config['campaign_dir'])
+    assert db.get_results(result_id='4')[0]['params']['RngRun'] == 4
+    assert [r['params']['RngRun'] for r in db.get_results(
+        {'dict': '/usr/share/dict/american-english', 'time': True})] == [
+            1, 3, 5, 7, 9]
+    assert [r['params']['RngRun'] for r in db.get_results(
+        {'dict': '/usr/share/dict/american-english', 'time': True,
+         'RngRun': [3, 4, 5]})] == [3, 5]
+
+    # Changing inserted or returned results does not alter the indexes
+    result['params']['RngRun'] = 10
+    result['meta']['id'] = '10'
+    result['meta']['exitcode'] = 0
+    db.insert_results([result])
+    result['params']['RngRun'] = 11
+    db.get_results(result_id='4')[0]['params']['RngRun'] = 11
+    assert db.get_results(result_id='4')[0]['params']['RngRun'] == 4
+    assert db.get_results(result_id='10')[0]['params']['RngRun'] == 10
+    db.delete_result(db.get_results(result_id='10')[0])
+
+    # Indexes are updated when results are removed
+    os.makedirs(os.path.join(db.get_data_dir(), '3'))
+    db.delete_result(db.get_results(result_id='3')[0])
+    assert db.get_results(result_id='3') == []
+    assert [r['params']['RngRun'] for r in db.get_results(
+        {'time': True})] == [1, 5, 7, 9]
+
+
+@pytest.mark.parametrize('backend_type', ['TinyDB', 'SQLite'])
+def test_get_grouped_results(config, result, backend_type):
+    db = DatabaseManager.new(backend_type=backend_type, **config)
+    for runIdx in range(6):
+        result['params']['RngRun'] = runIdx
+        result['params']['time'] = bool(runIdx % 2)
+        db.insert_result(result)
+
+    american = '/usr/share/dict/american-english'
+    queries = [{'dict': american, 'time': False},
+               {'dict': american, 'time': True, 'RngRun': 3},
+               {'dict': american, 'time': True, 'RngRun': 4},
+               {'time': [True, False], 'RngRun': [0, 1]},
+               {'dict': '/usr/share/dict/british-english', 'time': False}]
+    grouped = db.get_grouped_results(queries)
+    assert grouped == [db.get_results(q) for q in queries]
+    assert [[r['params']['RngRun'] for r in g] for g in grouped] == [
+        [0, 2, 4], [3], [], [0, 1], []]
+
+    # Lists of queries are answered with the same mechanism
+    assert db.get_results(queries) == sum(grouped, [])
+
+    # Each query is validated
+    with pytest.raises(ValueError):
+        db.get_grouped_results([{'dict': american}, {'non-existing': 0}])
+
+    # Failed queries do not prevent the following ones
+    if backend_type == 'SQLite':
+        with pytest.raises(OverflowError):
+            db.get_grouped_results([{'dict': american, 'time': False,
+                                     'RngRun': 2**64}])
+    assert db.get_grouped_results(queries) == grouped
+
+
+@pytest.mark.parametrize('backend_type', ['TinyDB', 'SQLite'])
+def test_get_grouped_results_without_params(config, backend_type):
+    config['params'] = {}
+    db = DatabaseManager.new(backend_type=backend_type, **config)
+    for runIdx in range(3):
+        db.insert_result({'params': {'RngRun': runIdx},
+                          'meta': {'elapsed_time': 1, 'id': str(runIdx)}})
+    grouped = db.get_grouped_results([{}, {'RngRun': 1}])
+    assert [[r['params']['RngRun'] for r in g] for g in grouped] == [
+        [0, 1, 2], [1]]
+
+
+@pytest.mark.parametrize('backend_type', ['TinyDB', 'SQLite'])
+def test_get_distinct_values(config, backend_type):
+    config['params'] = {'flag': False, 'values': [0]}
+    db = DatabaseManager.new(backend_type=backend_type, **config)
+    for runIdx, (flag, values) in enumerate([(False, [0]), (True, [0, 1]),
+                                             (False, [0, 1])]):
+        db.insert_result({'params': {'flag': flag, 'values': values,
+                                     'RngRun': runIdx},
+                          'meta': {'elapsed_time': 1, 'id': str(runIdx)}})
+    # Values are returned with their original types, in order of appearance
+    assert db.get_distinct_values('flag') == [False, True]
+    assert db.get_distinct_values('values') == [[0], [0, 1]]
+    assert db.get_distinct_values('RngRun') == [0, 1, 2]
+
+
 def test_get_complete_results(manager, parameter_combination):
     manager.run_simulations([parameter_combination], show_progress=False)
     assert manager.db.get_complete_results()[0].get('output').get('stdout') is not None
@@ -190,6 +438,38 @@ def test_get_complete_results(manager, parameter_combination):
         result_id=result_id)[0].get('output').get('stdout') is not None
 
 
+def test_iter_complete_results(db, result):
+    db.insert_result(result)
+    result_dir = os.path.join(db.get_data_dir(), result['meta']['id'])
+    os.makedirs(result_dir)
+    for name in ['stdout', 'stderr', 'output.txt']:
+        with open(os.path.join(result_dir, name), 'w') as output_file:
+            output_file.write('%s contents' % name)
+
+    results = list(db.iter_complete_results())
+    assert len(results) == 1
+    assert results[0]['params'] == result['params']
+    output = results[0]['output']
+    assert sorted(output) == ['output.txt', 'stderr', 'stdout']
+
+    # Files are only read when accessed
+    os.remove(os.path.join(result_dir, 'stderr'))
+    assert output['stdout'] == 'stdout contents'
+    with pytest.raises(FileNotFoundError):
+        output['stderr']
+
+    output = next(db.iter_complete_results(result_id=result['meta']['id'],
+                                           files_to_load=['output.txt'],
+                                           use_mmap=True))['output']
+    assert list(output) == ['output.txt']
+    assert output['output.txt'][:6] == b'output'
+    output = pickle.loads(pickle.dumps(output))
+    assert output['output.txt'][:] == b'output.txt contents'
+
+    assert db.get_complete_results()[0]['output'] == {
+        'stdout': 'stdout contents', 'output.txt': 'output.txt contents'}
+
+
 def test_get_result_files(manager, parameter_combination):
     manager.run_simulations([parameter_combination], show_progress=False)
     # Try querying result files via id
@@ -202,6 +482,234 @@ def test_get_result_files(manager, parameter_combination):
         manager.db.get_result_files(['stuff', 'other_stuff'])
 
 
+def test_data_layout(config, result):
+    db = DatabaseManager.new(data_layout='sharded', **config)
+    assert db.get_data_layout() == 'sharded'
+    result_ids = [str(uuid.uuid4()) for _ in range(5)]
+    for result_id in result_ids:
+        result['meta']['id'] = result_id
+        db.insert_result(result)
+        os.makedirs(db.get_result_dir(result_id))
+        with open(os.path.join(db.get_result_dir(result_id), 'stdout'),
+                  'w') as stdout:
+            stdout.write(result_id)
+    assert db.get_result_dir(result_ids[0]) == os.path.join(
+        db.get_data_dir(), result_ids[0][:2], result_ids[0][2:4],
+        result_ids[0])
+    assert db.get_result_files(result_ids[0]) == {
+        'stdout': os.path.join(db.get_result_dir(result_ids[0]), 'stdout')}
+
+    # The layout is saved in the configuration
+    db.close()
+    db = DatabaseManager.load(config['campaign_dir'])
+    assert db.get_data_layout() == 'sharded'
+
+    # Migrate to the flat layout
+    db.set_data_layout('flat')
+    assert sorted(os.listdir(db.get_data_dir())) == sorted(result_ids)
+    assert 'data_layout' not in DatabaseManager.load(
+        config['campaign_dir']).get_config()
+    for complete_result in db.get_complete_results():
+        assert (complete_result['output']['stdout'] ==
+                complete_result['meta']['id'])
+
+    db.set_data_layout('sharded')
+    db.delete_result(db.get_results(result_id=result_ids[0])[0])
+    assert not os.path.exists(db.get_result_dir(result_ids[0]))
+    db.wipe_results()
+    assert os.listdir(db.get_data_dir()) == []
+
+
+def test_output_store(config, result, monkeypatch):
+    monkeypatch.setattr(sem.store, 'SPILL_SIZE', 100)
+    db = DatabaseManager.new(output_store='segments', **config)
+    assert db.get_output_store() == 'segments'
+    contents = {}
+    for idx in range(5):
+        result['meta']['id'] = str(idx)
+        contents[str(idx)] = {'stdout': 'x' * idx * 10, 'stderr': ''}
+        if idx == 4:
+            # This result is too large to be packed
+            contents[str(idx)]['stdout'] = 'x' * 200
+        os.makedirs(db.get_result_dir(str(idx)))
+        for name, file_contents in contents[str(idx)].items():
+            with open(os.path.join(db.get_result_dir(str(idx)), name),
+                      'w') as output_file:
+                output_file.write(file_contents)
+        db.insert_results([deepcopy(dict(result,
+                                         meta=dict(result['meta'],
+                                                   exitcode=0)))])
+    db.write_to_disk()
+
+    # Only the result that was too large keeps its own directory
+    assert sorted(os.listdir(db.get_data_dir())) == ['4', 'segments']
+    assert 'files' in db.get_results(result_id='0')[0]
+    assert 'files' not in db.get_results(result_id='4')[0]
+
+    db.close()
+    db = DatabaseManager.load(config['campaign_dir'])
+    for complete_result in db.get_complete_results():
+        assert (complete_result['output'] ==
+                contents[complete_result['meta']['id']])
+    assert isinstance(db.get_result_files('1')['stdout'], sem.store.PackedFile)
+
+    # Locations can be sent to other processes, to list files there
+    for result_id in ['1', '4']:
+        location = pickle.loads(pickle.dumps(db.get_result_location(
+            db.get_results(result_id=result_id)[0])))
+        assert (sem.database.list_result_files(location) ==
+                db.get_result_files(result_id))
+    assert db.get_result_location('4') == db.get_result_dir('4')
+    assert next(db.iter_complete_results(result_id='3', use_mmap=True))[
+        'output']['stdout'] == b'x' * 30
+
+    # Packed files are streamed from their segment, up to their end
+    with sem.store.open_output_stream(
+            db.get_result_files('3')['stdout']) as stream:
+        assert stream.read(10) == b'x' * 10
+        assert stream.read() == b'x' * 20
+        assert stream.read() == b''
+        stream.seek(25)
+        assert stream.read(10) == b'x' * 5
+
+    db.delete_result(db.get_results(result_id='1')[0])
+    assert len(db.get_results()) == 4
+    db.wipe_results()
+    assert os.listdir(db.get_data_dir()) == []
+
+
+@pytest.mark.parametrize('compression', [
+    'gzip',
+    pytest.param('zstd', marks=pytest.mark.skipif(
+        not sem.store.ZSTD_AVAILABLE, reason='zstandard is not installed'))])
+@pytest.mark.parametrize('output_store', ['directories', 'segments'])
+def test_compression(config, result, compression, output_store):
+    db = DatabaseManager.new(output_store=output_store,
+                             compression=compression, **config)
+    assert db.get_compression() == compression
+    contents = {'stdout': 'line\n' * 100, 'stderr': '', 'output.bin':
+                '\u00e8'}
+    result_dir = db.get_result_dir(result['meta']['id'])
+    os.makedirs(result_dir)
+    for name, file_contents in contents.items():
+        with open(os.path.join(result_dir, name), 'w') as output_file:
+            output_file.write(file_contents)
+    result['meta']['exitcode'] = 0
+    db.insert_results([result])
+    db.write_to_disk()
+
+    # Files are listed and read under their original name
+    assert db.get_result_files(result).keys() == contents.keys()
+    complete_result = db.get_complete_results()[0]
+    assert complete_result['output'] == contents
+    lazy_result = next(db.iter_complete_results(use_mmap=True))
+    assert lazy_result['output']['stdout'] == contents['stdout'].encode()
+    with lazy_result['output'].open('stdout') as stdout:
+        assert next(stdout) == 'line\n'
+    if output_store == 'directories':
+        assert sorted(os.listdir(result_dir)) == sorted(
+            name + sem.store.COMPRESSION_SUFFIXES[compression] for name in
+            contents)
+
+
+def test_compress_results(config, result):
+    db = DatabaseManager.new(**config)
+    assert db.get_compression() is None
+    for idx in range(3):
+        result['meta']['id'] = str(idx)
+        os.makedirs(db.get_result_dir(str(idx)))
+        with open(os.path.join(db.get_result_dir(str(idx)), 'stdout'),
+                  'w') as stdout:
+            stdout.write('x' * idx)
+        db.insert_result(result)
+    # A file whose compression was interrupted is ignored
+    with open(os.path.join(db.get_result_dir('0'), 'stdout.gz.sem-tmp'),
+              'w') as stdout:
+        stdout.write('garbage')
+    db.compress_results('gzip', processes=2)
+    assert os.listdir(db.get_result_dir('1')) == ['stdout.gz']
+
+    db.close()
+    db = DatabaseManager.load(config['campaign_dir'])
+    assert db.get_compression() == 'gzip'
+    for complete_result in db.get_complete_results():
+        assert (complete_result['output'] ==
+                {'stdout': 'x' * int(complete_result['meta']['id'])})
+
+    with pytest.raises(ValueError):
+        db.compress_results('lzma')
+
+
+def test_insert_parsed_result(db, result):
+    result['parsed'] = {'function': 'fingerprint', 'output': {'a': [1, 2]}}
+    db.insert_result(result)
+    assert db.get_results()[0]['parsed'] == result['parsed']
+
+    result['parsed'] = {'output': [1, 2]}
+    with pytest.raises(ValueError):
+        db.insert_result(result)
+
+
+@pytest.mark.parametrize('backend_type', ['TinyDB', 'SQLite'])
+def test_statistics(config, result, backend_type):
+    db = DatabaseManager.new(backend_type=backend_type, **config)
+    outputs = {False: [[1, 10], [2, 20], [6, 30]], True: [[5, 0]]}
+    for time, time_outputs in outputs.items():
+        for run, output in enumerate(time_outputs):
+            result['params']['time'] = time
+            result['params']['RngRun'] = run
+            result['meta']['id'] = '%s-%s' % (time, run)
+            result['parsed'] = {'function': 'fingerprint', 'output': output}
+            db.insert_result(result)
+    # Outputs that are not numbers are not aggregated
+    result['meta']['id'] = 'text'
+    result['parsed'] = {'function': 'fingerprint', 'output': 'text'}
+    db.insert_result(result)
+
+    statistics = db.get_statistics('fingerprint', {'time': False})
+    assert len(statistics) == 1
+    assert statistics[0]['params'] == {
+        'dict': '/usr/share/dict/american-english', 'time': False}
+    assert statistics[0]['count'] == 3
+    assert statistics[0]['mean'] == pytest.approx([3, 20])
+    assert statistics[0]['variance'] == pytest.approx([7, 100])
+    assert statistics[0]['ci'] == pytest.approx([6.5724, 24.8414], 1e-4)
+    assert len(db.get_statistics('fingerprint')) == 2
+    assert db.get_statistics('other fingerprint') == []
+
+    # Statistics are updated as results are removed, and saved in the
+    # database
+    os.makedirs(os.path.join(db.get_data_dir(), 'False-2'))
+    db.delete_result(db.get_results(result_id='False-2')[0])
+    db.write_to_disk()
+    db.close()
+    db = DatabaseManager.load(config['campaign_dir'])
+    statistics = db.get_statistics('fingerprint', dict(config['params'],
+                                                       dict=result['params'][
+                                                           'dict']))
+    assert statistics[0]['count'] == 2
+    assert statistics[0]['mean'] == pytest.approx([1.5, 15])
+    assert statistics[0]['variance'] == pytest.approx([0.5, 50])
+
+    # Statistics can be rebuilt from the results
+    db.rebuild_statistics()
+    assert db.get_statistics('fingerprint', {'time': False}) == statistics
+
+    db.wipe_results()
+    assert db.get_statistics('fingerprint') == []
+
+
+def test_check_relative_ci():
+    summary = {'mean': [10, -1, 0], 'ci': [0.5, 0.5, 0]}
+    assert check_relative_ci(summary, 0.05, 0)
+    assert not check_relative_ci(summary, 0.05, 1)
+    assert check_relative_ci(summary, 0.05, 2)
+    assert not check_relative_ci(summary, 0.05)
+    assert check_relative_ci(summary, 0.5)
+    # The interval of a single output is not defined
+    assert not check_relative_ci({'mean': 1, 'ci': float('nan')}, 1)
+
+
 def test_have_same_structure():
     d1 = {'a': 1, 'b': 2}
     d2 = {'a': [], 'b': 3}
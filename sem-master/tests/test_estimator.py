@@ -0,0 +1,35 @@
+import pytest
+
+from sem.estimator import RuntimeEstimator
+
+
+def get_result(params, elapsed_time):
+    return {'params': dict(params, RngRun=0),
+            'meta': {'elapsed_time': elapsed_time}}
+
+
+def test_runtime_estimator():
+    # Runtimes grow with the square of nodes, and are three times longer in
+    # the slow mode
+    results = [get_result({'nodes': nodes, 'mode': mode, 'fixed': 1},
+                          nodes ** 2 * (3 if mode == 'slow' else 1))
+               for nodes in [10, 20, 40] for mode in ['fast', 'slow']]
+    estimator = RuntimeEstimator(results)
+    assert estimator.predict({'nodes': 80, 'mode': 'fast', 'fixed': 1}) == (
+        pytest.approx(6400, rel=0.05))
+    assert estimator.predict({'nodes': 80, 'mode': 'slow', 'fixed': 1}) == (
+        pytest.approx(19200, rel=0.05))
+
+    # Unknown values do not contribute to predictions
+    assert (estimator.predict({'nodes': 20, 'mode': 'fast', 'fixed': 1}) <
+            estimator.predict({'nodes': 20, 'mode': 'new', 'fixed': 1}) <
+            estimator.predict({'nodes': 20, 'mode': 'slow', 'fixed': 1}))
+    assert estimator.predict({'nodes': 'many', 'mode': 'fast'}) > 0
+
+    # Without variable parameters, the geometric mean is predicted
+    estimator = RuntimeEstimator([get_result({'nodes': 10}, 1),
+                                  get_result({'nodes': 10}, 4)])
+    assert estimator.predict({'nodes': 20}) == pytest.approx(2)
+
+    # Without results, nothing can be predicted
+    assert RuntimeEstimator().predict({'nodes': 10}) == float('Inf')
@@ -1,7 +1,9 @@
 import sem
+import asyncio
 import os
 import pytest
 import numpy as np
+import pandas as pd
 import shutil
 import git
 
@@ -101,6 +103,32 @@ def test_repo_on_wrong_commit(manager, config, ns_3_compiled,
         manager.run_simulations([parameter_combination])
 
 
+def test_get_missing_simulations(manager, result,
+                                 parameter_combination_no_rngrun,
+                                 parameter_combination_range):
+    # Two runs of the first combination are already available, and their
+    # average runtime is used as an estimate
+    manager.db.insert_result(result)
+    manager.db.insert_result(dict(result, params=dict(result['params'],
+                                                      RngRun=11),
+                                  meta=dict(result['meta'], id='2',
+                                            elapsed_time=20)))
+
+    missing = manager.get_missing_simulations(
+        sem.list_param_combinations(parameter_combination_range), 3,
+        with_time_estimate=True)
+    assert len(missing) == 1 + 3 * 3
+    assert missing[0] == [dict(parameter_combination_no_rngrun, RngRun=0),
+                          15.0]
+    # The runtime of other combinations is predicted
+    assert all(m[1] == pytest.approx(200 ** 0.5) for m in missing[1:])
+    assert manager.estimate_missing_runtime(
+        parameter_combination_range, 3) == pytest.approx(
+            15 + 9 * 200 ** 0.5)
+    # Each missing run gets a different RngRun value
+    assert len(set(m[0]['RngRun'] for m in missing)) == len(missing)
+
+
 def test_get_results_as_numpy_array(tmpdir, manager,
                                     parameter_combination_no_rngrun,
                                     parameter_combination,
@@ -122,6 +150,210 @@ def test_get_results_as_numpy_array(tmpdir, manager,
     assert(np.all(array[0, 0, 0] == sem.utils.constant_array_parser(None)))
 
 
+def test_save_to_netcdf_file(tmpdir, manager, parameter_combination_range,
+                             monkeypatch):
+    if not sem.manager.NETCDF_AVAILABLE:
+        pytest.skip("netCDF4 or h5netcdf is required")
+    import xarray as xr
+    manager.run_missing_simulations(parameter_combination_range, 2)
+    labels = ['a', 'b', 'c', 'd']
+    array = manager.get_results_as_xarray(parameter_combination_range,
+                                          sem.utils.constant_array_parser,
+                                          labels, 3)
+
+    # Save one combination per hyperslab
+    monkeypatch.setattr(sem.manager, 'HYPERSLAB_RESULTS', 3)
+    filename = str(tmpdir.join('results.nc'))
+    manager.save_to_netcdf_file(parameter_combination_range,
+                                sem.utils.constant_array_parser, labels,
+                                filename, 3)
+    with xr.open_dataarray(filename) as saved:
+        assert saved.dims == array.dims
+        assert saved.encoding['chunksizes'] == (1, 1, 3, 4)
+        assert list(saved.coords['time'].values) == [False, True]
+        assert np.all(saved.isel(runs=slice(0, 2)) == [0, 1, 2, 3])
+        assert np.all(np.isnan(saved.isel(runs=2)))
+        np.testing.assert_array_equal(saved.values, array.values)
+
+    # Outputs can be integers in some hyperslabs and floats in others
+    def mixed_parser(result):
+        if result['params']['dict'].endswith('american-english'):
+            return 0
+        return 0.5
+
+    manager.save_to_netcdf_file(parameter_combination_range, mixed_parser,
+                                'output', filename, 2)
+    with xr.open_dataarray(filename) as saved:
+        assert saved.dtype == float
+        assert np.all(saved.isel(dict=0) == 0)
+        assert np.all(saved.isel(dict=1) == 0.5)
+
+
+def test_get_missing_simulations_with_constraints(
+        manager, parameter_combination_range):
+    parameter_combination_range['no_time'] = sem.Constraint(
+        lambda p: not p['time'])
+    missing = manager.get_missing_simulations(parameter_combination_range, 2)
+    assert len(missing) == 4
+    assert not any(m['time'] for m in missing)
+
+
+def test_run_missing_simulations_in_windows(manager,
+                                            parameter_combination_range,
+                                            monkeypatch):
+    # The runtime estimator is trained once per call, and only if estimates
+    # are used by the runner or by the progress bar
+    fits = []
+    get_runtime_estimator = manager.get_runtime_estimator
+    monkeypatch.setattr(manager, 'get_runtime_estimator',
+                        lambda: fits.append(1) or get_runtime_estimator())
+    manager.run_missing_simulations(parameter_combination_range, 2, window=1)
+    assert len(manager.db.get_results()) == 8
+    assert len(fits) == 1
+    manager.run_missing_simulations(parameter_combination_range, 3, window=3,
+                                    show_progress=False)
+    assert len(manager.db.get_results()) == 12
+    assert len(fits) == 1
+
+
+def test_run_missing_simulations_async(manager, parameter_combination_range):
+    async def collect(runs):
+        return [result async for result in
+                manager.run_missing_simulations_async(
+                    parameter_combination_range, runs,
+                    result_parsing_function=sem.utils.constant_array_parser)]
+
+    # Results are yielded after being saved in the database
+    results = asyncio.run(collect(2))
+    assert len(results) == 8
+    assert all(r['parsed']['output'] == [0, 1, 2, 3] for r in results)
+    assert len(manager.db.get_results()) == 8
+
+    # Only missing simulations are run
+    assert len(asyncio.run(collect(3))) == 4
+    assert len(manager.db.get_results()) == 12
+
+
+def test_parse_on_ingest(manager, parameter_combination_range):
+    manager.run_missing_simulations(
+        parameter_combination_range, 2,
+        result_parsing_function=sem.utils.constant_array_parser)
+    results = manager.db.get_results()
+    assert len(results) == 8
+    assert all(r['parsed']['output'] == [0, 1, 2, 3] for r in results)
+
+    # Parsed outputs are used by the export functions
+    array = manager.get_results_as_numpy_array(
+        parameter_combination_range, sem.utils.constant_array_parser, 2)
+    assert(np.all(array == sem.utils.constant_array_parser(None)))
+
+    # So are their statistics
+    statistics = manager.get_statistics_as_dataframe(
+        sem.utils.constant_array_parser, columns=['a', 'b', 'c', 'd'],
+        params={'time': True})
+    assert len(statistics) == 2
+    assert list(statistics['count']) == [2, 2]
+    assert list(statistics['d_mean']) == [3, 3]
+    assert list(statistics['d_ci']) == [0, 0]
+
+
+def test_run_missing_simulations_to_precision(manager,
+                                             parameter_combination_range):
+    # Constant outputs converge as soon as the minimum number of runs is
+    # available
+    manager.run_missing_simulations_to_precision(
+        parameter_combination_range, sem.utils.constant_array_parser, 0.05,
+        metric=3, max_runs_in_flight=1)
+    assert len(manager.db.get_results()) == 12
+    statistics = manager.get_statistics(sem.utils.constant_array_parser)
+    assert [s['count'] for s in statistics] == [3, 3, 3, 3]
+
+    # Converged combinations are not run again
+    manager.run_missing_simulations_to_precision(
+        parameter_combination_range, sem.utils.constant_array_parser, 0.05)
+    assert len(manager.db.get_results()) == 12
+
+    with pytest.raises(ValueError):
+        manager.run_missing_simulations_to_precision(
+            parameter_combination_range, sem.utils.constant_array_parser,
+            0.05, metric='unknown')
+
+    # Runs whose output cannot be added to the statistics count towards
+    # max_runs, and are retried a few times if it is not specified
+    manager.run_missing_simulations_to_precision(
+        parameter_combination_range, text_parser, 0.05, max_runs=2,
+        max_runs_in_flight=1)
+    assert len(manager.db.get_results()) == 20
+    with pytest.raises(ValueError, match='were not added to the statistics'):
+        manager.run_missing_simulations_to_precision(
+            parameter_combination_range, text_parser, 0.05,
+            max_runs_in_flight=1)
+
+
+def text_parser(result):
+    return 'text'
+
+
+def test_parse_on_ingest_errors(manager, parameter_combination_range):
+    # Parsing functions that cannot be sent to worker processes make parsing
+    # fail, instead of hanging
+    with pytest.raises(Exception, match='Parsing failed for 4 results'):
+        manager.run_missing_simulations(
+            parameter_combination_range, 1,
+            result_parsing_function=lambda result: 0)
+    results = manager.db.get_results()
+    assert len(results) == 4
+    assert all('parsed' not in r for r in results)
+
+
+def test_parse_result_on_ingest():
+    result = {'params': {'a': 1}, 'meta': {'id': 'id'},
+              'output': {'stdout': ''}}
+    # Outputs are only saved if they are read back unchanged from the
+    # database, so that exports do not depend on when results were parsed
+    for output, saved in [([0, 1.5, True], True),
+                          ({'a': [None, 'b']}, True),
+                          ((0, 1), False),
+                          (np.array([0, 1]), False),
+                          ({0: 1}, False)]:
+        parsed, error = sem.manager.parse_result_on_ingest(
+            [result, False, lambda r: output, 'fingerprint'])
+        assert error is None
+        assert 'output' not in parsed
+        assert ('parsed' in parsed) == saved
+        if saved:
+            assert parsed['parsed'] == {'function': 'fingerprint',
+                                        'output': output}
+
+
+def test_group_results():
+    results = [{'params': {'a': a, 'b': b, 'RngRun': run},
+                'meta': {'id': '%s-%s-%s' % (a, b, run)}}
+               for a in [1, 2, 3] for b in [1, 2] for run in range(a)]
+    grouped = sem.manager.group_results(results, {'a': [1, 2, 3], 'b': 2},
+                                        runs=2)
+    assert {k: [r['meta']['id'] for r in v] for k, v in grouped.items()} == {
+        (0, 0): ['1-2-0'], (1, 0): ['2-2-0', '2-2-1'],
+        (2, 0): ['3-2-0', '3-2-1']}
+
+    # Missing runs are NaN, and integer outputs are converted to floats
+    outputs = {r['meta']['id']: [r['params']['a'], 0] for r in results}
+    data = sem.manager.fill_space_array([3, 1], grouped, outputs)
+    assert data.shape == (3, 1, 2, 2)
+    assert data.dtype == float
+    assert np.isnan(data[0, 0, 1]).all()
+    assert (data[2, 0, 1] == [3, 0]).all()
+    complete = {k: v for k, v in grouped.items() if k != (0, 0)}
+    assert sem.manager.fill_space_array([2, 1], {
+        (k[0] - 1, 0): v for k, v in complete.items()}, outputs).dtype == int
+
+    # Outputs with different shapes are saved in an array of objects
+    outputs['3-2-1'] = [1]
+    data = sem.manager.fill_space_array([3, 1], grouped, outputs)
+    assert data.shape == (3, 1, 2)
+    assert data[2, 0, 1] == [1]
+
+
 def test_save_to_mat_file(tmpdir, manager, result, parameter_combination):
     mat_file = str(tmpdir.join('results.mat'))
     manager.run_missing_simulations(parameter_combination)
@@ -139,6 +371,94 @@ def test_save_to_folders(tmpdir, manager, result, parameter_combination_range):
                             2)
 
 
+def test_iter_results_as_dataframes(tmpdir, manager,
+                                    parameter_combination_range):
+    manager.run_missing_simulations(parameter_combination_range, 3)
+
+    @sem.utils.output_labels(['Label'])
+    def parsing_function(result):
+        return [len(result['output']['stdout'])]
+
+    dataframe = manager.get_results_as_dataframe(parsing_function)
+    chunks = list(manager.iter_results_as_dataframes(parsing_function,
+                                                     chunk_size=5))
+    assert [len(chunk) for chunk in chunks] == [5, 5, 2]
+    assert pd.concat(chunks, ignore_index=True).equals(dataframe)
+    chunks = manager.iter_results_as_dataframes(parsing_function,
+                                                chunk_size=5,
+                                                parallel_parsing=True)
+    assert pd.concat(chunks, ignore_index=True).equals(dataframe)
+
+    folder = str(tmpdir.join('csv_export'))
+    manager.save_to_csv_files(folder, parsing_function, chunk_size=5,
+                              partition_by=['time'])
+    assert sorted(os.listdir(folder)) == ['time=False', 'time=True']
+    assert sum(len(pd.read_csv(os.path.join(folder, d, f))) for d in
+               os.listdir(folder) for f in
+               os.listdir(os.path.join(folder, d))) == 12
+
+
+def test_save_to_parquet_file(tmpdir, manager, parameter_combination_range):
+    pq = pytest.importorskip('pyarrow.parquet')
+    manager.run_missing_simulations(parameter_combination_range, 3)
+
+    @sem.utils.output_labels(['Label'])
+    def parsing_function(result):
+        return [len(result['output']['stdout'])]
+
+    dataframe = manager.get_results_as_dataframe(parsing_function)
+
+    filename = str(tmpdir.join('results.parquet'))
+    manager.save_to_parquet_file(filename, parsing_function, chunk_size=5)
+    assert pq.ParquetFile(filename).num_row_groups == 3
+    assert pq.read_table(filename).to_pandas().equals(dataframe)
+
+    folder = str(tmpdir.join('parquet_dataset'))
+    manager.save_to_parquet_file(folder, parsing_function, chunk_size=5,
+                                 partition_by=['time'])
+    assert sorted(os.listdir(folder)) == ['time=False', 'time=True']
+    assert pq.read_table(folder).num_rows == 12
+
+    filename = str(tmpdir.join('results.arrow'))
+    manager.save_to_arrow_file(filename, parsing_function, chunk_size=5)
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(filename) as reader:
+        assert reader.num_record_batches == 3
+        assert reader.read_all().to_pandas().equals(dataframe)
+
+
+def test_arrow_schema_backends(tmpdir, config):
+    pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+
+    @sem.utils.output_labels(['Label'])
+    def parsing_function(result):
+        return [len(result['output']['stdout'])]
+
+    # Both backends export the same parameter types
+    schemas = []
+    for backend_type in ['TinyDB', 'SQLite']:
+        config['campaign_dir'] = str(tmpdir.join(backend_type))
+        db = sem.DatabaseManager.new(backend_type=backend_type, **config)
+        for runIdx in range(4):
+            result_id = str(runIdx)
+            os.makedirs(db.get_result_dir(result_id))
+            with open(os.path.join(db.get_result_dir(result_id), 'stdout'),
+                      'w') as stdout:
+                stdout.write('x' * runIdx)
+            db.insert_result({'params': {'dict': 'words',
+                                         'time': bool(runIdx % 2),
+                                         'RngRun': runIdx},
+                              'meta': {'elapsed_time': 1, 'id': result_id}})
+        campaign = sem.CampaignManager(db, None, check_repo=False)
+        filename = str(tmpdir.join('%s.arrow' % backend_type))
+        campaign.save_to_arrow_file(filename, parsing_function, chunk_size=2)
+        with pyarrow.ipc.open_file(filename) as reader:
+            schemas.append(reader.schema)
+    assert schemas[0].field('time').type == pyarrow.bool_()
+    assert schemas[0].equals(schemas[1], check_metadata=False)
+
+
 def test_only_load_some_files_decorator(tmpdir, manager, result, parameter_combination_no_rngrun):
     def parsing_function(result):
         assert len(result['output'].keys()) == 2
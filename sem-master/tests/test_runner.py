@@ -1,5 +1,9 @@
-from sem import SimulationRunner, ParallelRunner
+from sem import SimulationRunner, ParallelRunner, LptRunner, AsyncRunner
+from sem.conditionalrunner import ConditionalRunner
+import asyncio
+import itertools
 import os
+import threading
 import pytest
 
 ###################
@@ -17,6 +21,12 @@ def runner(ns_3_compiled, ns_3_compiled_debug, config, request):
     elif request.param[0] == 'ParallelRunner':
         return ParallelRunner(ns_3_folder, config['script'],
                               optimized=request.param[1])
+    elif request.param[0] == 'LptRunner':
+        return LptRunner(ns_3_folder, config['script'],
+                         optimized=request.param[1])
+    elif request.param[0] == 'AsyncRunner':
+        return AsyncRunner(ns_3_folder, config['script'],
+                           optimized=request.param[1])
 
 
 def test_get_available_parameters(runner, config):
@@ -28,6 +38,8 @@ def test_get_available_parameters(runner, config):
                          [
                              ['SimulationRunner', True],
                              ['ParallelRunner', True],
+                             ['LptRunner', True],
+                             ['AsyncRunner', True],
                           ],
                          indirect=True)
 def test_run_simulations(runner, config,
@@ -37,6 +49,108 @@ def test_run_simulations(runner, config,
     list(runner.run_simulations([parameter_combination], data_dir))
 
 
+def test_async_runner_in_event_loop(ns_3_compiled, config,
+                                    parameter_combination):
+    # Runners can also be used from threads that run an event loop, like
+    # the ones of Jupyter notebooks
+    runner = AsyncRunner(ns_3_compiled, config['script'], optimized=True)
+    data_dir = os.path.join(config['campaign_dir'], 'data')
+
+    async def run():
+        return list(runner.run_simulations([parameter_combination],
+                                           data_dir))
+
+    assert len(asyncio.run(run())) == 1
+
+
+def test_lpt_runner_order(ns_3_compiled, config, monkeypatch):
+    runner = LptRunner(ns_3_compiled, config['script'], optimized=True,
+                       max_parallel_processes=1)
+    started = []
+
+    def launch_simulation(parameter, data_folder, callbacks, stop_on_errors):
+        started.append(parameter['time'])
+        return {'params': parameter, 'meta': {'elapsed_time': 1}}
+
+    monkeypatch.setattr(runner, 'launch_simulation', launch_simulation)
+    data_dir = os.path.join(config['campaign_dir'], 'data')
+    # Combinations with the longest estimate are run first, while
+    # combinations without an estimate take precedence
+    parameter_list = [[{'time': False, 'RngRun': 0}, 10],
+                      [{'time': True, 'RngRun': 0}, 20],
+                      [{'time': False, 'RngRun': 1}, 10],
+                      [{'time': 'unknown', 'RngRun': 0}, float('Inf')]]
+    assert len(list(runner.run_simulations(parameter_list, data_dir))) == 4
+    assert started == ['unknown', True, False, False]
+
+    # Measured runtimes replace estimates
+    started.clear()
+    list(runner.run_simulations([[{'time': True, 'RngRun': 1}, 20],
+                                 [{'time': 'new', 'RngRun': 0}, 5]],
+                                data_dir))
+    assert started == ['new', True]
+
+
+@pytest.mark.parametrize('max_runs_in_flight', [1, None])
+def test_conditional_runner(ns_3_compiled, config, monkeypatch,
+                            max_runs_in_flight):
+    runner = ConditionalRunner(ns_3_compiled, config['script'],
+                               optimized=True, max_parallel_processes=4,
+                               max_runs_in_flight=max_runs_in_flight)
+    # By default, the 4 processes are spread among the 2 combinations
+    cap = max_runs_in_flight or 2
+    lock = threading.Lock()
+    # Simulations only end once as many as allowed are running, so that the
+    # first ones overlap
+    overlapping = threading.Event()
+    in_flight = {}
+    max_in_flight = {}
+    collected = []
+    checked = []
+
+    def launch_simulation(parameter, data_folder, callbacks, stop_on_errors):
+        with lock:
+            in_flight[parameter['time']] = in_flight.get(
+                parameter['time'], 0) + 1
+            max_in_flight[parameter['time']] = max(
+                max_in_flight.get(parameter['time'], 0),
+                in_flight[parameter['time']])
+            if sum(in_flight.values()) == 2 * cap:
+                overlapping.set()
+        overlapping.wait(5)
+        with lock:
+            in_flight[parameter['time']] -= 1
+        return {'params': parameter, 'meta': {'elapsed_time': 1}}
+
+    def stopping_function(parameter):
+        checked.append(parameter['time'])
+        return len([r for r in collected if r['params']['time'] ==
+                    parameter['time']]) >= (3 if parameter['time'] else 2)
+
+    monkeypatch.setattr(runner, 'launch_simulation', launch_simulation)
+    runner.stopping_function = stopping_function
+    runner.next_runs = itertools.count()
+    data_dir = os.path.join(config['campaign_dir'], 'data')
+    for result in runner.run_simulations([{'time': False}, {'time': True}],
+                                         data_dir):
+        collected.append(result)
+
+    # Each combination is run until it converges, with at most cap runs at
+    # the same time, and thus at most cap - 1 surplus runs
+    assert overlapping.is_set()
+    assert max_in_flight == {False: cap, True: cap}
+    assert 2 <= len([r for r in collected if not r['params']['time']]) <= (
+        2 + cap - 1)
+    assert 3 <= len([r for r in collected if r['params']['time']]) <= (
+        3 + cap - 1)
+    assert sorted(r['params']['RngRun'] for r in collected) == list(
+        range(len(collected)))
+    if cap == 1:
+        # Combinations are only checked at the beginning and after each of
+        # their results
+        assert sorted(checked) == [False] * 3 + [True] * 4
+
+
 def test_scratch_script(ns_3_compiled, config):
     data_dir = os.path.join(config['campaign_dir'], 'data')
     runner = ParallelRunner(ns_3_compiled, 'scratch-simulator')
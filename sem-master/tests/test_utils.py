@@ -1,5 +1,6 @@
-from sem import list_param_combinations, automatic_parser, stdout_automatic_parser, CallbackBase, CampaignManager
+from sem import list_param_combinations, iter_param_combinations, Constraint, automatic_parser, stdout_automatic_parser, CallbackBase, CampaignManager
 import json
+import pytest
 import numpy as np
 from operator import getitem
 
@@ -77,6 +78,64 @@ def test_list_param_combinations():
                         {'a': 3, 'b': 1, 'c': 10}, {'a': 3, 'b': 2, 'c': 20}])))
 
 
+def test_iter_param_combinations():
+    # Combinations are yielded in order, the first parameter varying slowest
+    params = {'a': [1, 2], 'b': [3, [4, 5]], 'c': 'x'}
+    assert list(iter_param_combinations(params)) == [
+        {'a': 1, 'b': 3, 'c': 'x'}, {'a': 1, 'b': 4, 'c': 'x'},
+        {'a': 1, 'b': 5, 'c': 'x'}, {'a': 2, 'b': 3, 'c': 'x'},
+        {'a': 2, 'b': 4, 'c': 'x'}, {'a': 2, 'b': 5, 'c': 'x'}]
+    assert list(iter_param_combinations(params)) == list_param_combinations(
+        params)
+
+    # Functions see the values of all other parameters, and of the functions
+    # that come before them
+    params_with_lambdas = {
+        'b': lambda p: list(range(p['a'])),
+        'c': lambda p: [p['a'] + p['b']],
+        'a': [1, 3],
+    }
+    assert list(iter_param_combinations(params_with_lambdas)) == [
+        {'b': 0, 'c': 1, 'a': 1}, {'b': 0, 'c': 3, 'a': 3},
+        {'b': 1, 'c': 4, 'a': 3}, {'b': 2, 'c': 5, 'a': 3}]
+
+    # Combinations are generated lazily
+    combinations = iter_param_combinations({'a': list(range(10 ** 6)),
+                                            'b': list(range(10 ** 6))})
+    assert next(combinations) == {'a': 0, 'b': 0}
+
+    # Mutable values are not shared between combinations
+    first, second = iter_param_combinations({'a': [1, 2], 'b': ({'c': 1},)})
+    first['b'][0]['c'] = 2
+    assert second['b'][0]['c'] == 1
+
+
+def test_constraints():
+    checked = []
+
+    def first_is_small(p):
+        checked.append(p['a'])
+        return p['a'] < 2
+
+    params = {
+        'a': [1, 2, 3],
+        'b': [1, 2],
+        'c': lambda p: [p['a'] + p['b']],
+        'small_a': Constraint(first_is_small),
+        'small_c': Constraint(lambda p: p['c'] < 3),
+    }
+    assert list(iter_param_combinations(params)) == [
+        {'a': 1, 'b': 1, 'c': 2}]
+    # Constraints are checked as soon as possible, and prune the rest of the
+    # sweep
+    assert checked == [1, 2, 3]
+
+    # Constraints using parameters that are not specified raise an error
+    with pytest.raises(KeyError):
+        list_param_combinations({'a': [1, 2],
+                                 'b': Constraint(lambda p: p['d'] > 0)})
+
+
 def test_stdout_automatic_parser(result):
     # Create a dummy result
     result['output'] = {}